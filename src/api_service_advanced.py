@@ -1,18 +1,32 @@
-from fastapi import FastAPI, HTTPException, Header, WebSocket, WebSocketDisconnect, Depends
+from fastapi import FastAPI, HTTPException, Header, WebSocket, Depends, Request
+from fastapi.concurrency import run_in_threadpool
 import pandas as pd
-import joblib
+import numpy as np
 import os
+from concurrent.futures import TimeoutError as FutureTimeout
 from typing import List
-from prometheus_client import Counter, Summary, Gauge
+from prometheus_client import Counter, Summary, Gauge, multiprocess
 from prometheus_fastapi_instrumentator import Instrumentator
-import json
 from sqlalchemy.orm import Session
+from datetime import datetime
 
-from src.db import init_db, get_db, Feedback, PredictionLog
-from src.notify import send_slack_alert, create_grafana_annotation, send_pagerduty_incident
+from src.db import get_db, async_session, Feedback, PredictionLog
+from src.migrations import check_schema
+from src.notify import AlertDispatcher
+from src.micro_batcher import MicroBatcher
+from src.log_writer import WriteBehindWriter
+from src.model_store import (CURRENT_VERSION_FILE, MODEL_MMAP_MODE, ModelRegistry, get_current_version, load_model,
+                             load_anomaly_detector, compiled_model_path, model_path)
+from src.compiled_model import CompiledStackedModel
+from src.feature_engineering_advanced import add_anomaly_score
+from src.prediction_cache import PredictionCache, fingerprint
+from src.feedback_ingest import detect_format, ingest_feedback, insert_feedback, insert_feedback_async, validate_item
+from src.profiling import SamplingProfiler, stage_timer
+from src.broadcast_hub import BroadcastHub
 
 app = FastAPI()
-init_db()
+# Migrations are applied by `python -m src.migrations` or src.serve before workers start, never on import
+check_schema()
 
 # Prometheus instrumentation
 instrumentator = Instrumentator().instrument(app)
@@ -23,98 +37,348 @@ FRAUD_COUNT = Counter("fraud_flags_total", "Total fraud predictions")
 AVG_PROB_SUMMARY = Summary("fraud_probability_summary", "Summary of fraud probabilities")
 MODEL_RETRAIN_COUNT = Counter("fraud_model_retraining_total", "Number of times the model retrained")
 FAIRNESS_GAPS = {
-    "Gender": Gauge("fairness_gap_gender", "Fairness gap for Gender"),
-    "Region": Gauge("fairness_gap_region", "Fairness gap for Region")
+    "Gender": Gauge("fairness_gap_gender", "Fairness gap for Gender", multiprocess_mode="mostrecent"),
+    "Region": Gauge("fairness_gap_region", "Fairness gap for Region", multiprocess_mode="mostrecent")
 }
 
 API_TOKEN = os.getenv("API_TOKEN")
-MODEL_DIR = "models"
-CURRENT_VERSION_FILE = os.path.join(MODEL_DIR, "current_model_version.txt")
+MAX_BATCH_SIZE = int(os.getenv("MAX_BATCH_SIZE", "10000"))
+MICROBATCH_ENABLED = os.getenv("MICROBATCH_ENABLED", "0") == "1"
+MICROBATCH_MAX_SIZE = int(os.getenv("MICROBATCH_MAX_SIZE", "64"))
+MICROBATCH_MAX_WAIT_MS = float(os.getenv("MICROBATCH_MAX_WAIT_MS", "2"))
+MICROBATCH_TIMEOUT = float(os.getenv("MICROBATCH_TIMEOUT", "30"))
+WRITE_BEHIND_ENABLED = os.getenv("WRITE_BEHIND_ENABLED", "1") == "1"
+WRITE_BEHIND_MAX_QUEUE = int(os.getenv("WRITE_BEHIND_MAX_QUEUE", "10000"))
+WRITE_BEHIND_BATCH_SIZE = int(os.getenv("WRITE_BEHIND_BATCH_SIZE", "500"))
+WRITE_BEHIND_FLUSH_INTERVAL = float(os.getenv("WRITE_BEHIND_FLUSH_INTERVAL", "1.0"))
+WRITE_BEHIND_DROP_POLICY = os.getenv("WRITE_BEHIND_DROP_POLICY", "block")
+WRITE_BEHIND_MAX_RETRIES = int(os.getenv("WRITE_BEHIND_MAX_RETRIES", "3"))
+WRITE_BEHIND_RETRY_BACKOFF = float(os.getenv("WRITE_BEHIND_RETRY_BACKOFF", "0.5"))
+COMPILED_MODEL_ENABLED = os.getenv("COMPILED_MODEL_ENABLED", "0") == "1"
+MODEL_CACHE_SIZE = int(os.getenv("MODEL_CACHE_SIZE", "3"))
+MODEL_LOAD_TIMEOUT = float(os.getenv("MODEL_LOAD_TIMEOUT", "300"))
+MODEL_FOLLOW_INTERVAL = float(os.getenv("MODEL_FOLLOW_INTERVAL", "0"))
+PREDICTION_CACHE_ENABLED = os.getenv("PREDICTION_CACHE_ENABLED", "0") == "1"
+PREDICTION_CACHE_SIZE = int(os.getenv("PREDICTION_CACHE_SIZE", "100000"))
+PREDICTION_CACHE_TTL = float(os.getenv("PREDICTION_CACHE_TTL", "300"))
+PREDICTION_CACHE_LOG_HITS = os.getenv("PREDICTION_CACHE_LOG_HITS", "0") == "1"
+ASYNC_DB_ENABLED = os.getenv("ASYNC_DB_ENABLED", "0") == "1"
+ALERT_RATE_PER_MIN = float(os.getenv("ALERT_RATE_PER_MIN", "30"))
+ALERT_COALESCE_WINDOW = float(os.getenv("ALERT_COALESCE_WINDOW", "10"))
+WS_MAX_QUEUE = int(os.getenv("WS_MAX_QUEUE", "100"))
+WS_SLOW_CONSUMER_POLICY = os.getenv("WS_SLOW_CONSUMER_POLICY", "resync")
+WS_HEARTBEAT_INTERVAL = float(os.getenv("WS_HEARTBEAT_INTERVAL", "15"))
+WS_SEND_TIMEOUT = float(os.getenv("WS_SEND_TIMEOUT", "5"))
+# Set by src.serve's environment; the incident hub lives in one process and cannot span workers
+API_WORKERS = int(os.getenv("API_WORKERS", "1"))
+SINGLE_WORKER_ONLY = "The incident feed needs a single-worker API (API_WORKERS=1)"
+HIGH_RISK_SUMMARY = "🚨 {count} more high-risk transactions in the last {window:.0f} s"
+
+# Opt-in cProfile of 1 in PROFILE_SAMPLE_EVERY requests; endpoints are untouched when off
+profiler = SamplingProfiler()
 
 # Model state
-def get_current_version():
-    try:
-        with open(CURRENT_VERSION_FILE) as f:
-            return int(f.read().strip())
-    except:
-        return None
+def load_scoring_model(version: int):
+    # Runs on the registry's loader thread, for reloads, rollbacks and preloads alike
+    with stage_timer("model_registry", "load", version):
+        return _load_scoring_model(version)
 
-def load_model(version: int):
-    fp = os.path.join(MODEL_DIR, f"stacked_fraud_model_v{version}.pkl")
-    if not os.path.exists(fp):
-        raise FileNotFoundError
-    return joblib.load(fp)
+def _load_scoring_model(version: int):
+    # Models trained with IsoAnomalyScore get it from the detector fitted with them, never a refit
+    anomaly_detector = load_anomaly_detector(version)
+    path = compiled_model_path(version)
+    if COMPILED_MODEL_ENABLED and os.path.exists(path):
+        # Array-backed ensemble: same probabilities without sklearn's per-call overhead.
+        # Memory-mapped, every worker process shares one copy of the node arrays.
+        compiled = CompiledStackedModel.load(path, mmap_mode=MODEL_MMAP_MODE)
+        if compiled.threshold is not None:
+            if os.path.exists(model_path(version)):
+                # Large batches are faster through the source model's native tree loops. The pickle's
+                # trees are private to each process, so a worker only loads it once it gets such a batch
+                compiled.set_fallback(loader=lambda: load_model(version)['model'])
+            return compiled, compiled.threshold, anomaly_detector
+    model_info = load_model(version)
+    model = model_info['model']
+    if COMPILED_MODEL_ENABLED:
+        model = CompiledStackedModel.from_model(model).set_fallback(model)
+    return model, model_info['threshold'], anomaly_detector
 
-current_version = get_current_version()
-model_info = load_model(current_version) if current_version else None
-stacked_model, threshold = (model_info['model'], model_info['threshold']) if model_info else (None, None)
+# Requests read one immutable (model, threshold, version, anomaly_detector) bundle; reloads swap it atomically
+model_registry = ModelRegistry(load_scoring_model, MODEL_CACHE_SIZE)
+if get_current_version():
+    model_registry.activate(get_current_version())
+if MODEL_FOLLOW_INTERVAL > 0:
+    model_registry.follow(get_current_version, MODEL_FOLLOW_INTERVAL)
 
 def verify_token(token: str):
     if token != API_TOKEN:
         raise HTTPException(status_code=401, detail="Unauthorized")
 
-# WebSocket handling
-connected_clients = set()
+# WebSocket handling: one bounded queue and writer task per subscriber, so a stalled dashboard only delays itself
+incident_hub = BroadcastHub("incidents", WS_MAX_QUEUE, WS_SLOW_CONSUMER_POLICY, WS_HEARTBEAT_INTERVAL, WS_SEND_TIMEOUT)
+
 @app.websocket("/ws/incidents")
 async def websocket_incidents(ws: WebSocket):
+    if API_WORKERS > 1:
+        # A subscriber on another worker than the one the poller posts to would never see a diff
+        await ws.close(code=1013, reason=SINGLE_WORKER_ONLY)
+        return
     await ws.accept()
-    connected_clients.add(ws)
-    try:
-        while True:
-            await ws.receive_text()  # for keep-alive
-    except WebSocketDisconnect:
-        connected_clients.remove(ws)
+    # New subscribers first receive the current incidents as a snapshot
+    await incident_hub.serve(ws)
+
+def active_model():
+    bundle = model_registry.current()
+    if bundle is None:
+        raise HTTPException(status_code=503, detail="No model loaded")
+    return bundle
+
+def current_version_label():
+    bundle = model_registry.current()
+    return bundle.version if bundle is not None else "none"
+
+def score_transactions(transactions: List[dict], bundle=None, endpoint="predict"):
+    # One vectorized predict_proba call for the whole batch
+    bundle = bundle or active_model()
+    with stage_timer(endpoint, "build_frame", bundle.version):
+        X = transactions if isinstance(bundle.model, CompiledStackedModel) else pd.DataFrame(transactions)
+        if bundle.anomaly_detector is not None:
+            X = add_anomaly_score(X, bundle.anomaly_detector)
+    with stage_timer(endpoint, "predict_proba", bundle.version):
+        probs = bundle.model.predict_proba(X)[:, 1]
+    preds = (probs >= bundle.threshold).astype(int)
+    return probs, preds
+
+def record_metrics(probs, preds):
+    PREDICTION_COUNT.inc(len(probs))
+    for prob in probs:
+        AVG_PROB_SUMMARY.observe(prob)
+    n_fraud = int(np.sum(preds))
+    if n_fraud:
+        FRAUD_COUNT.inc(n_fraud)
+
+def score_micro_batch(transactions: List[dict]):
+    bundle = active_model()
+    probs, preds = score_transactions(transactions, bundle, endpoint="predict_micro_batch")
+    return [(float(prob), int(pred), bundle.threshold, bundle.version) for prob, pred in zip(probs, preds)]
+
+# Opt-in: answer retried and duplicated transactions without scoring them again
+prediction_cache = PredictionCache(PREDICTION_CACHE_SIZE, PREDICTION_CACHE_TTL) if PREDICTION_CACHE_ENABLED else None
+if prediction_cache is not None:
+    # Keys carry the model version already; clearing on a swap just frees the memory at once
+    model_registry.on_swap(lambda old, new: prediction_cache.clear())
+
+def score_with_cache(transactions: List[dict], bundle, endpoint="predict_batch"):
+    """
+    Score only the transactions missing from the prediction cache.
+    Returns (probs, preds, hits) where `hits` marks cached rows.
+    """
+    if prediction_cache is None:
+        probs, preds = score_transactions(transactions, bundle, endpoint)
+        return probs, preds, np.zeros(len(probs), dtype=bool)
+    with stage_timer(endpoint, "cache_lookup", bundle.version):
+        keys = [fingerprint(txn, bundle.version) for txn in transactions]
+        cached = [prediction_cache.get(key) for key in keys]
+    hits = np.array([entry is not None for entry in cached])
+    probs = np.array([entry[0] if entry else 0.0 for entry in cached])
+    preds = np.array([entry[1] if entry else 0 for entry in cached], dtype=int)
+    misses = np.flatnonzero(~hits)
+    if len(misses):
+        probs[misses], preds[misses] = score_transactions([transactions[i] for i in misses], bundle, endpoint)
+        for i in misses:
+            prediction_cache.put(keys[i], (float(probs[i]), int(preds[i]), bundle.threshold, bundle.version))
+    return probs, preds, hits
+
+# Opt-in: queue concurrent /predict calls and score them with one model call
+micro_batcher = (MicroBatcher(score_micro_batch, MICROBATCH_MAX_SIZE, MICROBATCH_MAX_WAIT_MS, MICROBATCH_TIMEOUT)
+                 if MICROBATCH_ENABLED else None)
+
+# Write-behind logging keeps the Postgres commit off the request path
+if WRITE_BEHIND_ENABLED:
+    prediction_log_writer = WriteBehindWriter(
+        PredictionLog.__table__, WRITE_BEHIND_MAX_QUEUE, WRITE_BEHIND_BATCH_SIZE,
+        WRITE_BEHIND_FLUSH_INTERVAL, WRITE_BEHIND_DROP_POLICY,
+        max_retries=WRITE_BEHIND_MAX_RETRIES, retry_backoff=WRITE_BEHIND_RETRY_BACKOFF
+    )
+    # Analyst labels are never dropped: failed writes retry until the database is back
+    # and a full queue blocks the request instead
+    feedback_writer = WriteBehindWriter(
+        Feedback.__table__, WRITE_BEHIND_MAX_QUEUE, WRITE_BEHIND_BATCH_SIZE,
+        WRITE_BEHIND_FLUSH_INTERVAL, "block", block_timeout=None,
+        max_retries=None, retry_backoff=WRITE_BEHIND_RETRY_BACKOFF
+    )
+else:
+    prediction_log_writer = feedback_writer = None
 
-async def broadcast_incidents(msg: dict):
-    if not connected_clients:
+def log_predictions(db: Session, rows: List[dict]):
+    if not rows:
         return
-    data = json.dumps(msg)
-    for client in list(connected_clients):
-        try:
-            await client.send_text(data)
-        except:
-            connected_clients.remove(client)
+    if prediction_log_writer is not None:
+        prediction_log_writer.put_many(rows)
+    else:
+        # Single executemany insert instead of one ORM object per row
+        db.execute(PredictionLog.__table__.insert(), rows)
+        db.commit()
+
+# Webhooks are sent from background threads, never from the request
+alert_dispatcher = AlertDispatcher(rate_per_min=ALERT_RATE_PER_MIN, coalesce_window=ALERT_COALESCE_WINDOW)
+
+@app.on_event("shutdown")
+async def close_websockets():
+    await incident_hub.close()
+
+@app.on_event("shutdown")
+def shutdown_background_workers():
+    if micro_batcher is not None:
+        micro_batcher.close()
+    alert_dispatcher.close(timeout=5)
+    model_registry.close()
+    if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        # Drop this worker's live gauges from the aggregated metrics
+        multiprocess.mark_process_dead(os.getpid())
+    for writer in (prediction_log_writer, feedback_writer):
+        if writer is not None:
+            writer.close()
 
 # API endpoints
 @app.post("/predict")
+@profiler.profiled("predict")
 def predict(transaction: dict, token: str = Header(...), db: Session = Depends(get_db)):
     verify_token(token)
-    X = pd.DataFrame([transaction])
-    prob = stacked_model.predict_proba(X)[0, 1]
-    pred = int(prob >= threshold)
-    db.add(PredictionLog(features=transaction, predicted_label=pred, predicted_prob=prob))
-    db.commit()
-    PREDICTION_COUNT.inc()
-    AVG_PROB_SUMMARY.observe(prob)
-    if pred == 1:
-        FRAUD_COUNT.inc()
+    bundle = active_model()
+    cached = None
+    if prediction_cache is not None:
+        with stage_timer("predict", "cache_lookup", bundle.version):
+            key = fingerprint(transaction, bundle.version)
+            cached = prediction_cache.get(key)
+    if cached is not None:
+        prob, pred, threshold, version = cached
+    elif micro_batcher is not None:
+        # Time spent waiting for the batch to fill plus its scoring
+        with stage_timer("predict", "micro_batch", bundle.version):
+            try:
+                prob, pred, threshold, version = micro_batcher.score(transaction)
+            except FutureTimeout:
+                raise HTTPException(status_code=503, detail="Scoring timed out")
+    else:
+        probs, preds = score_transactions([transaction], bundle)
+        prob, pred, threshold, version = float(probs[0]), int(preds[0]), bundle.threshold, bundle.version
+    if cached is None or PREDICTION_CACHE_LOG_HITS:
+        with stage_timer("predict", "log", version):
+            log_predictions(db, [
+                {"features": transaction, "predicted_label": pred, "predicted_prob": prob,
+                 "prediction_time": datetime.utcnow(), "model_version": version, "threshold": threshold}
+            ])
+    if cached is not None:
+        return {"fraud_prediction": pred, "fraud_probability": float(prob), "threshold": float(threshold)}
+    if prediction_cache is not None:
+        prediction_cache.put(key, (prob, pred, threshold, version))
+    record_metrics([prob], [pred])
     if prob > 0.9:
-        send_slack_alert(f"🚨 Fraud Alert: {prob:.2%}", "fraud_spike")
+        with stage_timer("predict", "alert", version):
+            alert_dispatcher.dispatch("slack", f"🚨 Fraud Alert: {prob:.2%}", coalesce_key="fraud_spike",
+                                      summary=HIGH_RISK_SUMMARY, dashboard_key="fraud_spike")
     return {"fraud_prediction": pred, "fraud_probability": float(prob), "threshold": float(threshold)}
 
+@app.post("/predict/batch")
+@profiler.profiled("predict_batch")
+def predict_batch(transactions: List[dict], token: str = Header(...), db: Session = Depends(get_db)):
+    verify_token(token)
+    bundle = active_model()
+    if not transactions:
+        return {"predictions": [], "threshold": float(bundle.threshold)}
+    if len(transactions) > MAX_BATCH_SIZE:
+        raise HTTPException(status_code=413, detail=f"Batch exceeds {MAX_BATCH_SIZE} transactions")
+    probs, preds, hits = score_with_cache(transactions, bundle)
+    now = datetime.utcnow()
+    with stage_timer("predict_batch", "log", bundle.version):
+        log_predictions(db, [
+            {"features": txn, "predicted_label": int(pred), "predicted_prob": float(prob), "prediction_time": now,
+             "model_version": bundle.version, "threshold": bundle.threshold}
+            for txn, pred, prob, hit in zip(transactions, preds, probs, hits)
+            if not hit or PREDICTION_CACHE_LOG_HITS
+        ])
+    # Metrics and alerts only count transactions scored by this request
+    with stage_timer("predict_batch", "metrics", bundle.version):
+        record_metrics(probs[~hits], preds[~hits])
+    n_high_risk = int((probs[~hits] > 0.9).sum())
+    if n_high_risk:
+        alert_dispatcher.dispatch("slack", f"🚨 Fraud Alert: {n_high_risk} of {len(transactions)} batch transactions above 90%",
+                                  coalesce_key="fraud_spike", summary=HIGH_RISK_SUMMARY, coalesce_count=n_high_risk,
+                                  dashboard_key="fraud_spike")
+    return {
+        "predictions": [
+            {"fraud_prediction": int(pred), "fraud_probability": float(prob)}
+            for pred, prob in zip(preds, probs)
+        ],
+        "threshold": float(bundle.threshold)
+    }
+
 @app.post("/feedback")
-def feedback(items: List[dict], token: str = Header(...), db: Session = Depends(get_db)):
+@profiler.profiled("feedback")
+async def feedback(items: List[dict], token: str = Header(...)):
     verify_token(token)
-    for fb in items:
-        db.add(Feedback(features=fb['features'], true_label=fb['analyst_label']))
-    db.commit()
+    now = datetime.utcnow()
+    rows = []
+    for i, fb in enumerate(items):
+        # Same checks as /feedback/bulk, so a bad label never reaches retraining data
+        try:
+            rows.append(validate_item(fb, now))
+        except ValueError as e:
+            raise HTTPException(status_code=422, detail=f"item {i}: {e}")
+    with stage_timer("feedback", "insert", current_version_label()):
+        if ASYNC_DB_ENABLED:
+            # Awaited on the event loop: no threadpool slot is held while the insert commits
+            async with async_session() as db:
+                await db.execute(Feedback.__table__.insert(), rows)
+                await db.commit()
+        elif feedback_writer is not None:
+            # put_many may block on a full queue, so keep it off the event loop
+            await run_in_threadpool(feedback_writer.put_many, rows)
+        else:
+            await run_in_threadpool(insert_feedback, rows)
     return {"status": "feedback_saved", "new_records": len(items)}
 
+@app.post("/feedback/bulk")
+@profiler.profiled("feedback_bulk")
+async def feedback_bulk(request: Request, token: str = Header(...), format: str = None):
+    """
+    Stream NDJSON (one /feedback item per line) or CSV (feature columns plus
+    analyst_label) into the feedback table in chunks. Bad rows are reported
+    by line number and skipped.
+    """
+    verify_token(token)
+    fmt = format or detect_format(request.headers.get("content-type"))
+    if fmt not in ("ndjson", "csv"):
+        raise HTTPException(status_code=415, detail="Send application/x-ndjson or text/csv, or pass ?format=")
+    try:
+        with stage_timer("feedback_bulk", "ingest", current_version_label()):
+            report = await ingest_feedback(request.stream(), fmt,
+                                           insert=insert_feedback_async if ASYNC_DB_ENABLED else insert_feedback)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"status": "feedback_saved", **report}
+
 @app.post("/retrain")
 def retrain_model(token: str = Header(...)):
     verify_token(token)
     # Simplified retrain logic (see scheduled retrainer for full)
-    send_slack_alert("🤖 Manual retrain triggered", "retrain")
+    alert_dispatcher.dispatch("slack", "🤖 Manual retrain triggered", dashboard_key="retrain")
     MODEL_RETRAIN_COUNT.inc()
     return {"status": "ok"}
 
+def activate_version(version: int, endpoint: str):
+    # Only this request waits for deserialization; scoring keeps using the old bundle
+    try:
+        with stage_timer(endpoint, "activate", version):
+            return model_registry.activate(version, timeout=MODEL_LOAD_TIMEOUT)
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail=f"Model version {version} not found")
+
 @app.post("/rollback_model")
 def rollback(v: int, token: str = Header(...)):
     verify_token(token)
-    global stacked_model, threshold, current_version
-    model_info = load_model(v)
-    stacked_model, threshold = model_info['model'], model_info['threshold']
-    current_version = v
+    activate_version(v, "rollback_model")
     with open(CURRENT_VERSION_FILE, 'w') as f:
         f.write(str(v))
     return {"status": "rolled_back", "version": v}
@@ -122,14 +386,26 @@ def rollback(v: int, token: str = Header(...)):
 @app.post("/model/reload")
 def reload_model(token: str = Header(...)):
     verify_token(token)
-    global stacked_model, threshold, current_version
-    current_version = get_current_version()
-    model_info = load_model(current_version)
-    stacked_model, threshold = model_info['model'], model_info['threshold']
-    return {"status": "reloaded", "version": current_version}
+    version = get_current_version()
+    if version is None:
+        raise HTTPException(status_code=404, detail="No current model version")
+    activate_version(version, "model_reload")
+    return {"status": "reloaded", "version": version}
+
+@app.post("/model/preload")
+def preload_model(v: int, token: str = Header(...)):
+    verify_token(token)
+    # Checked here because the load itself runs in the background, where a missing file is only logged
+    if not (os.path.exists(model_path(v)) or COMPILED_MODEL_ENABLED and os.path.exists(compiled_model_path(v))):
+        raise HTTPException(status_code=404, detail=f"Model version {v} not found")
+    # Returns immediately; a later reload or rollback to v is then an instant swap
+    model_registry.preload(v)
+    return {"status": "preloading", "version": v, "cached_versions": model_registry.cached_versions()}
 
 @app.post("/broadcast_incident")
 async def broadcast_incident(msg: dict, token: str = Header(...)):
     verify_token(token)
-    await broadcast_incidents(msg)
-    return {"status": "broadcasted"}
+    if API_WORKERS > 1:
+        raise HTTPException(status_code=503, detail=SINGLE_WORKER_ONLY)
+    subscribers = incident_hub.publish(msg)
+    return {"status": "broadcasted", "subscribers": subscribers}
@@ -0,0 +1,541 @@
+import argparse
+import asyncio
+import json
+import os
+import platform
+import resource
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+import numpy as np
+
+# src.* modules read DATA_DIR, MODEL_DIR and DATABASE_URL at import time, so they
+# are only imported once run_suite() has pointed those at the benchmark workdir.
+
+BENCH_ROWS = int(os.getenv("BENCH_ROWS", "5000"))
+BENCH_REQUESTS = int(os.getenv("BENCH_REQUESTS", "500"))
+BENCH_CONCURRENCY = int(os.getenv("BENCH_CONCURRENCY", "8"))
+BENCH_BATCH_SIZE = int(os.getenv("BENCH_BATCH_SIZE", "500"))
+BENCH_WORKERS = int(os.getenv("BENCH_WORKERS", "2"))
+BENCH_WS_CLIENTS = int(os.getenv("BENCH_WS_CLIENTS", "500"))
+BENCH_WS_SLOW_CLIENTS = int(os.getenv("BENCH_WS_SLOW_CLIENTS", "10"))
+BENCH_WS_MESSAGES = int(os.getenv("BENCH_WS_MESSAGES", "100"))
+BENCH_LOG_ROWS = int(os.getenv("BENCH_LOG_ROWS", "200000"))
+BENCH_GEOPY_PAIRS = int(os.getenv("BENCH_GEOPY_PAIRS", "2000"))
+BENCH_STREAM_BATCHES = int(os.getenv("BENCH_STREAM_BATCHES", "20"))
+BENCH_STREAM_BATCH_SIZES = [int(n) for n in os.getenv("BENCH_STREAM_BATCH_SIZES", "1,10,100,1000").split(",")]
+BENCH_REGRESSION_THRESHOLD = float(os.getenv("BENCH_REGRESSION_THRESHOLD", "0.10"))
+# The API setting: the largest batch /predict/batch accepts
+MAX_BATCH_SIZE = int(os.getenv("MAX_BATCH_SIZE", "10000"))
+BENCH_TOKEN = "bench-token"
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def timed(fn, *args, repeat=1, **kwargs):
+    # Best of `repeat` runs, in seconds, and the last result
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn(*args, **kwargs)
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+def latency_stats(latencies, elapsed):
+    ms = np.asarray(latencies) * 1000
+    return {
+        "requests": len(ms),
+        "throughput_per_s": len(ms) / elapsed,
+        "p50_ms": float(np.percentile(ms, 50)),
+        "p95_ms": float(np.percentile(ms, 95)),
+        "p99_ms": float(np.percentile(ms, 99)),
+    }
+
+def max_rss_mb():
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / (1024 * 1024 if sys.platform == "darwin" else 1024)
+
+def process_tree_rss_mb(pid):
+    # Current RSS of a uvicorn master and its workers; Linux only
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            rss = next(int(line.split()[1]) for line in f if line.startswith("VmRSS:")) / 1024
+        with open(f"/proc/{pid}/task/{pid}/children") as f:
+            children = [int(c) for c in f.read().split()]
+    except (OSError, StopIteration):
+        return None
+    return rss + sum(process_tree_rss_mb(child) or 0 for child in children)
+
+def run_load(post, path, payloads, concurrency):
+    """
+    Send every payload to `path` from `concurrency` threads and return
+    latency stats. `post(path, json)` is a TestClient or httpx.Client post.
+    """
+    def send(payload):
+        start = time.perf_counter()
+        response = post(path, json=payload, headers={"token": BENCH_TOKEN})
+        response.raise_for_status()
+        return time.perf_counter() - start
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        latencies = list(pool.map(send, payloads))
+    return latency_stats(latencies, time.perf_counter() - start)
+
+def api_scenarios(post, records, n_requests, concurrency, batch_size):
+    singles = [records[i % len(records)] for i in range(n_requests)]
+    batches = [records[i:i + batch_size] for i in range(0, len(records), batch_size)]
+    # One untimed request so model loading and connection setup are not measured
+    post("/predict", json=singles[0], headers={"token": BENCH_TOKEN}).raise_for_status()
+    results = {"predict": run_load(post, "/predict", singles, concurrency)}
+    batch = run_load(post, "/predict/batch", batches, concurrency)
+    batch["transactions_per_s"] = batch["throughput_per_s"] * batch_size
+    results["predict_batch"] = batch
+    return results
+
+def bench_training(X, y, cache_dir):
+    from src.model_training_hybrid import train_stacked_model
+    # A fresh cache directory, so every base-learner fold is actually fitted
+    seconds, (model, threshold) = timed(train_stacked_model, X, y, cache_dir=cache_dir)
+    return {"wall_s": seconds, "rows": len(X)}, model, threshold
+
+def bench_features(X):
+    from src.feature_engineering_advanced import add_advanced_features, fit_anomaly_detector, haversine_km, vincenty_km
+    from geopy.distance import geodesic
+    results = {}
+    for expanding in (False, True):
+        # Fitted once, as at training time; the timed calls only score with it
+        fit_s, detector = timed(fit_anomaly_detector, X, expanding=expanding)
+        tracemalloc.start()
+        seconds, _ = timed(add_advanced_features, X, expanding=expanding, anomaly_detector=detector, repeat=3)
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        results["expanding" if expanding else "batch"] = {
+            "wall_s": seconds, "rows_per_s": len(X) / seconds, "peak_mb": peak / 2 ** 20, "anomaly_fit_s": fit_s,
+        }
+    lat1, lon1, lat2, lon2 = (X[c].to_numpy() for c in ("Lat", "Lon", "Lat", "Lon"))
+    lat2, lon2 = np.roll(lat2, 1), np.roll(lon2, 1)
+    # geopy computes one pair per call, so it is timed and compared on a sample
+    sample = slice(0, min(len(X), BENCH_GEOPY_PAIRS))
+    pairs = list(zip(lat1[sample], lon1[sample], lat2[sample], lon2[sample]))
+    seconds, reference = timed(lambda: np.array([geodesic((a, b), (c, d)).km for a, b, c, d in pairs]))
+    results["geopy"] = {"wall_s": seconds, "rows_per_s": len(pairs) / seconds}
+    for name, fn in (("haversine", haversine_km), ("vincenty", vincenty_km)):
+        seconds, dist = timed(fn, lat1, lon1, lat2, lon2, repeat=3)
+        error = np.abs(dist[sample] - reference)
+        results[name] = {"wall_s": seconds, "rows_per_s": len(X) / seconds, "max_error_km": float(error.max()),
+                         "max_rel_error": float((error / np.maximum(reference, 1e-9)).max())}
+    return results
+
+def bench_inference(model, compiled, X, max_batch_size=MAX_BATCH_SIZE):
+    """
+    Score batches from one row up to the API's MAX_BATCH_SIZE (rows of X
+    repeated as needed) as the API does: sklearn on a DataFrame built from
+    the request records, the compiled model on the records themselves, as
+    served (larger batches handed to sklearn) and with every batch traversed.
+    Reports p50/p99 per call, around the batch size the served model was
+    calibrated to switch at.
+    """
+    import pandas as pd
+    from src.compiled_model import CompiledStackedModel
+    served = compiled.set_fallback(model)
+    traversal = CompiledStackedModel(compiled.feature_names, compiled.ensembles, compiled.coef, compiled.intercept)
+    results = {"served_max_rows": served.max_rows}
+    for batch in sorted({1, 100, served.max_rows, served.max_rows + 1, 2000, max_batch_size}):
+        records = X.iloc[np.arange(batch) % len(X)].to_dict(orient="records")
+        calls = 20 if batch <= 2000 else 5
+        entry = {}
+        for name, fn in (("sklearn", lambda: model.predict_proba(pd.DataFrame(records))),
+                         ("compiled", lambda: served.predict_proba(records)),
+                         ("traversal", lambda: traversal.predict_proba(records))):
+            latencies = []
+            for _ in range(calls):
+                start = time.perf_counter()
+                fn()
+                latencies.append(time.perf_counter() - start)
+            stats = latency_stats(latencies, sum(latencies))
+            entry.update({f"{name}_p50_ms": stats["p50_ms"], f"{name}_p99_ms": stats["p99_ms"],
+                          f"{name}_rows_per_s": batch * stats["throughput_per_s"]})
+        results[f"batch_{batch}"] = entry
+    return results
+
+def seed_prediction_log(n_rows, days=90, seed=0, chunk_size=20000):
+    """
+    Append `n_rows` synthetic predictions spread over the last `days` days,
+    oldest first like real traffic, with the protected attributes the
+    fairness audit groups on.
+    """
+    from src.db import engine, PredictionLog
+    rng = np.random.default_rng(seed)
+    now = datetime.utcnow()
+    ages = np.sort(rng.uniform(0, days * 86400, n_rows))[::-1]
+    genders = rng.choice(["F", "M"], n_rows)
+    regions = rng.choice(["north", "south", "east", "west"], n_rows)
+    probs = rng.random(n_rows)
+    amounts = rng.lognormal(np.log(50), 0.8, n_rows).round(2)
+    for start in range(0, n_rows, chunk_size):
+        rows = [
+            {"features": {"Amount": float(amounts[i]), "Gender": genders[i], "Region": regions[i]},
+             "predicted_label": int(probs[i] >= 0.9), "predicted_prob": float(probs[i]),
+             "prediction_time": now - timedelta(seconds=float(ages[i])), "model_version": 1, "threshold": 0.9}
+            for i in range(start, min(start + chunk_size, n_rows))
+        ]
+        with engine.begin() as conn:
+            conn.execute(PredictionLog.__table__.insert(), rows)
+
+def _time_range_queries(db):
+    from sqlalchemy import func, select
+    from src.db import PredictionLog
+    now = datetime.utcnow()
+    recent = select(func.count()).where(PredictionLog.prediction_time >= now - timedelta(hours=1))
+    # The fairness audit's grouping over a one-day window
+    gender = PredictionLog.features["Gender"].as_string()
+    fairness = (
+        select(gender, func.count(), func.sum(PredictionLog.predicted_label))
+        .where(PredictionLog.prediction_time >= now - timedelta(days=1), gender.isnot(None))
+        .group_by(gender)
+    )
+    recent_s, _ = timed(db.scalar, recent, repeat=20)
+    fairness_s, _ = timed(lambda: db.execute(fairness).all(), repeat=5)
+    return {"recent_count_ms": recent_s * 1000, "fairness_window_ms": fairness_s * 1000}
+
+def bench_database(log_rows=BENCH_LOG_ROWS):
+    """
+    Time-range and fairness-window queries on prediction_log with its
+    prediction_time (and, on Postgres, protected attribute) indexes, then
+    again with them dropped, and the fairness rollup over the whole log.
+    """
+    from sqlalchemy import func, select, text
+    from src.db import SessionLocal, engine, PredictionLog
+    from src.fairness_audit import update_rollups
+    from src.migrations import PROTECTED_ATTRS, add_protected_attribute_indexes, add_time_indexes
+    if log_rows:
+        seed_start = time.perf_counter()
+        seed_prediction_log(log_rows)
+        seed_s = time.perf_counter() - seed_start
+    with engine.begin() as conn:
+        conn.execute(text("ANALYZE prediction_log"))
+    results = {}
+    with SessionLocal() as db:
+        results["prediction_log_rows"] = db.scalar(select(func.count()).select_from(PredictionLog))
+        results["indexed"] = _time_range_queries(db)
+    time_indexes = [ix.name for ix in PredictionLog.__table__.indexes if "prediction_time" in ix.columns]
+    attr_indexes = [f"ix_prediction_log_{attr.lower()}" for attr in PROTECTED_ATTRS]
+    with engine.begin() as conn:
+        for name in time_indexes + (attr_indexes if conn.dialect.name == "postgresql" else []):
+            conn.execute(text(f"DROP INDEX IF EXISTS {name}"))
+    try:
+        with SessionLocal() as db:
+            results["unindexed"] = _time_range_queries(db)
+    finally:
+        with engine.begin() as conn:
+            add_time_indexes(conn)
+            if conn.dialect.name == "postgresql":
+                add_protected_attribute_indexes(conn)
+    with SessionLocal() as db:
+        results["fairness_rollup_s"], _ = timed(update_rollups, db)
+    if log_rows:
+        results["seed_rows_per_s"] = log_rows / seed_s
+    return results
+
+_StreamRecord = namedtuple("_StreamRecord", "topic partition offset key value")
+
+class _BenchStream:
+    # Fake consumer and producer for StreamScorer: one partition of pre-built records, sends serialized like
+    # build_producer's and acknowledged at once
+    def __init__(self, records, batch_size):
+        from kafka import TopicPartition
+        from src.kafka_stream_scoring import INPUT_TOPIC
+        self.tp = TopicPartition(INPUT_TOPIC, 0)
+        self.batches = [
+            [_StreamRecord(INPUT_TOPIC, 0, offset, None, value)
+             for offset, value in enumerate(records[start:start + batch_size], start)]
+            for start in range(0, len(records), batch_size)
+        ]
+        self.sent = 0
+
+    def poll(self, timeout_ms=0, max_records=None):
+        return {self.tp: self.batches.pop(0)} if self.batches else {}
+
+    def commit(self):
+        pass
+
+    def send(self, topic, key=None, value=None):
+        json.dumps(value).encode("utf-8")
+        self.sent += 1
+        return _SentFuture()
+
+    def flush(self, timeout=None):
+        pass
+
+class _SentFuture:
+    def get(self, timeout=None):
+        return None
+
+def bench_stream(model, threshold, records, batches=BENCH_STREAM_BATCHES, batch_sizes=BENCH_STREAM_BATCH_SIZES):
+    """
+    Messages per second through StreamScorer.process_batch per batch size:
+    parse, one predict_proba call, produce and write_predictions into the
+    benchmark database, `batches` batches each.
+    """
+    from functools import partial
+    from src.kafka_stream_scoring import StreamScorer, write_predictions
+    results = {}
+    for batch_size in batch_sizes:
+        n = batch_size * batches
+        stream = _BenchStream([records[i % len(records)] for i in range(n)], batch_size)
+        # A group of its own, so stored offsets from another batch size do not skip these rows
+        scorer = StreamScorer(stream, stream, batch_size=batch_size,
+                              writer=partial(write_predictions, group_id=f"bench-{batch_size}"))
+        scorer.model, scorer.threshold, scorer.version = model, threshold, 1
+        latencies = []
+        start = time.perf_counter()
+        while stream.batches:
+            sent = time.perf_counter()
+            scorer.process_batch(stream.poll())
+            latencies.append(time.perf_counter() - sent)
+        elapsed = time.perf_counter() - start
+        stats = latency_stats(latencies, elapsed)
+        results[f"batch_{batch_size}"] = {
+            "messages_per_s": n / elapsed, "batch_p50_ms": stats["p50_ms"], "batch_p99_ms": stats["p99_ms"],
+            "messages": n,
+        }
+    return results
+
+class _BenchSocket:
+    # Stands in for an accepted WebSocket; `delay` simulates a slow network or client
+    def __init__(self, delivered=None, delay=0.0):
+        self.delivered = delivered
+        self.delay = delay
+        self.closed = asyncio.Event()
+
+    async def send_text(self, data):
+        if self.delay:
+            await asyncio.sleep(self.delay)
+        if self.delivered is not None:
+            self.delivered[0] += 1
+
+    async def receive(self):
+        await self.closed.wait()
+        return {"type": "websocket.disconnect"}
+
+    async def close(self):
+        self.closed.set()
+
+async def _broadcast_run(n_clients, n_slow, n_messages):
+    from src.broadcast_hub import BroadcastHub
+    hub = BroadcastHub("bench", max_queue=20, send_timeout=5.0)
+    # Messages sent to fast subscribers, snapshots included
+    delivered = [0]
+    fast = [_BenchSocket(delivered) for _ in range(n_clients)]
+    # Slow enough to overflow their queues, not to hit the send timeout
+    slow = [_BenchSocket(delay=0.5) for _ in range(n_slow)]
+    serving = [asyncio.create_task(hub.serve(ws)) for ws in fast + slow]
+    await asyncio.sleep(0.1)
+    latencies = []
+    start = time.perf_counter()
+    for i in range(n_messages):
+        sent = time.perf_counter()
+        hub.publish({"type": "incident_diff", "pagerduty": {
+            "added": [{"id": f"P{i}", "title": "bench", "status": "triggered"}], "updated": [], "resolved": []}})
+        # Delivered once every fast client has sent the snapshot plus i + 1 messages
+        while delivered[0] < n_clients * (i + 2):
+            await asyncio.sleep(0)
+        latencies.append(time.perf_counter() - sent)
+    elapsed = time.perf_counter() - start
+    connected = len(hub)
+    await hub.close()
+    await asyncio.gather(*serving)
+    results = latency_stats(latencies, elapsed)
+    results["messages_per_s"] = results.pop("throughput_per_s")
+    results.update(clients=n_clients, slow_clients=n_slow, still_connected=connected)
+    return results
+
+def bench_broadcast(n_clients, n_slow, n_messages):
+    """
+    Publish to `n_clients` in-memory subscribers plus `n_slow` slow ones and
+    time each message until every fast subscriber has sent it.
+    """
+    return asyncio.run(_broadcast_run(n_clients, n_slow, n_messages))
+
+def bench_in_process(records, args):
+    from fastapi.testclient import TestClient
+    from src.api_service_advanced import app
+    with TestClient(app) as client:
+        results = api_scenarios(client.post, records, args.requests, args.concurrency, args.batch_size)
+    results["max_rss_mb"] = max_rss_mb()
+    return results
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def bench_uvicorn(records, args, env):
+    import httpx
+    port = _free_port()
+    env = dict(env, API_HOST="127.0.0.1", API_PORT=str(port), API_WORKERS=str(args.workers),
+               PROMETHEUS_MULTIPROC_DIR=os.path.join(args.workdir, "prometheus"))
+    server = subprocess.Popen([sys.executable, "-m", "src.serve"], cwd=REPO_DIR, env=env)
+    base_url = f"http://127.0.0.1:{port}"
+    try:
+        deadline = time.monotonic() + 120
+        while True:
+            try:
+                httpx.get(f"{base_url}/metrics", timeout=1).raise_for_status()
+                break
+            except httpx.HTTPError:
+                if server.poll() is not None or time.monotonic() > deadline:
+                    raise RuntimeError(f"uvicorn did not start on port {port}")
+                time.sleep(0.5)
+        limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+        with httpx.Client(base_url=base_url, timeout=60, limits=limits) as client:
+            results = api_scenarios(client.post, records, args.requests, args.concurrency, args.batch_size)
+        results["server_rss_mb"] = process_tree_rss_mb(server.pid)
+        results["workers"] = args.workers
+        return results
+    finally:
+        server.terminate()
+        server.wait(timeout=30)
+
+def run_suite(args):
+    os.makedirs(args.workdir, exist_ok=True)
+    env = dict(
+        os.environ,
+        DATA_DIR=os.path.join(args.workdir, "data"),
+        MODEL_DIR=os.path.join(args.workdir, "models"),
+        DATABASE_URL=args.database_url or f"sqlite:///{os.path.join(args.workdir, 'bench.db')}",
+        API_TOKEN=BENCH_TOKEN,
+        # Only rows older than this are rolled up; the benchmark rolls up what it just wrote
+        FAIRNESS_SETTLE_SECONDS="0",
+    )
+    os.environ.update(env)
+    for key in ("DATA_DIR", "MODEL_DIR"):
+        os.makedirs(env[key], exist_ok=True)
+
+    import joblib
+    from src.compiled_model import export_model, CompiledStackedModel
+    from src.migrations import migrate
+    from src.generate_synthetic_data import generate_transactions
+    from src.model_store import CURRENT_VERSION_FILE, compiled_model_path, model_path
+
+    # What src.serve does before starting workers; the in-process API only checks the schema
+    migrate()
+    results = {}
+    data_s, (X, y) = timed(generate_transactions, n_samples=args.rows, seed=args.seed)
+    results["generate_data"] = {"wall_s": data_s, "rows": len(X)}
+    results["features"] = bench_features(X)
+    results["training"], model, threshold = bench_training(X, y, os.path.join(args.workdir, "oof_cache"))
+
+    # Version 1 of the benchmark workdir, in the layout the API loads from
+    joblib.dump({"model": model, "threshold": threshold}, model_path(1))
+    with open(CURRENT_VERSION_FILE, "w") as f:
+        f.write("1")
+    # Includes verifying and calibrating on training rows, as `python -m src.compiled_model` does
+    compile_s, path = timed(export_model, 1, X.head(1000))
+    results["compile_model"] = {"wall_s": compile_s, "calibrated_max_rows": CompiledStackedModel.load(path).calibrated_max_rows}
+    results["inference"] = bench_inference(model, CompiledStackedModel.load(compiled_model_path(1)), X)
+
+    records = X.to_dict(orient="records")
+    if "in_process" in args.modes:
+        results["api_in_process"] = bench_in_process(records, args)
+    if "uvicorn" in args.modes:
+        results["api_uvicorn"] = bench_uvicorn(records, args, env)
+    results["database"] = bench_database(args.log_rows)
+    # After the database queries, which expect only the seeded prediction_log rows
+    results["stream"] = bench_stream(model, threshold, records)
+    if args.ws_clients:
+        results["broadcast"] = bench_broadcast(args.ws_clients, args.ws_slow_clients, args.ws_messages)
+
+    return {
+        "meta": {
+            "timestamp": datetime.utcnow().isoformat(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "database": env["DATABASE_URL"].split(":", 1)[0],
+            "rows": args.rows, "requests": args.requests, "concurrency": args.concurrency,
+            "batch_size": args.batch_size, "seed": args.seed, "ws_clients": args.ws_clients,
+            "log_rows": args.log_rows,
+        },
+        "results": results,
+    }
+
+def flatten(results, prefix=""):
+    flat = {}
+    for key, value in results.items():
+        name = f"{prefix}{key}"
+        if isinstance(value, dict):
+            flat.update(flatten(value, f"{name}."))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            flat[name] = value
+    return flat
+
+def higher_is_better(metric):
+    if metric.endswith("_per_s"):
+        return True
+    if metric.endswith(("_s", "_ms", "_mb")):
+        return False
+    # Counts and settings (rows, requests, workers) are not compared
+    return None
+
+def compare(current, baseline, threshold=BENCH_REGRESSION_THRESHOLD):
+    """
+    Return [(metric, baseline, current, change)] for every metric that got
+    worse by more than `threshold` (0.10 = 10%), comparing only metrics
+    present in both runs.
+    """
+    new, old = flatten(current["results"]), flatten(baseline["results"])
+    regressions = []
+    for metric in sorted(new.keys() & old.keys()):
+        direction = higher_is_better(metric)
+        if direction is None or not old[metric]:
+            continue
+        change = (new[metric] - old[metric]) / old[metric]
+        if (-change if direction else change) > threshold:
+            regressions.append((metric, old[metric], new[metric], change))
+    return regressions
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Offline load test and benchmarks of training and scoring")
+    parser.add_argument("--rows", type=int, default=BENCH_ROWS, help="Synthetic transactions to generate")
+    parser.add_argument("--requests", type=int, default=BENCH_REQUESTS, help="Requests per /predict scenario")
+    parser.add_argument("--concurrency", type=int, default=BENCH_CONCURRENCY)
+    parser.add_argument("--batch-size", type=int, default=BENCH_BATCH_SIZE)
+    parser.add_argument("--workers", type=int, default=BENCH_WORKERS, help="Uvicorn workers in uvicorn mode")
+    parser.add_argument("--modes", nargs="+", choices=["in_process", "uvicorn"], default=["in_process", "uvicorn"])
+    parser.add_argument("--ws-clients", type=int, default=BENCH_WS_CLIENTS, help="Incident WebSocket subscribers; 0 skips")
+    parser.add_argument("--ws-slow-clients", type=int, default=BENCH_WS_SLOW_CLIENTS)
+    parser.add_argument("--ws-messages", type=int, default=BENCH_WS_MESSAGES)
+    parser.add_argument("--log-rows", type=int, default=BENCH_LOG_ROWS,
+                        help="Synthetic prediction_log history added before the database queries")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--database-url", help="Defaults to a SQLite file in the workdir")
+    parser.add_argument("--workdir", default=None, help="Data, models and database of the run (default: a temp dir)")
+    parser.add_argument("--output", default="bench_results.json")
+    parser.add_argument("--compare", metavar="BASELINE_JSON", help="Exit with status 1 if a metric regressed")
+    parser.add_argument("--threshold", type=float, default=BENCH_REGRESSION_THRESHOLD)
+    args = parser.parse_args()
+    args.workdir = args.workdir or tempfile.mkdtemp(prefix="fraud-bench-")
+
+    report = run_suite(args)
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Benchmark results written to {args.output}")
+    for metric, value in flatten(report["results"]).items():
+        print(f"  {metric}: {value:.4g}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        regressions = compare(report, baseline, args.threshold)
+        for metric, old, new, change in regressions:
+            print(f"REGRESSION {metric}: {old:.4g} -> {new:.4g} ({change:+.1%})")
+        if regressions:
+            sys.exit(1)
+        print(f"No metric regressed by more than {args.threshold:.0%} against {args.compare}")
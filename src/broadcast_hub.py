@@ -0,0 +1,180 @@
+import asyncio
+import json
+from prometheus_client import Counter, Gauge, Histogram
+
+from src.incident_poller import ID_FIELDS, apply_diff
+
+SUBSCRIBERS = Gauge("ws_subscribers", "Connected WebSocket subscribers", ["channel"], multiprocess_mode="livesum")
+SLOW_CONSUMERS = Counter("ws_slow_consumers_total", "Subscribers that fell behind or stalled, by action taken",
+                         ["channel", "action"])
+FANOUT_LATENCY = Histogram("ws_fanout_seconds", "Time from publish to a message being sent to one subscriber",
+                           ["channel"], buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5))
+
+SLOW_CONSUMER_POLICIES = ("resync", "disconnect")
+HEARTBEAT = json.dumps({"type": "heartbeat"})
+
+class _Subscriber:
+    __slots__ = ("ws", "queue", "task", "sending_since")
+
+    def __init__(self, ws, max_queue):
+        self.ws = ws
+        # (serialized message, publish time); bounded so a stalled client cannot grow memory
+        self.queue = asyncio.Queue(maxsize=max_queue)
+        self.task = None
+        self.sending_since = None
+
+class BroadcastHub:
+    """
+    Fans incident messages out to WebSocket subscribers.
+
+    Each message is serialized once and offered to every subscriber's
+    bounded queue without waiting; a writer task per subscriber sends from
+    its queue, so a slow client only delays itself. When a queue is full,
+    `slow_policy` decides: "resync" discards the client's backlog and
+    queues the current snapshot instead (diffs cannot simply be dropped),
+    "disconnect" closes the connection. A watchdog disconnects subscribers
+    whose current send has taken longer than `send_timeout`. Idle
+    subscribers get a heartbeat every `heartbeat_interval` seconds.
+
+    The hub applies incident_diff messages to its own copy of the open
+    incidents and replays it to every new subscriber as an
+    incident_snapshot, shaped like a diff with only "added" entries. A
+    published incident_snapshot replaces that copy, so the poller can
+    resync a hub that missed diffs. All methods run on the event loop, and
+    the state belongs to one process: publishers and subscribers must reach
+    the same worker.
+    """
+
+    def __init__(self, channel="incidents", max_queue=100, slow_policy="resync",
+                 heartbeat_interval=15.0, send_timeout=5.0):
+        if slow_policy not in SLOW_CONSUMER_POLICIES:
+            raise ValueError(f"slow_policy must be one of {SLOW_CONSUMER_POLICIES}")
+        self.channel = channel
+        self.max_queue = max_queue
+        self.slow_policy = slow_policy
+        self.heartbeat_interval = heartbeat_interval
+        self.send_timeout = send_timeout
+        self.incidents = {source: {} for source in ID_FIELDS}
+        self._snapshot = None
+        self._subscribers = set()
+        self._watchdog = None
+        self._latency = FANOUT_LATENCY.labels(channel)
+
+    def __len__(self):
+        return len(self._subscribers)
+
+    def snapshot(self):
+        # Serialized lazily and reused until the next diff changes it
+        if self._snapshot is None:
+            self._snapshot = json.dumps({
+                "type": "incident_snapshot",
+                **{source: {"added": list(incidents.values())} for source, incidents in self.incidents.items()},
+            })
+        return self._snapshot
+
+    def publish(self, msg: dict):
+        """Queue `msg` for every subscriber and return how many it was queued for."""
+        kind = msg.get("type")
+        if kind in ("incident_diff", "incident_snapshot"):
+            if kind == "incident_snapshot":
+                self.incidents = {source: {} for source in ID_FIELDS}
+            for source, id_field in ID_FIELDS.items():
+                if source in msg:
+                    apply_diff(self.incidents[source], msg[source], id_field)
+            self._snapshot = None
+        data = self.snapshot() if kind == "incident_snapshot" else json.dumps(msg)
+        now = asyncio.get_running_loop().time()
+        queued = 0
+        for sub in list(self._subscribers):
+            queued += self._offer(sub, data, now)
+        return queued
+
+    def _offer(self, sub, data, now):
+        try:
+            sub.queue.put_nowait((data, now))
+            return True
+        except asyncio.QueueFull:
+            pass
+        SLOW_CONSUMERS.labels(self.channel, self.slow_policy).inc()
+        if self.slow_policy == "disconnect":
+            self._remove(sub)
+            return False
+        # The snapshot already includes this message
+        while not sub.queue.empty():
+            sub.queue.get_nowait()
+        sub.queue.put_nowait((self.snapshot(), now))
+        return True
+
+    async def serve(self, ws):
+        """Stream to an accepted WebSocket until it disconnects."""
+        sub = _Subscriber(ws, self.max_queue)
+        sub.queue.put_nowait((self.snapshot(), asyncio.get_running_loop().time()))
+        sub.task = asyncio.create_task(self._write(sub))
+        self._subscribers.add(sub)
+        SUBSCRIBERS.labels(self.channel).inc()
+        if self._watchdog is None or self._watchdog.done():
+            self._watchdog = asyncio.create_task(self._watch())
+        try:
+            # Anything the client sends only keeps the connection alive
+            while True:
+                message = await ws.receive()
+                if message["type"] == "websocket.disconnect":
+                    break
+        except Exception:
+            pass
+        finally:
+            self._remove(sub)
+
+    async def _write(self, sub):
+        loop = asyncio.get_running_loop()
+        try:
+            while True:
+                # wait_for costs a task per call, so only idle subscribers pay for it
+                try:
+                    data, published = sub.queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    try:
+                        data, published = await asyncio.wait_for(sub.queue.get(), self.heartbeat_interval)
+                    except asyncio.TimeoutError:
+                        data, published = HEARTBEAT, None
+                sub.sending_since = loop.time()
+                await sub.ws.send_text(data)
+                sub.sending_since = None
+                if published is not None:
+                    self._latency.observe(loop.time() - published)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            # The socket is gone
+            self._remove(sub)
+
+    async def _watch(self):
+        # One timer for all subscribers instead of a timeout around every send
+        loop = asyncio.get_running_loop()
+        while self._subscribers:
+            await asyncio.sleep(min(self.send_timeout, self.heartbeat_interval))
+            now = loop.time()
+            for sub in list(self._subscribers):
+                if sub.sending_since is not None and now - sub.sending_since > self.send_timeout:
+                    SLOW_CONSUMERS.labels(self.channel, "send_timeout").inc()
+                    self._remove(sub)
+
+    def _remove(self, sub):
+        if sub not in self._subscribers:
+            return
+        self._subscribers.discard(sub)
+        SUBSCRIBERS.labels(self.channel).dec()
+        if sub.task is not None and sub.task is not asyncio.current_task():
+            sub.task.cancel()
+        asyncio.ensure_future(self._close(sub.ws))
+
+    @staticmethod
+    async def _close(ws):
+        try:
+            await ws.close()
+        except Exception:
+            pass
+
+    async def close(self):
+        for sub in list(self._subscribers):
+            self._remove(sub)
@@ -0,0 +1,315 @@
+import argparse
+import json
+import os
+import threading
+import time
+import numpy as np
+import pandas as pd
+from sklearn.ensemble import RandomForestClassifier
+from sklearn.linear_model import LogisticRegression
+from xgboost import XGBClassifier
+
+from src.model_store import load_model, compiled_model_path
+
+NODE_ARRAYS = ("feature", "threshold", "left", "right", "value", "missing_left", "roots")
+VERIFY_TOLERANCE = 1e-5
+# Larger batches go to the source model when one is attached; 0 scores every batch here.
+# Unset: the crossover measured by calibrate_max_rows when the model was compiled
+COMPILED_MODEL_MAX_ROWS = os.getenv("COMPILED_MODEL_MAX_ROWS")
+COMPILED_MODEL_MAX_ROWS = int(COMPILED_MODEL_MAX_ROWS) if COMPILED_MODEL_MAX_ROWS else None
+# For models compiled without sample rows: benchmarked crossovers ran from ~250 rows
+# (200 trees per learner) to ~800 (20 trees), and running past it costs more than stopping short
+UNCALIBRATED_MAX_ROWS = 250
+CALIBRATION_BATCH_SIZES = (50, 100, 200, 300, 400, 500, 700, 1000, 1500, 2000)
+VERIFY_CSV = os.path.join(os.getenv("DATA_DIR", "data"), "X_train_bal_adv.csv")
+
+def _pack_trees(trees):
+    """
+    Concatenate per-tree node arrays into one flat forest. Node ids become
+    global; leaves point to themselves and have an infinite threshold, which
+    is how traversal recognizes them.
+    """
+    arrays = {name: [] for name in NODE_ARRAYS[:-1]}
+    roots, offset, depth = [], 0, 0
+    for tree in trees:
+        n = len(tree["feature"])
+        is_leaf = tree["left"] < 0
+        own = np.arange(offset, offset + n, dtype=np.int32)
+        arrays["feature"].append(np.where(is_leaf, 0, tree["feature"]).astype(np.int32))
+        arrays["threshold"].append(np.where(is_leaf, np.inf, tree["threshold"]).astype(np.float64))
+        arrays["left"].append(np.where(is_leaf, own, tree["left"] + offset).astype(np.int32))
+        arrays["right"].append(np.where(is_leaf, own, tree["right"] + offset).astype(np.int32))
+        arrays["value"].append(np.where(is_leaf, tree["value"], 0.0).astype(np.float64))
+        arrays["missing_left"].append(tree["missing_left"].astype(bool))
+        roots.append(offset)
+        offset += n
+        depth = max(depth, tree["depth"])
+    packed = {name: np.concatenate(parts) for name, parts in arrays.items()}
+    packed["roots"] = np.asarray(roots, dtype=np.int32)
+    return packed, depth
+
+def _export_sklearn_forest(forest):
+    trees = []
+    for est in forest.estimators_:
+        t = est.tree_
+        value = t.value[:, 0, :]
+        trees.append({
+            "feature": t.feature,
+            "threshold": t.threshold,
+            "left": t.children_left,
+            "right": t.children_right,
+            "value": value[:, 1] / value.sum(axis=1),
+            "missing_left": getattr(t, "missing_go_to_left", np.zeros(t.node_count, dtype=np.uint8)),
+            "depth": t.max_depth,
+        })
+    packed, depth = _pack_trees(trees)
+    return packed, {"kind": "mean", "depth": depth}
+
+def _tree_depth(left, right):
+    depth, frontier = 0, [0]
+    while frontier:
+        frontier = [c for node in frontier for c in (left[node], right[node]) if c >= 0]
+        depth += bool(frontier)
+    return depth
+
+def _export_xgboost(model):
+    booster = json.loads(model.get_booster().save_raw("json"))["learner"]
+    if booster["objective"]["name"] != "binary:logistic":
+        raise TypeError(f"Unsupported XGBoost objective {booster['objective']['name']}")
+    base_score = float(str(booster["learner_model_param"]["base_score"]).strip("[]"))
+    trees = []
+    for tree in booster["gradient_booster"]["model"]["trees"]:
+        if any(tree.get("split_type", [])):
+            raise TypeError("Categorical XGBoost splits are not supported")
+        left = np.asarray(tree["left_children"])
+        right = np.asarray(tree["right_children"])
+        conditions = np.asarray(tree["split_conditions"], dtype=np.float32)
+        trees.append({
+            "feature": np.asarray(tree["split_indices"]),
+            # XGBoost goes left on x < c in float32; for float32 x that is x <= the float below c
+            "threshold": np.nextafter(conditions, np.float32(-np.inf)),
+            "left": left,
+            "right": right,
+            # Leaf weights are stored in split_conditions
+            "value": conditions.astype(np.float64),
+            "missing_left": np.asarray(tree["default_left"]),
+            "depth": _tree_depth(left, right),
+        })
+    packed, depth = _pack_trees(trees)
+    return packed, {"kind": "logit_sum", "depth": depth, "base_margin": float(np.log(base_score / (1 - base_score)))}
+
+class CompiledStackedModel:
+    """
+    Array-backed copy of a fitted stacked ensemble.
+
+    Every base learner is flattened into node arrays and all of its trees
+    are walked at once with NumPy fancy indexing, one step per tree level.
+    The passthrough LogisticRegression is reduced to its coefficients.
+    Probabilities match the sklearn/XGBoost model to within VERIFY_TOLERANCE.
+
+    That wins on small batches, where sklearn's per-call overhead dominates,
+    but loses to the native tree loops on large ones. With a `fallback`
+    model attached, batches over `max_rows` rows are scored by it instead;
+    a fallback `loader` defers loading that model to the first such batch.
+    """
+
+    def __init__(self, feature_names, ensembles, coef, intercept, threshold=None, calibrated_max_rows=None):
+        self.feature_names = list(feature_names)
+        # ensembles: list of (name, spec, arrays)
+        self.ensembles = ensembles
+        self.coef = np.asarray(coef, dtype=np.float64)
+        self.intercept = float(intercept)
+        # Decision threshold of the source model, so serving never needs the pickle
+        self.threshold = threshold
+        self.classes_ = np.array([0, 1])
+        # Largest batch traversal scored at least as fast as the source model, see calibrate_max_rows
+        self.calibrated_max_rows = calibrated_max_rows
+        self.fallback = None
+        self.max_rows = self.default_max_rows()
+        self._fallback_loader = None
+        self._fallback_lock = threading.Lock()
+
+    def default_max_rows(self):
+        if COMPILED_MODEL_MAX_ROWS is not None:
+            return COMPILED_MODEL_MAX_ROWS
+        return self.calibrated_max_rows or UNCALIBRATED_MAX_ROWS
+
+    def set_fallback(self, model=None, max_rows=None, loader=None):
+        max_rows = self.default_max_rows() if max_rows is None else max_rows
+        self.fallback = model if max_rows > 0 else None
+        self._fallback_loader = loader if max_rows > 0 and model is None else None
+        self.max_rows = max_rows
+        return self
+
+    def _load_fallback(self):
+        with self._fallback_lock:
+            if self.fallback is None:
+                self.fallback = self._fallback_loader()
+                self._fallback_loader = None
+        return self.fallback
+
+    @classmethod
+    def from_model(cls, model):
+        if not getattr(model, "passthrough", False):
+            raise TypeError("Only passthrough stacking models can be compiled")
+        if any(method != "predict_proba" for method in getattr(model, "stack_method_", ["predict_proba"])):
+            raise TypeError("Base learners must be stacked on predict_proba")
+        meta = model.final_estimator_
+        if not isinstance(meta, LogisticRegression) or meta.coef_.shape[0] != 1:
+            raise TypeError("The meta learner must be a binary LogisticRegression")
+        ensembles = []
+        for name, est in model.named_estimators_.items():
+            if isinstance(est, RandomForestClassifier):
+                arrays, spec = _export_sklearn_forest(est)
+            elif isinstance(est, XGBClassifier):
+                arrays, spec = _export_xgboost(est)
+            else:
+                raise TypeError(f"Unsupported base learner {name}: {type(est).__name__}")
+            ensembles.append((name, spec, arrays))
+        return cls(model.feature_names_in_, ensembles, meta.coef_[0], meta.intercept_[0])
+
+    def save(self, path):
+        os.makedirs(path, exist_ok=True)
+        for name, _, arrays in self.ensembles:
+            for key, arr in arrays.items():
+                np.save(os.path.join(path, f"{name}.{key}.npy"), arr)
+        np.save(os.path.join(path, "meta.coef.npy"), self.coef)
+        with open(os.path.join(path, "model.json"), "w") as f:
+            json.dump({
+                "feature_names": self.feature_names,
+                "ensembles": [[name, spec] for name, spec, _ in self.ensembles],
+                "intercept": self.intercept,
+                "threshold": self.threshold,
+                "calibrated_max_rows": self.calibrated_max_rows,
+            }, f)
+
+    @classmethod
+    def load(cls, path, mmap_mode=None):
+        # With mmap_mode="r" the node arrays are shared page cache across processes
+        with open(os.path.join(path, "model.json")) as f:
+            info = json.load(f)
+        ensembles = [
+            (name, spec, {key: np.load(os.path.join(path, f"{name}.{key}.npy"), mmap_mode=mmap_mode)
+                          for key in NODE_ARRAYS})
+            for name, spec in info["ensembles"]
+        ]
+        coef = np.load(os.path.join(path, "meta.coef.npy"))
+        return cls(info["feature_names"], ensembles, coef, info["intercept"], info.get("threshold"),
+                   info.get("calibrated_max_rows"))
+
+    def _matrix(self, X):
+        if isinstance(X, pd.DataFrame):
+            return X[self.feature_names].to_numpy(dtype=np.float64)
+        if isinstance(X, np.ndarray):
+            return X.astype(np.float64, copy=False)
+        # List of transaction dicts: skip pandas entirely
+        return np.array([[row.get(f, np.nan) for f in self.feature_names] for row in X], dtype=np.float64)
+
+    @staticmethod
+    def _traverse(arrays, spec, X32):
+        feature, threshold = arrays["feature"], arrays["threshold"]
+        left, right, missing_left = arrays["left"], arrays["right"], arrays["missing_left"]
+        n_rows, n_features = X32.shape
+        n_trees = len(arrays["roots"])
+        # One entry per (row, tree); entries drop out of `active` once they reach a leaf
+        node = np.tile(arrays["roots"], n_rows)
+        row_offset = np.repeat(np.arange(n_rows) * n_features, n_trees)
+        active = np.arange(node.size)
+        flat_X = X32.ravel()
+        while active.size:
+            current = node[active]
+            x = flat_X[row_offset[active] + feature[current]]
+            go_left = (x <= threshold[current]) | (np.isnan(x) & missing_left[current])
+            current = np.where(go_left, left[current], right[current])
+            node[active] = current
+            active = active[np.isfinite(threshold[current])]
+        leaf = arrays["value"][node].reshape(n_rows, n_trees)
+        if spec["kind"] == "mean":
+            return leaf.mean(axis=1)
+        return 1.0 / (1.0 + np.exp(-(leaf.sum(axis=1) + spec["base_margin"])))
+
+    def predict_proba(self, X):
+        if len(X) > self.max_rows and (self.fallback is not None or self._fallback_loader is not None):
+            return self._load_fallback().predict_proba(self._frame(X))
+        X = self._matrix(X)
+        # Tree splits compare float32-rounded inputs, exactly like sklearn and XGBoost
+        X32 = X.astype(np.float32).astype(np.float64)
+        base = [self._traverse(arrays, spec, X32) for _, spec, arrays in self.ensembles]
+        z = np.column_stack(base + [X]) @ self.coef + self.intercept
+        p = 1.0 / (1.0 + np.exp(-z))
+        return np.column_stack([1 - p, p])
+
+    def _frame(self, X):
+        if isinstance(X, pd.DataFrame):
+            return X[self.feature_names]
+        # Missing keys become NaN, as in _matrix
+        return pd.DataFrame(X, columns=self.feature_names)
+
+    def predict(self, X):
+        return (self.predict_proba(X)[:, 1] >= 0.5).astype(int)
+
+def calibrate_max_rows(model, compiled, X, batch_sizes=CALIBRATION_BATCH_SIZES, repeat=5):
+    """
+    Largest of `batch_sizes` up to which traversal's median latency stays
+    at or below the source model's, both scoring request records as the API
+    does (rows of X repeated as needed); 1 if it never does. Where sklearn
+    starts to win depends on the number and depth of the trees.
+    """
+    def median_s(fn, records):
+        times = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            fn(records)
+            times.append(time.perf_counter() - start)
+        return float(np.median(times))
+
+    traversal = CompiledStackedModel(compiled.feature_names, compiled.ensembles, compiled.coef, compiled.intercept)
+    best = 1
+    for batch in sorted(batch_sizes):
+        records = X.iloc[np.arange(batch) % len(X)].to_dict(orient="records")
+        if median_s(traversal.predict_proba, records) > median_s(lambda r: model.predict_proba(pd.DataFrame(r)), records):
+            break
+        best = batch
+    return best
+
+def compile_model(model, threshold, sample_X=None):
+    """CompiledStackedModel of `model`, calibrated on `sample_X` when given."""
+    compiled = CompiledStackedModel.from_model(model)
+    compiled.threshold = threshold
+    if sample_X is not None and len(sample_X):
+        compiled.calibrated_max_rows = calibrate_max_rows(model, compiled, sample_X[compiled.feature_names])
+    return compiled
+
+def read_verify_rows(path=VERIFY_CSV, rows=1000):
+    # Training rows to verify and calibrate against; None when there is no training set
+    return pd.read_csv(path, nrows=rows) if os.path.exists(path) else None
+
+def export_model(version: int, verify_X: pd.DataFrame = None):
+    """
+    Compile stacked_fraud_model_v{version}.pkl next to the pickle and, when
+    `verify_X` is given, check it against the original model on those rows
+    and calibrate the batch size it serves up to on them.
+    """
+    model_info = load_model(version)
+    model = model_info['model']
+    compiled = compile_model(model, model_info['threshold'], verify_X)
+    if verify_X is not None:
+        diff = np.abs(compiled.predict_proba(verify_X)[:, 1] - model.predict_proba(verify_X)[:, 1]).max()
+        print(f"Max probability difference on {len(verify_X)} rows: {diff:.2e}")
+        if diff > VERIFY_TOLERANCE:
+            raise ValueError(f"Compiled model differs from v{version} by {diff:.2e}")
+    path = compiled_model_path(version)
+    compiled.save(path)
+    return path
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compile a stacked fraud model into array form")
+    parser.add_argument("--version", type=int, required=True)
+    parser.add_argument("--verify-csv", default=VERIFY_CSV)
+    parser.add_argument("--verify-rows", type=int, default=1000)
+    args = parser.parse_args()
+    verify_X = read_verify_rows(args.verify_csv, args.verify_rows)
+    start = time.perf_counter()
+    path = export_model(args.version, verify_X)
+    print(f"Compiled model written to {path} in {time.perf_counter() - start:.1f}s, "
+          f"serving batches up to {CompiledStackedModel.load(path).default_max_rows()} rows")
@@ -1,18 +1,28 @@
 import streamlit as st
 import pandas as pd
-from sqlalchemy import create_engine
 from fpdf import FPDF
 import os
 import requests
 import asyncio
 import json
+import tempfile
+from datetime import datetime, timedelta
 import websockets
+from sqlalchemy import func, select
+from src.db import engine, PredictionLog
+from src.fairness_audit import FAIRNESS_WINDOW_DAYS, audit_gaps
+from src.migrations import check_schema
+from src.incident_poller import ID_FIELDS, apply_diff
 
 # Environment variables
-DB_URL = os.getenv("DATABASE_URL")
-API_TOKEN = os.getenv("API_TOKEN")
+API_URL = os.getenv("API_URL", "http://api:8000")
+API_TOKEN = os.getenv("API_TOKEN", "")
 SLACK_WEBHOOK_URL = os.getenv("SLACK_WEBHOOK_URL")
 GRAFANA_URL = os.getenv("GRAFANA_URL")
+DASHBOARD_CACHE_TTL = int(os.getenv("DASHBOARD_CACHE_TTL", "60"))
+DASHBOARD_PAGE_SIZE = int(os.getenv("DASHBOARD_PAGE_SIZE", "100"))
+# Must not exceed the API's MAX_BATCH_SIZE
+DASHBOARD_BATCH_CHUNK_SIZE = int(os.getenv("DASHBOARD_BATCH_CHUNK_SIZE", "1000"))
 
 # Grafana panel links
 GRAFANA_LINKS = {
@@ -21,21 +31,78 @@ GRAFANA_LINKS = {
     "fraud_spike": f"{GRAFANA_URL}/d/GpK4WWlmz/fraud-spike-dashboard?orgId=1&viewPanel=12"
 }
 
-def run_fairness_audit():
-    engine = create_engine(DB_URL)
-    df = pd.read_sql("SELECT * FROM prediction_log", con=engine)
-    # Extract protected attributes
-    protected_attrs = ["Gender", "Region"]
-    results = []
-    for attr in protected_attrs:
-        if attr not in df.columns and df.shape[0] > 0:
-            # Attempt to parse JSON features column for attr if needed
-            df[attr] = df['features'].apply(lambda x: x.get(attr, None) if isinstance(x, dict) else None)
-        if df[attr].nunique() > 1:
-            group_stats = df.groupby(attr)['predicted_label'].mean()
-            gap = group_stats.max() - group_stats.min()
-            results.append((attr, gap))
-    return results
+@st.cache_resource
+def api_session():
+    # One keep-alive connection pool per dashboard process, shared by every rerun and user
+    session = requests.Session()
+    session.headers["token"] = API_TOKEN
+    return session
+
+@st.cache_resource
+def schema_ready():
+    # Checked once per dashboard process; `python -m src.migrations` (or the API's src.serve) applies migrations
+    check_schema()
+    return True
+
+@st.cache_data(ttl=DASHBOARD_CACHE_TTL, show_spinner="Updating fairness rollup...")
+def run_fairness_audit(window_days=FAIRNESS_WINDOW_DAYS):
+    # Same incremental rollup as the nightly job, so a click never scans the whole log
+    return audit_gaps(window_days)
+
+@st.cache_data(ttl=DASHBOARD_CACHE_TTL)
+def prediction_summary(hours=24):
+    since = datetime.utcnow() - timedelta(hours=hours)
+    stmt = select(func.count(), func.sum(PredictionLog.predicted_label)).where(PredictionLog.prediction_time >= since)
+    with engine.connect() as conn:
+        total, flagged = conn.execute(stmt).one()
+    return total, flagged or 0
+
+@st.cache_data(ttl=DASHBOARD_CACHE_TTL)
+def prediction_page(before_id=None, page_size=DASHBOARD_PAGE_SIZE, flagged_only=False):
+    """
+    One page of prediction_log, newest first, starting below `before_id`.
+    Keyset pagination on the primary key costs the same for every page,
+    unlike OFFSET; the features JSON is left out to keep pages small.
+    """
+    stmt = (
+        select(PredictionLog.id, PredictionLog.prediction_time, PredictionLog.predicted_prob,
+               PredictionLog.predicted_label, PredictionLog.model_version, PredictionLog.threshold)
+        .order_by(PredictionLog.id.desc())
+        .limit(page_size)
+    )
+    if before_id is not None:
+        stmt = stmt.where(PredictionLog.id < before_id)
+    if flagged_only:
+        stmt = stmt.where(PredictionLog.predicted_label == 1)
+    with engine.connect() as conn:
+        return pd.read_sql(stmt, conn)
+
+def score_csv(uploaded, chunk_size=DASHBOARD_BATCH_CHUNK_SIZE, progress=None):
+    """
+    Send an uploaded CSV to /predict/batch one chunk at a time and write
+    the predictions to a temporary CSV. Returns (path, rows, flagged);
+    only one chunk is held in memory.
+    """
+    session = api_session()
+    out = tempfile.NamedTemporaryFile("w", suffix=".csv", delete=False, newline="")
+    rows = flagged = 0
+    try:
+        with out:
+            for i, chunk in enumerate(pd.read_csv(uploaded, chunksize=chunk_size)):
+                # NaN is not valid JSON
+                records = chunk.astype(object).where(chunk.notna(), None).to_dict(orient="records")
+                response = session.post(f"{API_URL}/predict/batch", json=records, timeout=120)
+                response.raise_for_status()
+                predictions = pd.DataFrame(response.json()["predictions"], index=chunk.index)
+                predictions.to_csv(out, index_label="row", header=i == 0)
+                rows += len(predictions)
+                flagged += int(predictions["fraud_prediction"].sum())
+                if progress is not None:
+                    progress.progress(min(uploaded.tell() / max(uploaded.size, 1), 1.0), text=f"{rows} rows scored")
+    except Exception:
+        os.remove(out.name)
+        raise
+    return out.name, rows, flagged
 
 def generate_compliance_report(shap_path, bias_report):
     pdf = FPDF()
@@ -54,26 +121,96 @@ def generate_compliance_report(shap_path, bias_report):
     return report_path
 
 async def incident_ws_client():
-    uri = f"ws://localhost:8000/ws/incidents"
+    uri = f"{API_URL.replace('http', 'ws', 1)}/ws/incidents"
+    # The poller sends added/updated/resolved diffs; keep the open incidents here
+    incidents = {source: {} for source in ID_FIELDS}
+    placeholder = st.empty()
     async with websockets.connect(uri) as websocket:
         while True:
             msg = await websocket.recv()
             data = json.loads(msg)
-            with st.container():
+            if data.get("type") == "heartbeat":
+                continue
+            # Sent on connect and after falling behind: the full current state
+            if data.get("type") == "incident_snapshot":
+                incidents = {source: {} for source in ID_FIELDS}
+            for source, id_field in ID_FIELDS.items():
+                if source in data:
+                    apply_diff(incidents[source], data[source], id_field)
+            with placeholder.container():
                 st.write("### PagerDuty Incidents")
-                for inc in data.get("pagerduty", []):
+                for inc in incidents["pagerduty"].values():
                     st.write(f"**{inc['id']}**: {inc['title']} (Status: {inc['status']})")
                 st.write("### ServiceNow Incidents")
-                for inc in data.get("servicenow", []):
+                for inc in incidents["servicenow"].values():
                     st.write(f"**{inc['sys_id']}**: {inc['short_description']} (State: {inc['state']})")
 
-menu = ["Single Prediction", "Batch Prediction", "Compliance & Fairness", "Incident Monitor"]
+schema_ready()
+menu = ["Single Prediction", "Batch Prediction", "Prediction Log", "Compliance & Fairness", "Incident Monitor"]
 choice = st.sidebar.selectbox("Menu", menu)
 
+if choice == "Single Prediction":
+    st.header("Score a Transaction")
+    raw = st.text_area("Transaction (JSON object of feature values)", height=200)
+    if st.button("Predict") and raw:
+        try:
+            response = api_session().post(f"{API_URL}/predict", json=json.loads(raw), timeout=30)
+            response.raise_for_status()
+            result = response.json()
+            st.metric("Fraud probability", f"{result['fraud_probability']:.2%}")
+            if result["fraud_prediction"]:
+                st.error(f"Flagged as fraud (threshold {result['threshold']:.2f})")
+            else:
+                st.success(f"Not flagged (threshold {result['threshold']:.2f})")
+        except ValueError as e:
+            st.error(f"Invalid JSON: {e}")
+        except requests.RequestException as e:
+            st.error(f"Prediction failed: {e}")
+
+if choice == "Batch Prediction":
+    st.header("Batch Scoring")
+    uploaded = st.file_uploader("Transactions CSV (one column per feature)", type="csv")
+    if uploaded is not None and st.button("Score File"):
+        progress = st.progress(0.0, text="Scoring...")
+        try:
+            path, rows, flagged = score_csv(uploaded, progress=progress)
+        except requests.RequestException as e:
+            st.error(f"Scoring stopped: {e}")
+        else:
+            progress.progress(1.0, text=f"{rows} rows scored")
+            st.metric("Flagged as fraud", f"{flagged} of {rows}")
+            st.dataframe(pd.read_csv(path, nrows=DASHBOARD_PAGE_SIZE))
+            with open(path, "rb") as f:
+                st.download_button("Download Predictions (CSV)", f, file_name="predictions.csv")
+            os.remove(path)
+
+if choice == "Prediction Log":
+    st.header("Logged Predictions")
+    total, flagged = prediction_summary()
+    st.metric("Predictions in the last 24 h", total, f"{flagged} flagged", delta_color="off")
+    flagged_only = st.checkbox("Flagged only")
+    # Stack of page boundaries: the last entry is the id the current page starts below
+    cursors = st.session_state.setdefault("prediction_log_cursors", [None])
+    page = prediction_page(cursors[-1], DASHBOARD_PAGE_SIZE, flagged_only)
+    st.dataframe(page)
+    newer, older, refresh = st.columns(3)
+    if newer.button("Newer", disabled=len(cursors) == 1):
+        cursors.pop()
+        st.rerun()
+    if older.button("Older", disabled=len(page) < DASHBOARD_PAGE_SIZE):
+        cursors.append(int(page["id"].min()))
+        st.rerun()
+    if refresh.button("Refresh"):
+        prediction_page.clear()
+        prediction_summary.clear()
+        cursors[:] = [None]
+        st.rerun()
+
 if choice == "Compliance & Fairness":
     st.header("Compliance & Fairness Audit")
+    window_days = st.number_input("Days audited (0 = all history)", min_value=0, value=FAIRNESS_WINDOW_DAYS)
     if st.button("Run Fairness Audit Now"):
-        audit_results = run_fairness_audit()
+        audit_results = run_fairness_audit(int(window_days))
         st.write("### Fairness Gaps")
         for attr, gap in audit_results:
             st.write(f"{attr}: {gap:.2%}")
@@ -1,28 +1,142 @@
-from sqlalchemy import create_engine, Column, Integer, Float, String, DateTime, JSON, LargeBinary
+from sqlalchemy import create_engine, event, make_url, Column, Integer, Float, String, Date, DateTime, JSON, LargeBinary, Index
+from sqlalchemy.dialects.postgresql import JSONB
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
+from prometheus_client import Counter, Gauge, Histogram
 from datetime import datetime
 import os
+import time
 
 DATABASE_URL = os.getenv("DATABASE_URL", "postgresql://user:pass@db:5432/frauddb")
-engine = create_engine(DATABASE_URL)
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "20"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "1") == "1"
+ASYNC_DRIVERS = {"postgresql": "asyncpg", "sqlite": "aiosqlite"}
+
+POOL_CHECKOUT_LATENCY = Histogram("db_pool_checkout_seconds", "Time to get a connection from the pool", ["pool"])
+POOL_CHECKOUT_TIMEOUTS = Counter("db_pool_checkout_timeouts_total", "Checkouts that hit the pool timeout", ["pool"])
+POOL_CHECKED_OUT = Gauge("db_pool_checked_out", "Connections currently in use", ["pool"], multiprocess_mode="livesum")
+POOL_OVERFLOW = Gauge("db_pool_overflow", "Connections open beyond pool_size", ["pool"], multiprocess_mode="livesum")
+
+class _InstrumentedPool:
+    # Pool.connect covers waiting for a free slot, opening a new connection and the pre-ping
+    def connect(self):
+        start = time.perf_counter()
+        try:
+            return super().connect()
+        except PoolTimeoutError:
+            POOL_CHECKOUT_TIMEOUTS.labels(pool=self.logging_name).inc()
+            raise
+        finally:
+            POOL_CHECKOUT_LATENCY.labels(pool=self.logging_name).observe(time.perf_counter() - start)
+
+    # Overflow drops when a returned connection finds the pool full, after the checkin event,
+    # so follow the counter itself rather than checkout/checkin
+    def _inc_overflow(self):
+        try:
+            return super()._inc_overflow()
+        finally:
+            self._report_overflow()
+
+    def _dec_overflow(self):
+        try:
+            return super()._dec_overflow()
+        finally:
+            self._report_overflow()
+
+    def dispose(self):
+        super().dispose()
+        self._report_overflow()
+
+    def _report_overflow(self):
+        POOL_OVERFLOW.labels(pool=self.logging_name).set(max(self.overflow(), 0))
+
+class InstrumentedQueuePool(_InstrumentedPool, QueuePool):
+    pass
+
+class InstrumentedAsyncQueuePool(_InstrumentedPool, AsyncAdaptedQueuePool):
+    pass
+
+def _track_usage(sync_engine):
+    # checkin fires before the connection is back in the pool, so count events instead of reading the pool
+    def checkout(*args):
+        POOL_CHECKED_OUT.labels(pool=sync_engine.pool.logging_name).inc()
+
+    def checkin(*args):
+        POOL_CHECKED_OUT.labels(pool=sync_engine.pool.logging_name).dec()
+
+    # Listening on the engine keeps the hooks across pool.recreate()/dispose()
+    event.listen(sync_engine, "checkout", checkout)
+    event.listen(sync_engine, "checkin", checkin)
+
+def _pool_options(url, name, pool_class):
+    parsed = make_url(url)
+    if parsed.get_backend_name() == "sqlite" and parsed.database in (None, "", ":memory:"):
+        # In-memory SQLite keeps one connection per thread; pool sizing does not apply
+        return {}
+    return {
+        "poolclass": pool_class,
+        "pool_size": DB_POOL_SIZE,
+        "max_overflow": DB_MAX_OVERFLOW,
+        "pool_timeout": DB_POOL_TIMEOUT,
+        "pool_recycle": DB_POOL_RECYCLE,
+        "pool_pre_ping": DB_POOL_PRE_PING,
+        "pool_logging_name": name,
+    }
+
+def make_engine(url=DATABASE_URL, name="sync"):
+    """
+    Build an engine with the DB_POOL_* settings and pool metrics. Use the
+    shared `engine` below; call this only for a genuinely separate pool.
+    """
+    options = _pool_options(url, name, InstrumentedQueuePool)
+    new_engine = create_engine(url, **options)
+    if options:
+        _track_usage(new_engine)
+    return new_engine
+
+def async_database_url(url=DATABASE_URL):
+    scheme, rest = url.split("://", 1)
+    dialect = scheme.split("+")[0]
+    return f"{dialect}+{ASYNC_DRIVERS[dialect]}://{rest}"
+
+def make_async_engine(url=DATABASE_URL, name="async"):
+    # Imported lazily: asyncpg/aiosqlite are only needed when ASYNC_DB_ENABLED=1
+    from sqlalchemy.ext.asyncio import create_async_engine
+    options = _pool_options(url, name, InstrumentedAsyncQueuePool)
+    new_engine = create_async_engine(async_database_url(url), **options)
+    if options:
+        _track_usage(new_engine.sync_engine)
+    return new_engine
+
+engine = make_engine()
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+_async_sessionmaker = None
 Base = declarative_base()
 
+# JSONB on Postgres: binary storage, expression indexes on feature keys
+FeaturesJSON = JSON().with_variant(JSONB(), "postgresql")
+
 class Feedback(Base):
     __tablename__ = "feedback"
     id = Column(Integer, primary_key=True, index=True)
-    features = Column(JSON, nullable=False)
+    features = Column(FeaturesJSON, nullable=False)
     true_label = Column(Integer, nullable=False)
-    submitted_at = Column(DateTime, default=datetime.utcnow)
+    submitted_at = Column(DateTime, default=datetime.utcnow, index=True)
 
 class PredictionLog(Base):
     __tablename__ = "prediction_log"
     id = Column(Integer, primary_key=True, index=True)
-    features = Column(JSON, nullable=False)
+    features = Column(FeaturesJSON, nullable=False)
     predicted_label = Column(Integer, nullable=False)
     predicted_prob = Column(Float, nullable=False)
-    prediction_time = Column(DateTime, default=datetime.utcnow)
+    prediction_time = Column(DateTime, default=datetime.utcnow, index=True)
+    model_version = Column(Integer)
+    threshold = Column(Float)
 
 class ComplianceReport(Base):
     __tablename__ = "compliance_report"
@@ -34,8 +148,32 @@ class ComplianceReport(Base):
     fairness_gaps = Column(JSON)
     model_version = Column(Integer)
 
-def init_db():
-    Base.metadata.create_all(bind=engine)
+class FairnessRollup(Base):
+    # Prediction counts per (protected attribute, group, day), maintained incrementally
+    __tablename__ = "fairness_rollup"
+    id = Column(Integer, primary_key=True)
+    attribute = Column(String, nullable=False)
+    group_value = Column(String, nullable=False)
+    day = Column(Date)
+    predictions = Column(Integer, nullable=False, default=0)
+    flagged = Column(Integer, nullable=False, default=0)
+    __table_args__ = (Index("ix_fairness_rollup_key", "attribute", "group_value", "day", unique=True),)
+
+class AuditWatermark(Base):
+    # Highest source row id already folded into a rollup
+    __tablename__ = "audit_watermark"
+    name = Column(String, primary_key=True)
+    last_id = Column(Integer, nullable=False, default=0)
+    updated_at = Column(DateTime, default=datetime.utcnow)
+
+class StreamOffset(Base):
+    # Highest Kafka offset per partition whose predictions are already in prediction_log
+    __tablename__ = "stream_offset"
+    consumer_group = Column(String, primary_key=True)
+    topic = Column(String, primary_key=True)
+    kafka_partition = Column(Integer, primary_key=True)
+    last_offset = Column(Integer, nullable=False)
+    updated_at = Column(DateTime, default=datetime.utcnow)
 
 def get_db():
     db = SessionLocal()
@@ -43,3 +181,15 @@ def get_db():
         yield db
     finally:
         db.close()
+
+def async_session():
+    # One async engine per process, created on first use
+    global _async_sessionmaker
+    if _async_sessionmaker is None:
+        from sqlalchemy.ext.asyncio import async_sessionmaker
+        _async_sessionmaker = async_sessionmaker(make_async_engine(), autoflush=False, expire_on_commit=False)
+    return _async_sessionmaker()
+
+async def get_async_db():
+    async with async_session() as db:
+        yield db
@@ -0,0 +1,133 @@
+import json
+import os
+import numpy as np
+import pandas as pd
+from datetime import datetime, timedelta
+from prometheus_client import CollectorRegistry, Gauge, push_to_gateway
+from sqlalchemy import select
+
+from src.db import SessionLocal, Feedback, PredictionLog
+
+DRIFT_BINS = int(os.getenv("DRIFT_BINS", "20"))
+DRIFT_PSI_THRESHOLD = float(os.getenv("DRIFT_PSI_THRESHOLD", "0.2"))
+DRIFT_KS_THRESHOLD = float(os.getenv("DRIFT_KS_THRESHOLD", "0.1"))
+DRIFT_MIN_ROWS = int(os.getenv("DRIFT_MIN_ROWS", "500"))
+DRIFT_WINDOW_HOURS = float(os.getenv("DRIFT_WINDOW_HOURS", "24"))
+DRIFT_CHUNK_SIZE = int(os.getenv("DRIFT_CHUNK_SIZE", "50000"))
+PUSHGATEWAY_URL = os.getenv("PUSHGATEWAY_URL")
+# Timestamps and identifiers always "drift" and would trigger a retrain every night
+DRIFT_EXCLUDE_FEATURES = [c for c in os.getenv("DRIFT_EXCLUDE_FEATURES", "Time,UserID").split(",") if c]
+
+# The retrainer is a batch job, so its gauges live in their own registry and are pushed
+DRIFT_REGISTRY = CollectorRegistry()
+DRIFT_PSI = Gauge("feature_drift_psi", "Population stability index per feature", ["feature"], registry=DRIFT_REGISTRY)
+DRIFT_KS = Gauge("feature_drift_ks", "Binned Kolmogorov-Smirnov statistic per feature", ["feature"], registry=DRIFT_REGISTRY)
+DRIFT_ROWS = Gauge("feature_drift_rows", "Rows compared against the training reference", registry=DRIFT_REGISTRY)
+
+def build_reference(X: pd.DataFrame, bins=DRIFT_BINS, exclude=DRIFT_EXCLUDE_FEATURES):
+    """
+    Pre-bin every numeric training column on its quantiles. The result is
+    small and JSON-serializable, so a drift check never needs the training
+    set again.
+    """
+    reference = {}
+    for col in X.select_dtypes(include=np.number).columns:
+        if col in exclude:
+            continue
+        values = X[col].to_numpy(dtype=float)
+        values = values[~np.isnan(values)]
+        if values.size == 0:
+            continue
+        edges = np.unique(np.quantile(values, np.linspace(0, 1, bins + 1)[1:-1]))
+        reference[col] = {"edges": edges.tolist(), "counts": _histogram(values, edges).tolist()}
+    return reference
+
+def save_reference(reference, path):
+    with open(path, "w") as f:
+        json.dump(reference, f)
+
+def load_reference(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+def _histogram(values, edges):
+    return np.bincount(np.searchsorted(edges, values, side="right"), minlength=len(edges) + 1)
+
+def psi(ref_counts, cur_counts, eps=1e-4):
+    p = np.clip(ref_counts / max(ref_counts.sum(), 1), eps, None)
+    q = np.clip(cur_counts / max(cur_counts.sum(), 1), eps, None)
+    return float(np.sum((q - p) * np.log(q / p)))
+
+def ks(ref_counts, cur_counts):
+    p = np.cumsum(ref_counts) / max(ref_counts.sum(), 1)
+    q = np.cumsum(cur_counts) / max(cur_counts.sum(), 1)
+    return float(np.max(np.abs(p - q)))
+
+class DriftAccumulator:
+    """
+    Accumulates histograms of new data on the reference bins chunk by chunk,
+    so a drift check is a single pass that never holds the new data at once.
+    """
+
+    def __init__(self, reference):
+        self.reference = reference
+        self.edges = {col: np.asarray(ref["edges"]) for col, ref in reference.items()}
+        self.counts = {col: np.zeros(len(ref["counts"]), dtype=np.int64) for col, ref in reference.items()}
+        self.rows = 0
+
+    def update(self, X: pd.DataFrame):
+        self.rows += len(X)
+        for col, edges in self.edges.items():
+            if col not in X.columns:
+                continue
+            values = pd.to_numeric(X[col], errors="coerce").to_numpy(dtype=float)
+            self.counts[col] += _histogram(values[~np.isnan(values)], edges)
+        return self
+
+    def scores(self):
+        return {
+            col: {"psi": psi(np.asarray(ref["counts"]), self.counts[col]),
+                  "ks": ks(np.asarray(ref["counts"]), self.counts[col])}
+            for col, ref in self.reference.items() if self.counts[col].sum() > 0
+        }
+
+def iter_recent_features(hours=DRIFT_WINDOW_HOURS, chunksize=DRIFT_CHUNK_SIZE):
+    since = datetime.utcnow() - timedelta(hours=hours)
+    queries = [
+        select(PredictionLog.features).where(PredictionLog.prediction_time >= since),
+        select(Feedback.features).where(Feedback.submitted_at >= since),
+    ]
+    with SessionLocal() as db:
+        for stmt in queries:
+            for rows in db.execute(stmt.execution_options(yield_per=chunksize)).partitions():
+                yield pd.DataFrame([row.features for row in rows])
+
+def check_drift(reference, chunks, psi_threshold=DRIFT_PSI_THRESHOLD, ks_threshold=DRIFT_KS_THRESHOLD,
+                min_rows=DRIFT_MIN_ROWS):
+    """
+    Return (drifted, scores). Drift is reported when any feature exceeds
+    either threshold; with fewer than `min_rows` new rows nothing is reported.
+    """
+    acc = DriftAccumulator(reference)
+    for X in chunks:
+        acc.update(X)
+    scores = acc.scores()
+    DRIFT_ROWS.set(acc.rows)
+    for col, s in scores.items():
+        DRIFT_PSI.labels(feature=col).set(s["psi"])
+        DRIFT_KS.labels(feature=col).set(s["ks"])
+    if acc.rows < min_rows:
+        return False, scores
+    drifted = any(s["psi"] > psi_threshold or s["ks"] > ks_threshold for s in scores.values())
+    return drifted, scores
+
+def push_drift_metrics(job="fraud_drift_check"):
+    if not PUSHGATEWAY_URL:
+        return
+    try:
+        push_to_gateway(PUSHGATEWAY_URL, job=job, registry=DRIFT_REGISTRY)
+    except Exception as e:
+        print(f"Pushing drift metrics failed: {e}")
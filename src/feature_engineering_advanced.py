@@ -1,31 +1,249 @@
 import pandas as pd
 import numpy as np
 from imblearn.over_sampling import SMOTE
+from sklearn.base import BaseEstimator, TransformerMixin
 from sklearn.ensemble import IsolationForest
-import geopy.distance
 
-def add_advanced_features(df: pd.DataFrame):
+EARTH_RADIUS_KM = 6371.0088
+# WGS-84 ellipsoid, as used by geopy.distance.geodesic
+WGS84_A = 6378.137
+WGS84_F = 1 / 298.257223563
+WGS84_B = WGS84_A * (1 - WGS84_F)
+
+def haversine_km(lat1, lon1, lat2, lon2):
+    """
+    Great-circle distance on a sphere of mean Earth radius. Works on scalars
+    or whole columns; within 0.6% of geopy's geodesic distance.
+    """
+    lat1, lon1, lat2, lon2 = (np.radians(np.asarray(v, dtype=float)) for v in (lat1, lon1, lat2, lon2))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+
+def vincenty_km(lat1, lon1, lat2, lon2, max_iter=200, tol=1e-12):
+    """
+    Vincenty's inverse formula on the WGS-84 ellipsoid, iterated on whole
+    arrays. Converged points agree with geopy's geodesic distance to within a
+    millimetre; nearly antipodal points that do not converge fall back to
+    haversine.
+    """
+    lat1, lon1, lat2, lon2 = np.broadcast_arrays(*(np.asarray(v, dtype=float) for v in (lat1, lon1, lat2, lon2)))
+    u1 = np.arctan((1 - WGS84_F) * np.tan(np.radians(lat1)))
+    u2 = np.arctan((1 - WGS84_F) * np.tan(np.radians(lat2)))
+    sin_u1, cos_u1, sin_u2, cos_u2 = np.sin(u1), np.cos(u1), np.sin(u2), np.cos(u2)
+    big_l = np.radians(lon2 - lon1)
+    lam = big_l.copy()
+    active = np.ones(lam.shape, dtype=bool)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        for _ in range(max_iter):
+            sin_lam, cos_lam = np.sin(lam), np.cos(lam)
+            sin_sigma = np.hypot(cos_u2 * sin_lam, cos_u1 * sin_u2 - sin_u1 * cos_u2 * cos_lam)
+            cos_sigma = sin_u1 * sin_u2 + cos_u1 * cos_u2 * cos_lam
+            sigma = np.arctan2(sin_sigma, cos_sigma)
+            sin_alpha = np.where(sin_sigma == 0, 0.0, cos_u1 * cos_u2 * sin_lam / sin_sigma)
+            cos2_alpha = 1 - sin_alpha ** 2
+            # Equatorial lines have cos2_alpha == 0
+            cos_2sigma_m = np.where(cos2_alpha == 0, 0.0, cos_sigma - 2 * sin_u1 * sin_u2 / cos2_alpha)
+            c = WGS84_F / 16 * cos2_alpha * (4 + WGS84_F * (4 - 3 * cos2_alpha))
+            lam_new = big_l + (1 - c) * WGS84_F * sin_alpha * (
+                sigma + c * sin_sigma * (cos_2sigma_m + c * cos_sigma * (-1 + 2 * cos_2sigma_m ** 2)))
+            converged = np.abs(lam_new - lam) <= tol
+            lam = np.where(active, lam_new, lam)
+            active &= ~converged
+            if not active.any():
+                break
+        u_sq = cos2_alpha * (WGS84_A ** 2 - WGS84_B ** 2) / WGS84_B ** 2
+        big_a = 1 + u_sq / 16384 * (4096 + u_sq * (-768 + u_sq * (320 - 175 * u_sq)))
+        big_b = u_sq / 1024 * (256 + u_sq * (-128 + u_sq * (74 - 47 * u_sq)))
+        delta_sigma = big_b * sin_sigma * (cos_2sigma_m + big_b / 4 * (
+            cos_sigma * (-1 + 2 * cos_2sigma_m ** 2)
+            - big_b / 6 * cos_2sigma_m * (-3 + 4 * sin_sigma ** 2) * (-3 + 4 * cos_2sigma_m ** 2)))
+        dist = WGS84_B * big_a * (sigma - delta_sigma)
+    failed = active | ~np.isfinite(dist)
+    if failed.any():
+        dist = np.where(failed, haversine_km(lat1, lon1, lat2, lon2), dist)
+    return dist
+
+DISTANCE_METHODS = {
+    "haversine": haversine_km,
+    "vincenty": vincenty_km,
+}
+
+class AnomalyScoreTransformer(BaseEstimator, TransformerMixin):
+    """
+    IsolationForest anomaly score as a reusable sklearn transformer.
+
+    Fitted once on the training features and persisted with the model, so
+    inference only runs `score_samples` on the columns seen during `fit`
+    (lower scores are more anomalous).
+    """
+
+    def __init__(self, n_estimators=100, contamination=0.01, random_state=42):
+        self.n_estimators = n_estimators
+        self.contamination = contamination
+        self.random_state = random_state
+
+    def _matrix(self, X):
+        return X.reindex(columns=self.columns_).fillna(0).to_numpy(dtype=float)
+
+    def fit(self, X: pd.DataFrame, y=None):
+        self.columns_ = [c for c in X.select_dtypes(include=np.number).columns if c != 'IsoAnomalyScore']
+        self.iso_ = IsolationForest(n_estimators=self.n_estimators, contamination=self.contamination,
+                                    random_state=self.random_state).fit(self._matrix(X))
+        return self
+
+    def score_samples(self, X: pd.DataFrame):
+        return self.iso_.score_samples(self._matrix(X))
+
+    def score_records(self, records):
+        rows = [[features.get(c, 0) or 0 for c in self.columns_] for features in records]
+        return self.iso_.score_samples(np.asarray(rows, dtype=float).reshape(len(rows), len(self.columns_)))
+
+    def score_one(self, features: dict) -> float:
+        return float(self.score_records([features])[0])
+
+    def transform(self, X: pd.DataFrame):
+        return self.score_samples(X).reshape(-1, 1)
+
+def add_advanced_features(df: pd.DataFrame, expanding: bool = False, distance: str = "haversine", *,
+                          anomaly_detector: AnomalyScoreTransformer):
+    """
+    Add temporal, profiling, geospatial and anomaly features.
+
+    By default per-user aggregates use the whole frame. With `expanding=True`
+    every row only sees itself and earlier rows of the same user (rows must be
+    in arrival order), which is what OnlineFeatureEngine produces one
+    transaction at a time. `distance` selects the DistFromHomeKM kernel from
+    DISTANCE_METHODS. IsoAnomalyScore comes from `anomaly_detector`, fitted
+    once with `fit_anomaly_detector` on the training frame, never refitted here.
+    """
+    df = _base_features(df, expanding, distance)
+    df['IsoAnomalyScore'] = anomaly_detector.score_samples(df)
+    df.fillna(0, inplace=True)
+    return df
+
+def fit_anomaly_detector(df: pd.DataFrame, expanding: bool = False, distance: str = "haversine"):
+    return AnomalyScoreTransformer().fit(_base_features(df, expanding, distance))
+
+def add_anomaly_score(X, anomaly_detector: AnomalyScoreTransformer):
+    """
+    IsoAnomalyScore of every row from a fitted detector, added to a copy of
+    the DataFrame or of each request record, as the model was trained on.
+    """
+    if isinstance(X, pd.DataFrame):
+        return X.assign(IsoAnomalyScore=anomaly_detector.score_samples(X))
+    scores = anomaly_detector.score_records(X)
+    return [{**txn, 'IsoAnomalyScore': float(score)} for txn, score in zip(X, scores)]
+
+def _base_features(df: pd.DataFrame, expanding: bool, distance: str):
+    distance_km = DISTANCE_METHODS[distance]
     df = df.copy()
     df['Hour'] = (df['Time'] / 3600) % 24
     df['DayOfWeek'] = (df['Time'] // (3600*24)) % 7
-    df['IsWeekend'] = df['DayOfWeek'].apply(lambda x: 1 if x in [5, 6] else 0)
-    if 'UserID' in df.columns:
-        user_avg = df.groupby('UserID')['Amount'].mean()
-        df['UserAvgAmount'] = df['UserID'].map(user_avg)
-        df['AmtDeviationFromUser'] = df['Amount'] - df['UserAvgAmount']
-    df['PrevTime'] = df['Time'].shift(1)
+    df['IsWeekend'] = df['DayOfWeek'].isin([5, 6]).astype(int)
+    if expanding:
+        keys = df['UserID'] if 'UserID' in df.columns else pd.Series(0, index=df.index)
+        by_user = df.groupby(keys, sort=False)
+        seen = by_user.cumcount() + 1
+        if 'UserID' in df.columns:
+            df['UserAvgAmount'] = by_user['Amount'].cumsum() / seen
+            df['AmtDeviationFromUser'] = df['Amount'] - df['UserAvgAmount']
+        df['PrevTime'] = by_user['Time'].shift(1)
+    else:
+        if 'UserID' in df.columns:
+            user_avg = df.groupby('UserID')['Amount'].mean()
+            df['UserAvgAmount'] = df['UserID'].map(user_avg)
+            df['AmtDeviationFromUser'] = df['Amount'] - df['UserAvgAmount']
+        df['PrevTime'] = df['Time'].shift(1)
     df['TimeDelta'] = df['Time'] - df['PrevTime']
     df['HighVelocityFlag'] = (df['TimeDelta'] < 60).astype(int)
     if {'Lat', 'Lon'}.issubset(set(df.columns)):
-        user_home = df.groupby('UserID').agg({'Lat':'mean','Lon':'mean'}).to_dict('index')
-        def dist_from_home(row):
-            if row['UserID'] in user_home:
-                home_lat = user_home[row['UserID']]['Lat']
-                home_lon = user_home[row['UserID']]['Lon']
-                return geopy.distance.distance((home_lat, home_lon), (row['Lat'], row['Lon'])).km
-            return 0
-        df['DistFromHomeKM'] = df.apply(dist_from_home, axis=1)
-    iso = IsolationForest(contamination=0.01, random_state=42)
-    df['IsoAnomalyScore'] = iso.fit_predict(df.select_dtypes(include=np.number))
-    df.fillna(0, inplace=True)
+        if expanding:
+            home_lat = by_user['Lat'].cumsum() / seen
+            home_lon = by_user['Lon'].cumsum() / seen
+        else:
+            # Rows without a UserID get no home and end up as 0 after fillna
+            by_home = df.groupby('UserID')
+            home_lat = by_home['Lat'].transform('mean')
+            home_lon = by_home['Lon'].transform('mean')
+        df['DistFromHomeKM'] = distance_km(home_lat.to_numpy(), home_lon.to_numpy(),
+                                           df['Lat'].to_numpy(), df['Lon'].to_numpy())
     return df
+
+class _UserState:
+    __slots__ = ("count", "amount_sum", "lat_sum", "lon_sum", "last_time")
+
+    def __init__(self):
+        self.count = 0
+        self.amount_sum = 0.0
+        self.lat_sum = 0.0
+        self.lon_sum = 0.0
+        self.last_time = None
+
+class OnlineFeatureEngine:
+    """
+    Stateful, per-transaction version of `add_advanced_features`.
+
+    Keeps one `_UserState` per UserID (running amount sum, transaction count,
+    Lat/Lon sums for the home centroid and last transaction time), so each
+    call to `transform_one` is O(1). Replaying transactions in arrival order
+    yields the same features as `add_advanced_features(df, expanding=True)`;
+    IsoAnomalyScore is only emitted when a fitted `anomaly_detector` is given.
+    """
+
+    def __init__(self, distance: str = "haversine", anomaly_detector: AnomalyScoreTransformer = None):
+        self._users = {}
+        self.distance_km = DISTANCE_METHODS[distance]
+        self.anomaly_detector = anomaly_detector
+
+    def __len__(self):
+        return len(self._users)
+
+    def fit(self, df: pd.DataFrame):
+        # Bulk-load state from history instead of replaying it row by row
+        keys = df['UserID'] if 'UserID' in df.columns else pd.Series(0, index=df.index)
+        agg = {'count': ('Amount', 'size'), 'amount_sum': ('Amount', 'sum'), 'last_time': ('Time', 'last')}
+        if {'Lat', 'Lon'}.issubset(set(df.columns)):
+            agg.update(lat_sum=('Lat', 'sum'), lon_sum=('Lon', 'sum'))
+        for key, row in df.groupby(keys, sort=False).agg(**agg).iterrows():
+            state = self._users.setdefault(key, _UserState())
+            state.count += int(row['count'])
+            state.amount_sum += row['amount_sum']
+            state.lat_sum += row.get('lat_sum', 0.0)
+            state.lon_sum += row.get('lon_sum', 0.0)
+            state.last_time = row['last_time']
+        return self
+
+    def transform_one(self, txn: dict) -> dict:
+        feats = dict(txn)
+        t = txn['Time']
+        feats['Hour'] = (t / 3600) % 24
+        feats['DayOfWeek'] = (t // (3600*24)) % 7
+        feats['IsWeekend'] = 1 if feats['DayOfWeek'] in (5, 6) else 0
+
+        key = txn.get('UserID', 0)
+        state = self._users.get(key)
+        if state is None:
+            state = self._users[key] = _UserState()
+        state.count += 1
+        state.amount_sum += txn['Amount']
+        if 'UserID' in txn:
+            feats['UserAvgAmount'] = state.amount_sum / state.count
+            feats['AmtDeviationFromUser'] = txn['Amount'] - feats['UserAvgAmount']
+
+        prev = state.last_time
+        feats['PrevTime'] = prev if prev is not None else 0
+        feats['TimeDelta'] = t - prev if prev is not None else 0
+        feats['HighVelocityFlag'] = int(prev is not None and t - prev < 60)
+        state.last_time = t
+
+        if 'Lat' in txn and 'Lon' in txn:
+            state.lat_sum += txn['Lat']
+            state.lon_sum += txn['Lon']
+            feats['DistFromHomeKM'] = float(self.distance_km(
+                state.lat_sum / state.count, state.lon_sum / state.count, txn['Lat'], txn['Lon']))
+        if self.anomaly_detector is not None:
+            feats['IsoAnomalyScore'] = self.anomaly_detector.score_one(feats)
+        return feats
+
+    def transform(self, transactions):
+        return pd.DataFrame([self.transform_one(txn) for txn in transactions])
@@ -0,0 +1,157 @@
+import csv
+import inspect
+import json
+import os
+from datetime import datetime
+from starlette.concurrency import run_in_threadpool
+
+from src.db import async_session, engine, Feedback
+
+FEEDBACK_CHUNK_SIZE = int(os.getenv("FEEDBACK_CHUNK_SIZE", "1000"))
+FEEDBACK_MAX_REPORTED_ERRORS = int(os.getenv("FEEDBACK_MAX_REPORTED_ERRORS", "100"))
+LABEL_FIELD = "analyst_label"
+FORMATS = {
+    "application/x-ndjson": "ndjson",
+    "application/jsonl": "ndjson",
+    "application/json-seq": "ndjson",
+    "text/csv": "csv",
+}
+
+def detect_format(content_type: str):
+    return FORMATS.get((content_type or "").split(";")[0].strip().lower())
+
+async def iter_lines(chunks):
+    # Only the current partial line is buffered, whatever the body size.
+    # Lines stay bytes: iter_records decodes them, so a bad one only rejects that row
+    buffer = b""
+    async for chunk in chunks:
+        buffer += chunk
+        *lines, buffer = buffer.split(b"\n")
+        for line in lines:
+            yield line.rstrip(b"\r")
+    if buffer:
+        yield buffer.rstrip(b"\r")
+
+async def iter_records(lines, fmt):
+    """Yield (line_no, item or exception) from NDJSON or CSV lines."""
+    line_no = 0
+    header = None
+    pending = ""
+    async for raw in lines:
+        line_no += 1
+        try:
+            line = raw.decode("utf-8")
+        except UnicodeDecodeError as e:
+            if fmt == "csv" and header is None:
+                raise ValueError(f"CSV header is not valid UTF-8: {e}")
+            # A quoted CSV record spanning this line is lost with it
+            pending = ""
+            yield line_no, ValueError(f"invalid UTF-8: {e}")
+            continue
+        if fmt == "ndjson":
+            if not line.strip():
+                continue
+            try:
+                yield line_no, json.loads(line)
+            except ValueError as e:
+                yield line_no, ValueError(f"invalid JSON: {e}")
+            continue
+        # A quoted CSV field may contain newlines: wait until quotes balance
+        pending = f"{pending}\n{line}" if pending else line
+        if pending.count('"') % 2:
+            continue
+        record, pending = next(csv.reader([pending])), ""
+        if header is None:
+            header = record
+            if LABEL_FIELD not in header:
+                raise ValueError(f"CSV header has no {LABEL_FIELD} column")
+            continue
+        if not any(record):
+            continue
+        if len(record) != len(header):
+            yield line_no, ValueError(f"expected {len(header)} fields, got {len(record)}")
+            continue
+        values = dict(zip(header, record))
+        label = values.pop(LABEL_FIELD)
+        yield line_no, {"features": {k: _csv_value(v) for k, v in values.items()}, LABEL_FIELD: label}
+
+def _csv_value(value):
+    if value == "":
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        return value
+
+def validate_item(item, submitted_at):
+    # Same shape as an item posted to /feedback
+    if not isinstance(item, dict):
+        raise ValueError("record must be an object")
+    features = item.get("features")
+    if not isinstance(features, dict) or not features:
+        raise ValueError("features must be a non-empty object")
+    label = item.get(LABEL_FIELD)
+    if isinstance(label, str):
+        # CSV values arrive as text
+        try:
+            label = float(label)
+        except ValueError:
+            pass
+    # Exactly 0 or 1: no rounding of 0.7 or 1.9, and no booleans (True == 1)
+    if isinstance(label, bool) or not isinstance(label, (int, float)) or label not in (0, 1):
+        raise ValueError(f"{LABEL_FIELD} must be 0 or 1")
+    return {"features": features, "true_label": int(label), "submitted_at": submitted_at}
+
+def insert_feedback(rows):
+    # One multi-row insert per chunk
+    with engine.begin() as conn:
+        conn.execute(Feedback.__table__.insert(), rows)
+
+async def insert_feedback_async(rows):
+    async with async_session() as db:
+        await db.execute(Feedback.__table__.insert(), rows)
+        await db.commit()
+
+async def ingest_feedback(chunks, fmt, chunk_size=FEEDBACK_CHUNK_SIZE, insert=insert_feedback,
+                          max_errors=FEEDBACK_MAX_REPORTED_ERRORS):
+    """
+    Validate a streamed NDJSON or CSV body row by row and insert the valid
+    rows in chunks of `chunk_size`. Bad rows are reported and skipped instead
+    of failing the upload; at most `max_errors` of them are listed.
+    """
+    report = {"accepted": 0, "rejected": 0, "errors": []}
+    submitted_at = datetime.utcnow()
+    rows, lines = [], []
+
+    def reject(line, error, count=1):
+        report["rejected"] += count
+        if len(report["errors"]) < max_errors:
+            report["errors"].append({"line": line, "error": error})
+
+    async def flush():
+        try:
+            if inspect.iscoroutinefunction(insert):
+                await insert(rows)
+            else:
+                await run_in_threadpool(insert, rows)
+            report["accepted"] += len(rows)
+        except Exception as e:
+            reject(f"{lines[0]}-{lines[-1]}", f"insert failed: {e}", len(rows))
+        rows.clear()
+        lines.clear()
+
+    async for line_no, item in iter_records(iter_lines(chunks), fmt):
+        try:
+            if isinstance(item, Exception):
+                raise item
+            rows.append(validate_item(item, submitted_at))
+            lines.append(line_no)
+        except ValueError as e:
+            reject(line_no, str(e))
+            continue
+        if len(rows) >= chunk_size:
+            await flush()
+    if rows:
+        await flush()
+    report["truncated_errors"] = report["rejected"] > len(report["errors"])
+    return report
@@ -1,77 +1,187 @@
+import argparse
 import os
-import pandas as pd
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
 import numpy as np
-import random
-import csv
-from datetime import datetime, timedelta
-from sklearn.datasets import make_classification
+import pandas as pd
 
 # Paths
-DATA_DIR = "data"
-os.makedirs(DATA_DIR, exist_ok=True)
+DATA_DIR = os.getenv("DATA_DIR", "data")
 
 # Parameters
 N_SAMPLES = 1000      # number of synthetic transactions
 N_FEATURES = 8        # additional engineered features
 FRAUD_RATIO = 0.08    # 8% of transactions fraudulent
+N_USERS = 1000        # card holders, with ids from USER_ID_OFFSET
+USER_ID_OFFSET = 1000
+SECONDS_PER_TXN = 200
+START_TIME = datetime(2024, 1, 1).timestamp()
+CHUNK_SIZE = 100_000
+FEEDBACK_FRACTION = 0.005
+LABEL = "Class"
+COLUMNS = [f"Feature{i}" for i in range(1, N_FEATURES + 1)] + ["Time", "Amount", "UserID", "Lat", "Lon"]
+
+def _rng(seed, *key):
+    # Same (seed, key) -> same stream, whichever process or order chunks are generated in
+    return np.random.default_rng([seed, *key])
 
-def generate_transactions():
+def make_users(n_users, seed):
+    """Per-user home location, typical spend and activity level."""
+    rng = _rng(seed, 0)
+    # Heavy-tailed: a few users make most of the transactions
+    activity = rng.pareto(1.5, n_users) + 1
+    return {
+        "home_lat": rng.uniform(-60, 70, n_users),
+        "home_lon": rng.uniform(-180, 180, n_users),
+        "spend": rng.lognormal(np.log(50), 0.8, n_users),
+        "activity": activity / activity.sum(),
+    }
+
+def _feature_model(seed):
+    # Class-conditional Gaussians shared by every chunk, so chunks come from one distribution
+    rng = _rng(seed, 1)
+    means = rng.normal(0, 1, (2, N_FEATURES))
+    mixing = np.eye(N_FEATURES) + rng.normal(0, 0.3, (2, N_FEATURES, N_FEATURES))
+    return means, mixing
+
+def generate_chunk(index, size, n_users=N_USERS, seed=42, fraud_ratio=FRAUD_RATIO,
+                   seconds_per_txn=SECONDS_PER_TXN, chunk_size=None):
+    """
+    Generate transactions [index * chunk_size, index * chunk_size + size)
+    of the dataset. Returns (X, y). Legitimate transactions happen near the
+    user's home and around their usual spend; fraud is a burst right after
+    another transaction on the same card, far away and several times
+    larger, so the velocity, distance and amount-deviation features of
+    add_advanced_features carry signal.
+    """
+    chunk_size = chunk_size or size
+    rng = _rng(seed, 2, index)
+    users = make_users(n_users, seed)
+    means, mixing = _feature_model(seed)
+
+    y = (rng.random(size) < fraud_ratio).astype(int)
+    user = rng.choice(n_users, size=size, p=users["activity"])
+    # Evenly spaced with jitter, so Time stays sorted within and across chunks
+    t = START_TIME + (index * chunk_size + np.arange(size) + rng.random(size)) * seconds_per_txn
+
+    fraud = np.flatnonzero(y)
+    fraud = fraud[fraud > 0]
+    user[fraud] = user[fraud - 1]
+    t[fraud] = t[fraud - 1] + rng.uniform(0.05, 1, len(fraud)) * min(30, seconds_per_txn)
+
+    z = rng.standard_normal((size, N_FEATURES))
+    features = means[y] + np.einsum("ij,ijk->ik", z, mixing[y])
+
+    amount = users["spend"][user] * rng.lognormal(0, 0.5, size)
+    amount[y == 1] *= rng.uniform(1.5, 5.0, int(y.sum()))
+    lat = users["home_lat"][user] + rng.normal(0, 0.3, size)
+    lon = users["home_lon"][user] + rng.normal(0, 0.3, size)
+    far = y == 1
+    lat[far] = rng.uniform(-60, 70, int(far.sum()))
+    lon[far] = rng.uniform(-180, 180, int(far.sum()))
+
+    X = pd.DataFrame(features, columns=COLUMNS[:N_FEATURES])
+    X["Time"] = t
+    X["Amount"] = np.round(amount, 2)
+    X["UserID"] = user + USER_ID_OFFSET
+    X["Lat"] = np.clip(lat, -90, 90)
+    X["Lon"] = (lon + 180) % 360 - 180
+    return X, pd.Series(y, name=LABEL)
+
+def generate_transactions(n_samples=N_SAMPLES, seed=42, n_users=N_USERS):
     """
     Generate semi-realistic credit card transaction dataset.
     """
-    np.random.seed(42)
-    
-    # Create synthetic classification data
-    X, y = make_classification(
-        n_samples=N_SAMPLES,
-        n_features=N_FEATURES,
-        n_informative=6,
-        n_redundant=2,
-        weights=[1 - FRAUD_RATIO, FRAUD_RATIO],
-        random_state=42
-    )
-    
-    df = pd.DataFrame(X, columns=[f"Feature{i}" for i in range(1, N_FEATURES+1)])
-    
-    # Add core transaction-like fields
-    start_time = datetime.now() - timedelta(days=30)
-    df['Time'] = [(start_time + timedelta(seconds=int(i * 200))).timestamp() for i in range(N_SAMPLES)]
-    df['Amount'] = np.round(np.random.exponential(scale=80, size=N_SAMPLES), 2)
-    df['UserID'] = np.random.randint(1000, 2000, size=N_SAMPLES)
-    df['Lat'] = np.random.uniform(-90, 90, size=N_SAMPLES)
-    df['Lon'] = np.random.uniform(-180, 180, size=N_SAMPLES)
-    
-    # Optional extra realistic patterns for fraud
-    df.loc[y == 1, 'Amount'] *= np.random.uniform(1.5, 5.0, size=(y == 1).sum())
-    df.loc[y == 1, 'Feature1'] *= np.random.uniform(2.0, 3.0, size=(y == 1).sum())
-    
-    return df, pd.Series(y, name="Class")
-
-def save_train_files(X_df, y_series):
-    # X_train_bal_adv.csv
-    X_df.to_csv(os.path.join(DATA_DIR, "X_train_bal_adv.csv"), index=False)
-    
-    # y_train_bal_adv.csv
-    y_series.to_csv(os.path.join(DATA_DIR, "y_train_bal_adv.csv"), index=False)
-    
-    print(f"[OK] Saved training data to {DATA_DIR}/")
-
-def save_feedback_file(X_df, y_series):
-    # Create small random feedback set (5 samples)
-    fb_idx = np.random.choice(X_df.index, size=5, replace=False)
-    features = X_df.loc[fb_idx].to_dict(orient="records")
-    labels = y_series.loc[fb_idx].tolist()
-
-    fb_path = os.path.join(DATA_DIR, "feedback_data.csv")
-    with open(fb_path, "w", newline="") as f:
-        writer = csv.writer(f)
-        writer.writerow(["features", "true_label"])
-        for feat, lbl in zip(features, labels):
-            writer.writerow([feat, lbl])
-    print(f"[OK] Created fake feedback file at {fb_path}")
+    return generate_chunk(0, n_samples, n_users=n_users, seed=seed)
+
+def feedback_sample(X, y, fraction, seed, index):
+    # In the CSV layout /feedback/bulk accepts: feature columns plus analyst_label
+    rng = _rng(seed, 3, index)
+    picked = rng.random(len(X)) < fraction
+    return X[picked].assign(analyst_label=y[picked].to_numpy())
+
+def write_shard(index, size, out_dir, fmt, feedback_fraction, **chunk_args):
+    X, y = generate_chunk(index, size, **chunk_args)
+    shard = X.assign(**{LABEL: y.to_numpy()})
+    path = os.path.join(out_dir, f"transactions-{index:05d}.{fmt}")
+    if fmt == "parquet":
+        shard.to_parquet(path, index=False)
+    else:
+        shard.to_csv(path, index=False)
+    feedback = feedback_sample(X, y, feedback_fraction, chunk_args.get("seed", 42), index)
+    if len(feedback):
+        feedback.to_csv(os.path.join(out_dir, f"feedback-{index:05d}.csv"), index=False)
+    return len(shard), int(y.sum()), len(feedback)
+
+def run_ordered(fn, jobs, workers):
+    """
+    Yield fn(*args, **kwargs) for every (args, kwargs) in `jobs`, in order.
+    At most 2 * workers chunks are in flight, so memory is bounded by chunk
+    size rather than dataset size.
+    """
+    if workers <= 1:
+        for args, kwargs in jobs:
+            yield fn(*args, **kwargs)
+        return
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        pending = deque()
+        for args, kwargs in jobs:
+            pending.append(pool.submit(fn, *args, **kwargs))
+            if len(pending) >= 2 * workers:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+def chunk_jobs(rows, chunk_size, **extra):
+    for index, start in enumerate(range(0, rows, chunk_size)):
+        yield (index, min(chunk_size, rows - start)), dict(extra, chunk_size=chunk_size)
+
+def save_train_files(chunks, data_dir=DATA_DIR, feedback_fraction=FEEDBACK_FRACTION, seed=42):
+    """
+    Append generated (X, y) chunks to X_train_bal_adv.csv and
+    y_train_bal_adv.csv, the base training set of src.training_data, and a
+    feedback sample to feedback_data.csv.
+    """
+    os.makedirs(data_dir, exist_ok=True)
+    paths = [os.path.join(data_dir, name) for name in ("X_train_bal_adv.csv", "y_train_bal_adv.csv", "feedback_data.csv")]
+    rows = frauds = n_feedback = 0
+    with open(paths[0], "w", newline="") as fx, open(paths[1], "w", newline="") as fy, \
+            open(paths[2], "w", newline="") as ff:
+        for index, (X, y) in enumerate(chunks):
+            X.to_csv(fx, index=False, header=index == 0)
+            y.to_csv(fy, index=False, header=index == 0)
+            feedback = feedback_sample(X, y, feedback_fraction, seed, index)
+            feedback.to_csv(ff, index=False, header=index == 0)
+            rows, frauds, n_feedback = rows + len(X), frauds + int(y.sum()), n_feedback + len(feedback)
+    print(f"[OK] Saved {rows} transactions ({frauds} fraud) to {paths[0]} and {paths[1]}")
+    print(f"[OK] Saved {n_feedback} feedback rows to {paths[2]}")
 
 if __name__ == "__main__":
-    X_df, y_series = generate_transactions()
-    save_train_files(X_df, y_series)
-    save_feedback_file(X_df, y_series)
-    print("[DONE] Synthetic dataset generation complete.")
+    parser = argparse.ArgumentParser(description="Generate synthetic credit card transactions")
+    parser.add_argument("--rows", type=int, default=N_SAMPLES)
+    parser.add_argument("--users", type=int, default=N_USERS)
+    parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE, help="Rows generated per task; bounds memory")
+    parser.add_argument("--workers", type=int, default=1, help="Processes generating chunks")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--fraud-ratio", type=float, default=FRAUD_RATIO)
+    parser.add_argument("--seconds-per-txn", type=float, default=SECONDS_PER_TXN, help="Mean gap between transactions")
+    parser.add_argument("--feedback-fraction", type=float, default=FEEDBACK_FRACTION)
+    parser.add_argument("--shards", metavar="DIR", help="Write one file per chunk (with a Class column) instead of the training CSVs")
+    parser.add_argument("--format", choices=["parquet", "csv"], default="parquet", help="Shard format")
+    args = parser.parse_args()
+
+    chunk_args = dict(n_users=args.users, seed=args.seed, fraud_ratio=args.fraud_ratio,
+                      seconds_per_txn=args.seconds_per_txn)
+    start = time.perf_counter()
+    if args.shards:
+        os.makedirs(args.shards, exist_ok=True)
+        jobs = chunk_jobs(args.rows, args.chunk_size, out_dir=args.shards, fmt=args.format,
+                          feedback_fraction=args.feedback_fraction, **chunk_args)
+        totals = np.sum(list(run_ordered(write_shard, jobs, args.workers)), axis=0)
+        print(f"[OK] Wrote {totals[0]} transactions ({totals[1]} fraud) and {totals[2]} feedback rows to {args.shards}/")
+    else:
+        chunks = run_ordered(generate_chunk, chunk_jobs(args.rows, args.chunk_size, **chunk_args), args.workers)
+        save_train_files(chunks, feedback_fraction=args.feedback_fraction, seed=args.seed)
+    print(f"[DONE] Synthetic dataset generation complete in {time.perf_counter() - start:.1f}s.")
@@ -1,58 +1,158 @@
 import asyncio
-import requests
 import os
+import random
+import time
+import httpx
 
 API_URL = os.getenv("API_URL", "http://api:8000")
+API_TOKEN = os.getenv("API_TOKEN", "")
 PD_API_KEY = os.getenv("PAGERDUTY_API_KEY")
+PAGERDUTY_API_URL = os.getenv("PAGERDUTY_API_URL", "https://api.pagerduty.com")
 SERVICENOW_INSTANCE = os.getenv("SERVICENOW_INSTANCE")
 SERVICENOW_USER = os.getenv("SERVICENOW_USER")
 SERVICENOW_PASS = os.getenv("SERVICENOW_PASSWORD")
+POLL_INTERVAL = float(os.getenv("INCIDENT_POLL_INTERVAL", "5"))
+POLL_TIMEOUT = float(os.getenv("INCIDENT_POLL_TIMEOUT", "5"))
+MAX_BACKOFF = float(os.getenv("INCIDENT_MAX_BACKOFF", "120"))
+# Every N polls the full state is pushed instead of a diff, so a restarted API catches up; 0 disables
+SNAPSHOT_EVERY = int(os.getenv("INCIDENT_SNAPSHOT_EVERY", "60"))
+ID_FIELDS = {"pagerduty": "id", "servicenow": "sys_id"}
 
-def fetch_pagerduty_incidents():
-    if not PD_API_KEY:
-        return []
-    url = "https://api.pagerduty.com/incidents"
-    headers = {
-        "Authorization": f"Token token={PD_API_KEY}",
-        "Accept": "application/vnd.pagerduty+json;version=2"
+class IncidentSource:
+    """
+    One incident API polled with conditional requests. `incidents` is the
+    last state pushed to the API, keyed by incident id; a fetch is only
+    committed once its diff has been broadcast, so a failed push is retried
+    on the next poll instead of being lost.
+    """
+
+    def __init__(self, name, url, id_field, result_key, params=None, headers=None, auth=None):
+        self.name = name
+        self.url = url
+        self.id_field = id_field
+        self.result_key = result_key
+        self.params = params or {}
+        self.headers = headers or {}
+        self.auth = auth
+        self.etag = None
+        self.incidents = {}
+        self.failures = 0
+        self.retry_at = 0.0
+
+    async def fetch(self, client: httpx.AsyncClient):
+        """Return (etag, incidents by id), or None when unchanged or failed."""
+        if time.monotonic() < self.retry_at:
+            return None
+        headers = dict(self.headers)
+        if self.etag:
+            headers["If-None-Match"] = self.etag
+        try:
+            response = await client.get(self.url, params=self.params, headers=headers, auth=self.auth)
+            if response.status_code == 304:
+                self.failures = 0
+                return None
+            response.raise_for_status()
+            items = response.json().get(self.result_key, [])
+        except Exception as e:
+            self.failures += 1
+            # Exponential backoff with jitter so a flapping API is not hammered in lockstep
+            delay = min(MAX_BACKOFF, POLL_INTERVAL * 2 ** self.failures) * random.uniform(0.5, 1.5)
+            self.retry_at = time.monotonic() + delay
+            print(f"{self.name} fetch error (retry in {delay:.0f}s): {e}")
+            return None
+        self.failures = 0
+        return response.headers.get("ETag"), {str(item[self.id_field]): item for item in items}
+
+    def commit(self, etag, incidents):
+        self.etag, self.incidents = etag, incidents
+
+def diff_incidents(previous: dict, current: dict):
+    return {
+        "added": [inc for key, inc in current.items() if key not in previous],
+        "updated": [inc for key, inc in current.items() if key in previous and previous[key] != inc],
+        "resolved": [key for key in previous if key not in current],
     }
-    params = {"statuses[]": "triggered", "limit": 10}
-    try:
-        response = requests.get(url, headers=headers, params=params)
-        response.raise_for_status()
-        return response.json().get("incidents", [])
-    except Exception as e:
-        print(f"PagerDuty fetch error: {e}")
-        return []
-
-def fetch_servicenow_incidents():
-    if not SERVICENOW_INSTANCE:
-        return []
-    url = f"{SERVICENOW_INSTANCE}/api/now/table/incident"
-    params = {"sysparm_query": "state=1", "sysparm_limit": 10}
-    try:
-        response = requests.get(url, auth=(SERVICENOW_USER, SERVICENOW_PASS), params=params)
-        response.raise_for_status()
-        return response.json().get("result", [])
-    except Exception as e:
-        print(f"ServiceNow fetch error: {e}")
-        return []
-
-async def poll_and_push():
-    previous_pd = []
-    previous_sn = []
-    while True:
-        pd_incidents = fetch_pagerduty_incidents()
-        sn_incidents = fetch_servicenow_incidents()
-        if pd_incidents != previous_pd or sn_incidents != previous_sn:
-            msg = {"pagerduty": pd_incidents, "servicenow": sn_incidents}
+
+def apply_diff(incidents: dict, diff: dict, id_field: str):
+    # Inverse of diff_incidents, for consumers rebuilding the current state
+    for inc in diff.get("added", []) + diff.get("updated", []):
+        incidents[str(inc[id_field])] = inc
+    for key in diff.get("resolved", []):
+        incidents.pop(key, None)
+    return incidents
+
+def build_sources():
+    sources = []
+    if PD_API_KEY:
+        sources.append(IncidentSource(
+            "pagerduty", f"{PAGERDUTY_API_URL}/incidents", ID_FIELDS["pagerduty"], "incidents",
+            params={"statuses[]": "triggered", "limit": 10},
+            headers={"Authorization": f"Token token={PD_API_KEY}",
+                     "Accept": "application/vnd.pagerduty+json;version=2"},
+        ))
+    if SERVICENOW_INSTANCE:
+        sources.append(IncidentSource(
+            "servicenow", f"{SERVICENOW_INSTANCE}/api/now/table/incident", ID_FIELDS["servicenow"], "result",
+            params={"sysparm_query": "state=1", "sysparm_limit": 10},
+            auth=(SERVICENOW_USER, SERVICENOW_PASS),
+        ))
+    return sources
+
+def snapshot_message(sources, results):
+    # Shaped like a diff with only "added" entries, as BroadcastHub.snapshot()
+    msg = {"type": "incident_snapshot"}
+    for source, result in zip(sources, results):
+        incidents = source.incidents if result is None else result[1]
+        msg[source.name] = {"added": list(incidents.values())}
+    return msg
+
+async def poll_once(client: httpx.AsyncClient, sources, api_url=API_URL, snapshot=False):
+    """
+    Fetch every source concurrently and push one message with the per-source
+    added/updated/resolved incidents, or with `snapshot` the full current
+    incidents of every source, which replace whatever the API holds.
+    Returns the message, or None if nothing changed. Raises if the push
+    failed; nothing is committed then.
+    """
+    results = await asyncio.gather(*(source.fetch(client) for source in sources))
+    changes = []
+    for source, result in zip(sources, results):
+        if result is None:
+            continue
+        diff = diff_incidents(source.incidents, result[1])
+        if any(diff.values()) or snapshot:
+            changes.append((source, diff, result))
+        else:
+            source.commit(*result)
+    if snapshot:
+        msg = snapshot_message(sources, results)
+    elif changes:
+        msg = {"type": "incident_diff", **{source.name: diff for source, diff, _ in changes}}
+    else:
+        return None
+    response = await client.post(f"{api_url}/broadcast_incident", json=msg, headers={"token": API_TOKEN})
+    response.raise_for_status()
+    for source, _, result in changes:
+        source.commit(*result)
+    return msg
+
+async def poll_and_push(sources=None, api_url=API_URL, interval=POLL_INTERVAL, snapshot_every=SNAPSHOT_EVERY):
+    sources = build_sources() if sources is None else sources
+    # The API may hold incidents from before this poller started, so begin with a snapshot
+    polls, resync = 0, True
+    # One pooled client: connections to both APIs and to our API are kept alive between polls
+    async with httpx.AsyncClient(timeout=POLL_TIMEOUT, limits=httpx.Limits(max_keepalive_connections=10)) as client:
+        while True:
+            snapshot = resync or (snapshot_every > 0 and polls % snapshot_every == 0)
             try:
-                requests.post(f"{API_URL}/broadcast_incident", json=msg, headers={"token": os.getenv("API_TOKEN")}, timeout=5)
+                await poll_once(client, sources, api_url, snapshot)
+                resync = False
             except Exception as e:
+                # The API may have applied the message or not; the next snapshot settles it either way
                 print(f"Broadcast error: {e}")
-            previous_pd = pd_incidents
-            previous_sn = sn_incidents
-        await asyncio.sleep(5)
+                resync = True
+            polls += 1
+            await asyncio.sleep(interval)
 
 if __name__ == "__main__":
     asyncio.run(poll_and_push())
@@ -0,0 +1,223 @@
+import json
+import os
+import time
+from datetime import datetime
+import pandas as pd
+from kafka import KafkaConsumer, KafkaProducer
+from prometheus_client import Counter, Gauge, Histogram, start_http_server
+from sqlalchemy import select
+
+from src.db import engine, PredictionLog, StreamOffset
+from src.migrations import check_schema
+from src.model_store import get_current_version, load_model, load_anomaly_detector
+from src.feature_engineering_advanced import add_anomaly_score
+
+KAFKA_BOOTSTRAP_SERVERS = os.getenv("KAFKA_BOOTSTRAP_SERVERS", "kafka:9092")
+INPUT_TOPIC = os.getenv("KAFKA_INPUT_TOPIC", "transactions")
+OUTPUT_TOPIC = os.getenv("KAFKA_OUTPUT_TOPIC", "fraud_scores")
+GROUP_ID = os.getenv("KAFKA_GROUP_ID", "fraud_scoring")
+BATCH_SIZE = int(os.getenv("KAFKA_BATCH_SIZE", "1000"))
+POLL_TIMEOUT_MS = int(os.getenv("KAFKA_POLL_TIMEOUT_MS", "500"))
+METRICS_PORT = int(os.getenv("KAFKA_METRICS_PORT", "8001"))
+LAG_CHECK_INTERVAL = float(os.getenv("KAFKA_LAG_CHECK_INTERVAL", "15"))
+MODEL_CHECK_INTERVAL = float(os.getenv("KAFKA_MODEL_CHECK_INTERVAL", "30"))
+SEND_TIMEOUT = float(os.getenv("KAFKA_SEND_TIMEOUT", "30"))
+
+RECORDS_CONSUMED = Counter("kafka_scoring_records_total", "Records consumed from the input topic")
+RECORDS_INVALID = Counter("kafka_scoring_invalid_records_total", "Records skipped because they could not be parsed or scored")
+FRAUD_FLAGS = Counter("kafka_scoring_fraud_flags_total", "Stream records flagged as fraud")
+BATCH_LATENCY = Histogram("kafka_scoring_batch_seconds", "Time from poll to offset commit for one batch")
+THROUGHPUT = Gauge("kafka_scoring_records_per_second", "Records per second in the last committed batch")
+SEND_FAILURES = Counter("kafka_scoring_send_failures_total", "Batches re-consumed because a score could not be produced")
+CONSUMER_LAG = Gauge("kafka_scoring_consumer_lag", "Records behind the partition end offset", ["partition"])
+
+def _deserialize(raw):
+    # Malformed payloads become None so one bad record cannot crash poll()
+    try:
+        return json.loads(raw)
+    except Exception:
+        return None
+
+def build_consumer():
+    return KafkaConsumer(
+        INPUT_TOPIC,
+        bootstrap_servers=KAFKA_BOOTSTRAP_SERVERS,
+        group_id=GROUP_ID,
+        enable_auto_commit=False,
+        auto_offset_reset="earliest",
+        max_poll_records=BATCH_SIZE,
+        value_deserializer=_deserialize
+    )
+
+def build_producer():
+    return KafkaProducer(
+        bootstrap_servers=KAFKA_BOOTSTRAP_SERVERS,
+        value_serializer=lambda v: json.dumps(v).encode("utf-8"),
+        linger_ms=5,
+        acks="all"
+    )
+
+def write_predictions(rows, sources, offsets, group_id=GROUP_ID):
+    """
+    Insert `rows` (rows[i] came from sources[i] = (topic, partition, offset))
+    and raise the stored offset of each partition to `offsets[(topic, partition)]`
+    in one transaction. Rows at or below the stored offset were written by an
+    earlier attempt whose Kafka commit never happened, and are skipped.
+    """
+    table = StreamOffset.__table__
+    with engine.begin() as conn:
+        stored = {(topic, partition): offset for topic, partition, offset in conn.execute(
+            select(table.c.topic, table.c.kafka_partition, table.c.last_offset)
+            .where(table.c.consumer_group == group_id).with_for_update()
+        )}
+        fresh = [row for row, (topic, partition, offset) in zip(rows, sources)
+                 if offset > stored.get((topic, partition), -1)]
+        if fresh:
+            conn.execute(PredictionLog.__table__.insert(), fresh)
+        for (topic, partition), offset in offsets.items():
+            values = {"last_offset": offset, "updated_at": datetime.utcnow()}
+            if (topic, partition) not in stored:
+                conn.execute(table.insert().values(consumer_group=group_id, topic=topic,
+                                                   kafka_partition=partition, **values))
+            elif offset > stored[(topic, partition)]:
+                conn.execute(table.update().values(**values).where(
+                    table.c.consumer_group == group_id, table.c.topic == topic, table.c.kafka_partition == partition))
+    return len(fresh)
+
+class StreamScorer:
+    """
+    Polls transactions in batches, scores each batch with one predict_proba
+    call and commits offsets only once results are in Kafka and Postgres.
+    If any score cannot be produced the batch is rewound, not committed, and
+    consumed again; the stored offsets keep the retry from logging it twice.
+    """
+
+    def __init__(self, consumer, producer, output_topic=OUTPUT_TOPIC, batch_size=BATCH_SIZE,
+                 writer=write_predictions):
+        self.consumer = consumer
+        self.producer = producer
+        self.output_topic = output_topic
+        self.batch_size = batch_size
+        self.writer = writer
+        self.version = None
+        self.model = None
+        self.threshold = None
+        self.anomaly_detector = None
+        self._last_lag_check = 0.0
+        self._last_model_check = 0.0
+
+    def load_current_model(self):
+        version = get_current_version()
+        if version is None or version == self.version:
+            return
+        model_info = load_model(version)
+        self.model, self.threshold, self.version = model_info['model'], model_info['threshold'], version
+        self.anomaly_detector = load_anomaly_detector(version)
+        print(f"Scoring with model version {version}")
+
+    def frame(self, transactions):
+        X = pd.DataFrame(transactions)
+        return X if self.anomaly_detector is None else add_anomaly_score(X, self.anomaly_detector)
+
+    def score(self, transactions):
+        try:
+            return list(self.model.predict_proba(self.frame(transactions))[:, 1])
+        except Exception:
+            # Fall back to per-record scoring so a bad record only drops itself
+            probs = []
+            for txn in transactions:
+                try:
+                    probs.append(self.model.predict_proba(self.frame([txn]))[0, 1])
+                except Exception as e:
+                    print(f"Scoring error: {e}")
+                    probs.append(None)
+            return probs
+
+    def process_batch(self, records):
+        messages = [msg for msgs in records.values() for msg in msgs]
+        valid = [msg for msg in messages if isinstance(msg.value, dict)]
+        RECORDS_CONSUMED.inc(len(messages))
+        RECORDS_INVALID.inc(len(messages) - len(valid))
+        rows, sources, sends = [], [], []
+        if valid:
+            probs = self.score([msg.value for msg in valid])
+            for msg, prob in zip(valid, probs):
+                if prob is None:
+                    RECORDS_INVALID.inc()
+                    continue
+                pred = int(prob >= self.threshold)
+                rows.append({"features": msg.value, "predicted_label": pred, "predicted_prob": float(prob),
+                             "model_version": self.version, "threshold": float(self.threshold)})
+                sources.append((msg.topic, msg.partition, msg.offset))
+                sends.append(self.producer.send(self.output_topic, key=msg.key, value={
+                    "transaction": msg.value,
+                    "fraud_prediction": pred,
+                    "fraud_probability": float(prob),
+                    "threshold": float(self.threshold),
+                    "model_version": self.version
+                }))
+        try:
+            self.producer.flush(timeout=SEND_TIMEOUT)
+            for future in sends:
+                future.get(timeout=SEND_TIMEOUT)
+        except Exception as e:
+            SEND_FAILURES.inc()
+            print(f"Could not produce scores, batch will be consumed again: {e}")
+            self.rewind(records)
+            return 0
+        offsets = {(tp.topic, tp.partition): msgs[-1].offset for tp, msgs in records.items() if msgs}
+        self.writer(rows, sources, offsets)
+        self.consumer.commit()
+        FRAUD_FLAGS.inc(sum(row["predicted_label"] for row in rows))
+        return len(messages)
+
+    def rewind(self, records):
+        # The next poll returns the batch again
+        for tp, msgs in records.items():
+            if msgs:
+                self.consumer.seek(tp, msgs[0].offset)
+
+    def update_lag(self):
+        partitions = self.consumer.assignment()
+        if not partitions:
+            return
+        end_offsets = self.consumer.end_offsets(list(partitions))
+        for tp in partitions:
+            CONSUMER_LAG.labels(partition=str(tp.partition)).set(max(end_offsets[tp] - self.consumer.position(tp), 0))
+
+    def run_once(self):
+        now = time.monotonic()
+        if now - self._last_model_check >= MODEL_CHECK_INTERVAL:
+            self.load_current_model()
+            self._last_model_check = now
+        records = self.consumer.poll(timeout_ms=POLL_TIMEOUT_MS, max_records=self.batch_size)
+        n = 0
+        if records:
+            start = time.perf_counter()
+            n = self.process_batch(records)
+            elapsed = time.perf_counter() - start
+            BATCH_LATENCY.observe(elapsed)
+            THROUGHPUT.set(n / elapsed if elapsed > 0 else 0)
+        if now - self._last_lag_check >= LAG_CHECK_INTERVAL:
+            self.update_lag()
+            self._last_lag_check = now
+        return n
+
+    def run(self):
+        self.load_current_model()
+        while True:
+            if self.model is None:
+                time.sleep(MODEL_CHECK_INTERVAL)
+                self.load_current_model()
+                continue
+            self.run_once()
+
+if __name__ == "__main__":
+    check_schema()
+    start_http_server(METRICS_PORT)
+    scorer = StreamScorer(build_consumer(), build_producer())
+    try:
+        scorer.run()
+    finally:
+        scorer.consumer.close()
+        scorer.producer.close()
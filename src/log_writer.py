@@ -0,0 +1,158 @@
+import queue
+import threading
+import time
+from prometheus_client import Counter, Gauge, Histogram
+from sqlalchemy.exc import InterfaceError, OperationalError, TimeoutError as PoolTimeoutError
+
+from src.db import engine
+
+QUEUE_DEPTH = Gauge("write_behind_queue_depth", "Rows waiting to be written", ["table"], multiprocess_mode="livesum")
+FLUSH_LATENCY = Histogram("write_behind_flush_seconds", "Time spent writing one batch", ["table"])
+ROWS_WRITTEN = Counter("write_behind_rows_written_total", "Rows written by the write-behind logger", ["table"])
+ROWS_DROPPED = Counter("write_behind_rows_dropped_total", "Rows dropped by the write-behind logger", ["table", "reason"])
+WRITE_RETRIES = Counter("write_behind_retries_total", "Batch writes retried after a database error", ["table"])
+
+DROP_POLICIES = ("block", "drop_newest", "drop_oldest")
+# Connection loss, failover, pool exhaustion: the same insert can succeed later
+TRANSIENT_ERRORS = (OperationalError, InterfaceError, PoolTimeoutError)
+MAX_RETRY_BACKOFF = 30.0
+
+_STOP = object()
+
+class WriteBehindWriter:
+    """
+    Buffers rows for one table in a bounded queue and writes them from a
+    background thread with executemany inserts.
+
+    A batch is written when `batch_size` rows are buffered or `flush_interval`
+    seconds have passed since its first row. When the queue is full,
+    `drop_policy` decides what happens: "block" applies backpressure for up to
+    `block_timeout` seconds (forever if None) before dropping the new row,
+    "drop_newest" drops the new row and "drop_oldest" evicts the oldest one.
+
+    A batch that fails with a connection-type error is retried with
+    exponential backoff starting at `retry_backoff` seconds, and dropped
+    after `max_retries` retries (never if None). While it retries nothing
+    else is written, so the queue fills and `drop_policy` applies. Any other
+    error means a bad row: the batch is written row by row and only the
+    rows that still fail are dropped.
+    """
+
+    def __init__(self, table, max_queue=10000, batch_size=500, flush_interval=1.0,
+                 drop_policy="block", block_timeout=1.0, bind=engine, max_retries=3, retry_backoff=0.5):
+        if drop_policy not in DROP_POLICIES:
+            raise ValueError(f"drop_policy must be one of {DROP_POLICIES}")
+        self.table = table
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.drop_policy = drop_policy
+        self.block_timeout = block_timeout
+        self.bind = bind
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name=f"write-behind-{table.name}", daemon=True)
+        self._thread.start()
+
+    def put(self, row: dict) -> bool:
+        if self._closed:
+            ROWS_DROPPED.labels(table=self.table.name, reason="closed").inc()
+            return False
+        if self.drop_policy == "block":
+            try:
+                self._queue.put(row, timeout=self.block_timeout)
+                return True
+            except queue.Full:
+                ROWS_DROPPED.labels(table=self.table.name, reason="queue_full").inc()
+                return False
+        while True:
+            try:
+                self._queue.put_nowait(row)
+                return True
+            except queue.Full:
+                if self.drop_policy == "drop_newest":
+                    ROWS_DROPPED.labels(table=self.table.name, reason="queue_full").inc()
+                    return False
+                try:
+                    self._queue.get_nowait()
+                    ROWS_DROPPED.labels(table=self.table.name, reason="evicted").inc()
+                except queue.Empty:
+                    pass
+
+    def put_many(self, rows) -> int:
+        written = sum(self.put(row) for row in rows)
+        self._update_depth()
+        return written
+
+    def _update_depth(self):
+        # After every enqueue and flush, so the gauge also works in multiprocess mode
+        QUEUE_DEPTH.labels(table=self.table.name).set(self._queue.qsize())
+
+    def close(self, timeout=None):
+        # Drain everything already queued, then stop the writer thread
+        if self._closed:
+            return
+        self._closed = True
+        self._queue.put(_STOP)
+        self._thread.join(timeout)
+
+    def _write(self, rows):
+        start = time.perf_counter()
+        try:
+            self._insert(rows)
+        except Exception as e:
+            if len(rows) == 1:
+                self._reject(rows, e)
+            else:
+                # A retry would fail the same way: find the bad rows and keep the rest
+                for row in rows:
+                    try:
+                        self._insert([row])
+                    except Exception as e:
+                        self._reject([row], e)
+        FLUSH_LATENCY.labels(table=self.table.name).observe(time.perf_counter() - start)
+
+    def _insert(self, rows):
+        attempt = 0
+        while True:
+            try:
+                with self.bind.begin() as conn:
+                    conn.execute(self.table.insert(), rows)
+                ROWS_WRITTEN.labels(table=self.table.name).inc(len(rows))
+                return
+            except TRANSIENT_ERRORS as e:
+                attempt += 1
+                if self.max_retries is not None and attempt > self.max_retries:
+                    ROWS_DROPPED.labels(table=self.table.name, reason="write_error").inc(len(rows))
+                    print(f"Write-behind flush to {self.table.name} failed {attempt} times, dropped {len(rows)} rows: {e}")
+                    return
+                delay = min(self.retry_backoff * 2 ** (attempt - 1), MAX_RETRY_BACKOFF)
+                WRITE_RETRIES.labels(table=self.table.name).inc()
+                print(f"Write-behind flush to {self.table.name} failed, retrying in {delay:.1f}s: {e}")
+                time.sleep(delay)
+
+    def _reject(self, rows, error):
+        ROWS_DROPPED.labels(table=self.table.name, reason="rejected").inc(len(rows))
+        print(f"Write-behind row rejected by {self.table.name}: {error}")
+
+    def _run(self):
+        stopping = False
+        while not stopping:
+            first = self._queue.get()
+            if first is _STOP:
+                break
+            rows = [first]
+            deadline = time.monotonic() + self.flush_interval
+            while len(rows) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                try:
+                    row = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if row is _STOP:
+                    stopping = True
+                    break
+                rows.append(row)
+            self._write(rows)
+            self._update_depth()
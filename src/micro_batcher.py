@@ -0,0 +1,116 @@
+import queue
+import threading
+import time
+from concurrent.futures import Future, TimeoutError as FutureTimeout
+from prometheus_client import Histogram
+
+MICROBATCH_SIZE = Histogram(
+    "fraud_microbatch_size", "Number of transactions scored per micro-batch",
+    buckets=(1, 2, 4, 8, 16, 32, 64, 128, 256)
+)
+
+_STOP = object()
+
+class MicroBatcher:
+    """
+    Collects concurrent single-transaction requests into one model call.
+
+    A batch is scored as soon as `max_batch_size` items are queued or
+    `max_wait_ms` has passed since the first item arrived, whichever is first.
+    `score_fn` takes a list of items and returns one result per item.
+    `score` waits at most `timeout` seconds for its result.
+    """
+
+    def __init__(self, score_fn, max_batch_size=64, max_wait_ms=2.0, timeout=30.0):
+        self.score_fn = score_fn
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+        self.timeout = timeout
+        self._queue = queue.Queue()
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name="micro-batcher", daemon=True)
+        self._thread.start()
+
+    def submit(self, item) -> Future:
+        fut = Future()
+        if self._closed:
+            fut.set_exception(RuntimeError("Micro-batcher closed"))
+        else:
+            self._queue.put((item, fut))
+        return fut
+
+    def score(self, item, timeout=None):
+        fut = self.submit(item)
+        try:
+            return fut.result(self.timeout if timeout is None else timeout)
+        except FutureTimeout:
+            # Not scored yet: keep the batcher from doing it for nobody
+            fut.cancel()
+            raise
+
+    def close(self):
+        self._closed = True
+        self._queue.put(_STOP)
+        self._thread.join()
+        # Anything submitted just before the stop marker would otherwise wait forever
+        while True:
+            try:
+                entry = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if entry is not _STOP:
+                self._fail(entry[1], RuntimeError("Micro-batcher closed"))
+
+    def _run(self):
+        stopping = False
+        while not stopping:
+            first = self._queue.get()
+            if first is _STOP:
+                break
+            batch = [first]
+            deadline = time.monotonic() + self.max_wait
+            while len(batch) < self.max_batch_size:
+                remaining = deadline - time.monotonic()
+                try:
+                    nxt = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if nxt is _STOP:
+                    stopping = True
+                    break
+                batch.append(nxt)
+            self._score_batch(batch)
+
+    def _call(self, items):
+        results = list(self.score_fn(items))
+        if len(results) != len(items):
+            raise ValueError(f"score_fn returned {len(results)} results for {len(items)} items")
+        return results
+
+    @staticmethod
+    def _fail(fut, exc):
+        if not fut.done():
+            fut.set_exception(exc)
+
+    def _score_batch(self, batch):
+        # Callers that timed out have cancelled their futures
+        batch = [(item, fut) for item, fut in batch if fut.set_running_or_notify_cancel()]
+        if not batch:
+            return
+        MICROBATCH_SIZE.observe(len(batch))
+        try:
+            try:
+                results = self._call([item for item, _ in batch])
+            except Exception:
+                # One malformed transaction must not fail its neighbours: retry individually
+                for item, fut in batch:
+                    try:
+                        fut.set_result(self._call([item])[0])
+                    except Exception as e:
+                        fut.set_exception(e)
+                return
+            for (_, fut), result in zip(batch, results):
+                fut.set_result(result)
+        finally:
+            for _, fut in batch:
+                self._fail(fut, RuntimeError("Micro-batch ended without a result"))
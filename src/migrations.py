@@ -0,0 +1,213 @@
+import argparse
+import fcntl
+import os
+import re
+from contextlib import contextmanager
+from datetime import date, datetime
+from sqlalchemy import Column, DateTime, MetaData, String, Table, inspect, text
+
+from src.db import engine, Base, Feedback, PredictionLog
+
+PARTITION_PREDICTION_LOG = os.getenv("PARTITION_PREDICTION_LOG", "0") == "1"
+PARTITION_MONTHS_AHEAD = int(os.getenv("PARTITION_MONTHS_AHEAD", "3"))
+PROTECTED_ATTRS = ["Gender", "Region"]
+# Any constant works; it only has to be the same in every process running migrate()
+MIGRATION_LOCK_ID = 7_340_117
+
+_metadata = MetaData()
+schema_migrations = Table(
+    "schema_migrations", _metadata,
+    Column("name", String, primary_key=True),
+    Column("applied_at", DateTime, default=datetime.utcnow),
+)
+
+def _add_missing_columns(conn, table, columns):
+    existing = {c["name"] for c in inspect(conn).get_columns(table.name)}
+    for column in columns:
+        if column.name not in existing:
+            col_type = column.type.compile(dialect=conn.dialect)
+            conn.execute(text(f"ALTER TABLE {table.name} ADD COLUMN {column.name} {col_type}"))
+
+def add_model_columns(conn):
+    _add_missing_columns(conn, PredictionLog.__table__,
+                         [PredictionLog.__table__.c.model_version, PredictionLog.__table__.c.threshold])
+
+def add_time_indexes(conn):
+    for index in (*PredictionLog.__table__.indexes, *Feedback.__table__.indexes):
+        index.create(conn, checkfirst=True)
+
+def convert_features_to_jsonb(conn):
+    for table in ("prediction_log", "feedback"):
+        conn.execute(text(f"ALTER TABLE {table} ALTER COLUMN features TYPE JSONB USING features::jsonb"))
+
+def add_protected_attribute_indexes(conn):
+    # Match PredictionLog.features[attr].as_string(), the expression the fairness audit groups on
+    for attr in PROTECTED_ATTRS:
+        conn.execute(text(
+            f"CREATE INDEX IF NOT EXISTS ix_prediction_log_{attr.lower()} "
+            f"ON prediction_log (((features ->> '{attr}')::VARCHAR), prediction_time)"
+        ))
+
+# (name, dialects or None for all, function); applied once each, in order
+MIGRATIONS = [
+    ("0001_prediction_model_columns", None, add_model_columns),
+    ("0002_time_indexes", None, add_time_indexes),
+    ("0003_features_jsonb", ("postgresql",), convert_features_to_jsonb),
+    ("0004_protected_attribute_indexes", ("postgresql",), add_protected_attribute_indexes),
+]
+
+@contextmanager
+def migration_lock(bind=engine):
+    """
+    A transaction that only one process at a time holds: a transaction-scoped
+    advisory lock on Postgres, an exclusive lock on a file next to the
+    database on SQLite.
+    """
+    url = bind.url
+    if url.get_backend_name() == "sqlite" and url.database not in (None, "", ":memory:"):
+        with open(f"{url.database}.migrate.lock", "w") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            with bind.begin() as conn:
+                yield conn
+    else:
+        with bind.begin() as conn:
+            if conn.dialect.name == "postgresql":
+                conn.execute(text("SELECT pg_advisory_xact_lock(:id)"), {"id": MIGRATION_LOCK_ID})
+            yield conn
+
+def _applicable(dialect_name):
+    return [name for name, dialects, _ in MIGRATIONS if not dialects or dialect_name in dialects]
+
+def _applied(conn):
+    if not inspect(conn).has_table(schema_migrations.name):
+        return set()
+    return set(conn.execute(schema_migrations.select().with_only_columns(schema_migrations.c.name)).scalars())
+
+def migrate(bind=engine):
+    """
+    Create missing tables and apply pending migrations, all under
+    migration_lock so concurrently starting processes cannot race each
+    other. Each migration is recorded in schema_migrations in the same
+    transaction.
+    """
+    with migration_lock(bind) as conn:
+        Base.metadata.create_all(conn)
+        schema_migrations.create(conn, checkfirst=True)
+        applied = _applied(conn)
+        for name, dialects, fn in MIGRATIONS:
+            if name in applied or (dialects and conn.dialect.name not in dialects):
+                continue
+            fn(conn)
+            conn.execute(schema_migrations.insert().values(name=name, applied_at=datetime.utcnow()))
+            print(f"Applied migration {name}")
+        if PARTITION_PREDICTION_LOG and conn.dialect.name == "postgresql":
+            partition_prediction_log(conn)
+            ensure_partitions(conn)
+
+def pending_migrations(bind=engine):
+    # Tables added to the models since the last migrate() count as pending too
+    with bind.connect() as conn:
+        inspector = inspect(conn)
+        missing = [f"create {table}" for table in Base.metadata.tables if not inspector.has_table(table)]
+        applied = _applied(conn)
+        return missing + [name for name in _applicable(conn.dialect.name) if name not in applied]
+
+def check_schema(bind=engine):
+    # Services only check; `python -m src.migrations` (or src.serve) applies
+    pending = pending_migrations(bind)
+    if pending:
+        raise RuntimeError(f"Database schema is not up to date, pending: {', '.join(pending)}. "
+                           "Run `python -m src.migrations` first.")
+
+def _month_start(d, offset=0):
+    months = d.year * 12 + d.month - 1 + offset
+    return date(months // 12, months % 12 + 1, 1)
+
+def partition_name(month: date):
+    return f"prediction_log_y{month.year}m{month.month:02d}"
+
+def is_partitioned(conn):
+    return conn.execute(text(
+        "SELECT 1 FROM pg_partitioned_table p JOIN pg_class c ON c.oid = p.partrelid WHERE c.relname = 'prediction_log'"
+    )).first() is not None
+
+def partition_prediction_log(conn):
+    """
+    Turn prediction_log into a table range-partitioned by month on
+    prediction_time. Existing rows stay where they are: the old table is
+    attached as one partition covering everything up to the next month,
+    so the conversion does not copy data.
+    """
+    if is_partitioned(conn):
+        return
+    conn.execute(text("LOCK TABLE prediction_log IN ACCESS EXCLUSIVE MODE"))
+    conn.execute(text("UPDATE prediction_log SET prediction_time = now() AT TIME ZONE 'utc' WHERE prediction_time IS NULL"))
+    latest = conn.execute(text("SELECT max(prediction_time) FROM prediction_log")).scalar()
+    upper = _month_start(max(latest.date() if latest else date.min, datetime.utcnow().date()), 1)
+    conn.execute(text("ALTER TABLE prediction_log RENAME TO prediction_log_legacy"))
+    # Index names are schema-wide, so the new parent's indexes would collide
+    for (index_name,) in conn.execute(text("SELECT indexname FROM pg_indexes WHERE tablename = 'prediction_log_legacy'")):
+        conn.execute(text(f'ALTER INDEX "{index_name}" RENAME TO "{index_name}_legacy"'))
+    conn.execute(text(
+        "CREATE TABLE prediction_log (LIKE prediction_log_legacy INCLUDING DEFAULTS) PARTITION BY RANGE (prediction_time)"
+    ))
+    conn.execute(text("ALTER TABLE prediction_log ALTER COLUMN prediction_time SET NOT NULL"))
+    # The partition key must be part of every unique constraint
+    conn.execute(text("ALTER TABLE prediction_log ADD PRIMARY KEY (id, prediction_time)"))
+    conn.execute(text("ALTER SEQUENCE prediction_log_id_seq OWNED BY prediction_log.id"))
+    # A partition must carry the parent's NOT NULLs (the backfill above makes this hold) and its
+    # primary key; the legacy key on id alone would clash with the one the attach creates
+    pkey = conn.execute(text(
+        "SELECT conname FROM pg_constraint WHERE conrelid = 'prediction_log_legacy'::regclass AND contype = 'p'"
+    )).scalar()
+    conn.execute(text(
+        "ALTER TABLE prediction_log_legacy ALTER COLUMN prediction_time SET NOT NULL"
+        + (f', DROP CONSTRAINT "{pkey}"' if pkey else "") + ", ADD PRIMARY KEY (id, prediction_time)"
+    ))
+    conn.execute(text(
+        f"ALTER TABLE prediction_log ATTACH PARTITION prediction_log_legacy FOR VALUES FROM (MINVALUE) TO ('{upper}')"
+    ))
+    conn.execute(text("CREATE TABLE prediction_log_default PARTITION OF prediction_log DEFAULT"))
+    add_time_indexes(conn)
+    add_protected_attribute_indexes(conn)
+    print(f"Partitioned prediction_log by month; existing rows kept in prediction_log_legacy (< {upper})")
+
+def ensure_partitions(conn, months_ahead=PARTITION_MONTHS_AHEAD):
+    """
+    Create the monthly partitions for the next `months_ahead` months,
+    skipping months the legacy partition already covers.
+    """
+    if not is_partitioned(conn):
+        return
+    legacy_upper = _legacy_upper(conn)
+    for offset in range(1, months_ahead + 1):
+        start = _month_start(datetime.utcnow().date(), offset)
+        if start < legacy_upper:
+            continue
+        conn.execute(text(
+            f"CREATE TABLE IF NOT EXISTS {partition_name(start)} PARTITION OF prediction_log "
+            f"FOR VALUES FROM ('{start}') TO ('{_month_start(start, 1)}')"
+        ))
+
+def _legacy_upper(conn):
+    bound = conn.execute(text(
+        "SELECT pg_get_expr(relpartbound, oid) FROM pg_class WHERE relname = 'prediction_log_legacy'"
+    )).scalar()
+    match = re.search(r"TO \('(\d{4}-\d{2}-\d{2})", bound or "")
+    return date.fromisoformat(match.group(1)) if match else date.min
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Apply database schema migrations")
+    parser.add_argument("--list", action="store_true", help="Show which migrations are applied")
+    parser.add_argument("--check", action="store_true", help="Only exit with status 1 if migrations are pending")
+    args = parser.parse_args()
+    if args.check:
+        pending = pending_migrations(engine)
+        print(f"Pending migrations: {', '.join(pending)}" if pending else "Schema is up to date")
+        raise SystemExit(1 if pending else 0)
+    migrate(engine)
+    if args.list:
+        with engine.connect() as conn:
+            applied = dict(conn.execute(schema_migrations.select()).all())
+        for name, _, _ in MIGRATIONS:
+            print(f"{name}: {applied.get(name, 'not applied')}")
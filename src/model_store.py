@@ -0,0 +1,155 @@
+import json
+import os
+import threading
+from collections import OrderedDict, namedtuple
+from concurrent.futures import Future, ThreadPoolExecutor
+import joblib
+
+MODEL_DIR = os.getenv("MODEL_DIR", "models")
+# "r" memory-maps the numpy arrays joblib stores raw inside model pickles. sklearn trees copy their
+# nodes on unpickling and XGBoost boosters are bytes, so each process still holds its own forests
+MODEL_MMAP_MODE = os.getenv("MODEL_MMAP_MODE") or None
+CURRENT_VERSION_FILE = os.path.join(MODEL_DIR, "current_model_version.txt")
+
+def get_current_version():
+    try:
+        with open(CURRENT_VERSION_FILE) as f:
+            return int(f.read().strip())
+    except:
+        return None
+
+def model_path(version: int):
+    return os.path.join(MODEL_DIR, f"stacked_fraud_model_v{version}.pkl")
+
+def load_model(version: int, mmap_mode=MODEL_MMAP_MODE):
+    fp = model_path(version)
+    if not os.path.exists(fp):
+        raise FileNotFoundError
+    return joblib.load(fp, mmap_mode=mmap_mode)
+
+def drift_reference_path(version: int):
+    return os.path.join(MODEL_DIR, f"stacked_fraud_model_v{version}.drift.json")
+
+def anomaly_detector_path(version: int):
+    return os.path.join(MODEL_DIR, f"stacked_fraud_model_v{version}.anomaly.pkl")
+
+def load_anomaly_detector(version: int):
+    # Kept apart from the pickle, so serving the compiled model never loads it. None for models trained without one
+    fp = anomaly_detector_path(version)
+    return joblib.load(fp) if os.path.exists(fp) else None
+
+def compiled_model_path(version: int):
+    return os.path.join(MODEL_DIR, f"stacked_fraud_model_v{version}.compiled")
+
+def model_metadata_path(version: int):
+    return os.path.join(MODEL_DIR, f"stacked_fraud_model_v{version}.meta.json")
+
+def save_model_metadata(version: int, metadata: dict):
+    with open(model_metadata_path(version), "w") as f:
+        json.dump(metadata, f)
+
+def load_model_metadata(version: int) -> dict:
+    # Versions trained before metadata was written have none
+    try:
+        with open(model_metadata_path(version)) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+# Immutable (model, threshold, version, anomaly_detector) bundle swapped in one assignment
+ModelBundle = namedtuple("ModelBundle", ["model", "threshold", "version", "anomaly_detector"], defaults=(None,))
+
+class ModelRegistry:
+    """
+    Holds the active ModelBundle and a small LRU of recently loaded ones.
+
+    Versions are deserialized on a background thread, so a slow joblib.load
+    never blocks scoring; requests keep using the previous bundle until the
+    new one replaces it in a single reference swap. `loader(version)` must
+    return (model, threshold) or (model, threshold, anomaly_detector).
+    Rolling back to a cached version is instant.
+    """
+
+    def __init__(self, loader, cache_size=3):
+        self._loader = loader
+        self._cache_size = cache_size
+        self._lock = threading.Lock()
+        self._current = None
+        self._cache = OrderedDict()
+        self._pending = {}
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="model-preload")
+        self._listeners = []
+        self._stopped = threading.Event()
+
+    def current(self) -> ModelBundle:
+        return self._current
+
+    def cached_versions(self):
+        with self._lock:
+            return list(self._cache)
+
+    def on_swap(self, callback):
+        # callback(old_bundle, new_bundle) runs after every activation
+        self._listeners.append(callback)
+
+    def preload(self, version: int) -> Future:
+        with self._lock:
+            if version in self._cache:
+                fut = Future()
+                fut.set_result(self._cache[version])
+                return fut
+            if version not in self._pending:
+                self._pending[version] = self._executor.submit(self._load, version)
+            return self._pending[version]
+
+    def activate(self, version: int, timeout=None) -> ModelBundle:
+        bundle = self.preload(version).result(timeout)
+        with self._lock:
+            old, self._current = self._current, bundle
+            self._remember(bundle)
+        for callback in self._listeners:
+            callback(old, bundle)
+        return bundle
+
+    def follow(self, get_version, interval):
+        """
+        Poll `get_version()` every `interval` seconds and activate any new
+        version. With several worker processes only one receives a reload
+        request; the others pick the change up from the version file.
+        """
+        def run():
+            while not self._stopped.wait(interval):
+                version = get_version()
+                if version is None or (self._current is not None and self._current.version == version):
+                    continue
+                try:
+                    self.activate(version)
+                except Exception as e:
+                    print(f"Loading model v{version} failed: {e}")
+        threading.Thread(target=run, name="model-follow", daemon=True).start()
+
+    def close(self):
+        self._stopped.set()
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def _load(self, version):
+        try:
+            model, threshold, *detector = self._loader(version)
+            bundle = ModelBundle(model, threshold, version, *detector)
+            with self._lock:
+                self._remember(bundle)
+            return bundle
+        finally:
+            with self._lock:
+                self._pending.pop(version, None)
+
+    def _remember(self, bundle):
+        # Caller holds the lock. The active bundle is never evicted.
+        self._cache[bundle.version] = bundle
+        self._cache.move_to_end(bundle.version)
+        active = self._current.version if self._current is not None else None
+        for version in list(self._cache):
+            if len(self._cache) <= self._cache_size:
+                break
+            if version != active:
+                del self._cache[version]
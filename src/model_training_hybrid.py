@@ -1,7 +1,21 @@
+import hashlib
+import os
+import shutil
+import joblib
+import numpy as np
+import pandas as pd
+from joblib import Parallel, delayed, effective_n_jobs
+from sklearn.base import clone
 from sklearn.ensemble import StackingClassifier, RandomForestClassifier
 from sklearn.linear_model import LogisticRegression
+from sklearn.metrics import precision_recall_curve
+from sklearn.model_selection import StratifiedKFold, cross_val_predict
 from xgboost import XGBClassifier
 
+OOF_CACHE_DIR = os.getenv("OOF_CACHE_DIR", os.path.join(os.getenv("DATA_DIR", "data"), "oof_cache"))
+OOF_CACHE_KEEP = int(os.getenv("OOF_CACHE_KEEP", "6"))
+TRAINING_N_JOBS = int(os.getenv("TRAINING_N_JOBS", "-1"))
+
 def build_hybrid_model():
     base_learners = [
         ('rf', RandomForestClassifier(n_estimators=200, class_weight='balanced', random_state=42)),
@@ -15,3 +29,135 @@ def build_hybrid_model():
         n_jobs=-1
     )
     return ensemble_model
+
+def find_best_threshold(y_true, probs):
+    # Threshold maximizing F1 on the precision/recall curve
+    precision, recall, thresholds = precision_recall_curve(y_true, probs)
+    f1 = 2 * precision[:-1] * recall[:-1] / np.clip(precision[:-1] + recall[:-1], 1e-12, None)
+    best = int(np.argmax(f1))
+    return float(thresholds[best]), float(f1[best])
+
+class CachedStackingModel:
+    """
+    Fitted stacking ensemble assembled from separately trained parts.
+
+    Mirrors the fitted attributes of sklearn's StackingClassifier with
+    passthrough=True (`estimators_`, `named_estimators_`, `final_estimator_`)
+    and produces the same predict_proba: the positive-class probability of
+    every base learner followed by the raw features, fed to the meta learner.
+    """
+
+    passthrough = True
+
+    def __init__(self, named_estimators, final_estimator, feature_names):
+        self.named_estimators_ = dict(named_estimators)
+        self.estimators_ = [est for _, est in named_estimators]
+        self.final_estimator_ = final_estimator
+        self.feature_names_in_ = np.asarray(feature_names, dtype=object)
+        self.classes_ = final_estimator.classes_
+
+    def _meta_features(self, X):
+        X = X[list(self.feature_names_in_)] if isinstance(X, pd.DataFrame) else X
+        base = [est.predict_proba(X)[:, 1] for est in self.estimators_]
+        return np.column_stack(base + [np.asarray(X, dtype=float)])
+
+    def predict_proba(self, X):
+        return self.final_estimator_.predict_proba(self._meta_features(X))
+
+    def predict(self, X):
+        return self.classes_[np.argmax(self.predict_proba(X), axis=1)]
+
+def _hash(*parts):
+    h = hashlib.sha256()
+    for part in parts:
+        h.update(part if isinstance(part, bytes) else repr(part).encode())
+    return h.hexdigest()[:16]
+
+def _data_key(X: pd.DataFrame, y):
+    return _hash(list(X.columns), pd.util.hash_pandas_object(X, index=False).to_numpy().tobytes(),
+                 np.asarray(y).tobytes())
+
+def _fit_part(path, estimator, X, y, train_idx, test_idx, fit_threads=None):
+    # A full-data fit returns the model, a fold fit its out-of-fold probabilities
+    est = clone(estimator)
+    n_jobs = est.get_params().get("n_jobs")
+    if fit_threads is not None:
+        # Pool workers already use every core; learners threading on top would oversubscribe them
+        est.set_params(n_jobs=fit_threads)
+    if train_idx is None:
+        est.fit(X, y)
+        # Predict with the learner's own setting, not the pool's
+        return path, est.set_params(n_jobs=n_jobs)
+    est.fit(X.iloc[train_idx], y.iloc[train_idx])
+    return path, est.predict_proba(X.iloc[test_idx])[:, 1]
+
+def _prune_cache(cache_dir, keep):
+    entries = sorted((os.path.join(cache_dir, d) for d in os.listdir(cache_dir)), key=os.path.getmtime, reverse=True)
+    for path in entries[keep:]:
+        shutil.rmtree(path, ignore_errors=True)
+
+def train_stacked_model(X: pd.DataFrame, y: pd.Series, cv=5, n_jobs=TRAINING_N_JOBS, cache_dir=OOF_CACHE_DIR,
+                        final_estimator=None):
+    """
+    Train the hybrid ensemble and pick its threshold. Returns (model, threshold).
+
+    Every (base learner, CV fold) fit and every full-data base fit runs as
+    its own job in a process pool. Its output is cached on disk under a key
+    derived from the training data and the learner's hyperparameters. Runs
+    that only change the meta learner, or that resume after a crash, reuse
+    the cached out-of-fold predictions and base models. The threshold is
+    chosen on the meta learner's own out-of-fold probabilities, from
+    cross_val_predict over the same folds, rather than in-sample ones.
+    """
+    template = build_hybrid_model()
+    final_estimator = clone(final_estimator if final_estimator is not None else template.final_estimator)
+    y = pd.Series(np.asarray(y), index=X.index)
+    folds = list(StratifiedKFold(n_splits=cv).split(X, y))
+    data_key = _data_key(X, y)
+    os.makedirs(cache_dir, exist_ok=True)
+
+    jobs = []
+    learner_dirs = {}
+    for name, estimator in template.estimators:
+        learner_dir = os.path.join(cache_dir, f"{name}-{_hash(data_key, cv, estimator.get_params())}")
+        os.makedirs(learner_dir, exist_ok=True)
+        os.utime(learner_dir)
+        learner_dirs[name] = learner_dir
+        for i, (train_idx, test_idx) in enumerate(folds):
+            path = os.path.join(learner_dir, f"fold{i}.npy")
+            if not os.path.exists(path):
+                jobs.append((path, estimator, train_idx, test_idx))
+        path = os.path.join(learner_dir, "full.joblib")
+        if not os.path.exists(path):
+            jobs.append((path, estimator, None, None))
+
+    if jobs:
+        print(f"Fitting {len(jobs)} base-learner jobs ({sum(j[2] is None for j in jobs)} full-data fits)")
+        fit_threads = 1 if effective_n_jobs(n_jobs) > 1 else None
+        results = Parallel(n_jobs=n_jobs, return_as="generator_unordered")(
+            delayed(_fit_part)(path, estimator, X, y, train_idx, test_idx, fit_threads)
+            for path, estimator, train_idx, test_idx in jobs
+        )
+        # Persist each part as soon as it finishes so an interrupted run can resume
+        for path, result in results:
+            tmp = path + ".tmp"
+            with open(tmp, "wb") as f:
+                if path.endswith(".npy"):
+                    np.save(f, result)
+                else:
+                    joblib.dump(result, f)
+            os.replace(tmp, path)
+
+    oof = np.zeros((len(X), len(learner_dirs)))
+    named_estimators = []
+    for j, (name, learner_dir) in enumerate(learner_dirs.items()):
+        for i, (_, test_idx) in enumerate(folds):
+            oof[test_idx, j] = np.load(os.path.join(learner_dir, f"fold{i}.npy"))
+        named_estimators.append((name, joblib.load(os.path.join(learner_dir, "full.joblib"))))
+
+    meta_X = np.column_stack([oof, X.to_numpy(dtype=float)])
+    final_estimator.fit(meta_X, y)
+    oof_probs = cross_val_predict(clone(final_estimator), meta_X, y, cv=folds, method="predict_proba")[:, 1]
+    threshold, _ = find_best_threshold(y, oof_probs)
+    _prune_cache(cache_dir, OOF_CACHE_KEEP)
+    return CachedStackingModel(named_estimators, final_estimator, X.columns), threshold
@@ -1,6 +1,12 @@
 import os
+import queue
+import random
+import threading
+import time
 import requests
+from requests.adapters import HTTPAdapter
 from datetime import datetime
+from prometheus_client import Counter, Gauge
 
 # Environment variables
 SLACK_WEBHOOK_URL      = os.getenv("SLACK_WEBHOOK_URL")
@@ -11,6 +17,12 @@ PAGERDUTY_API_KEY      = os.getenv("PAGERDUTY_API_KEY")
 SERVICENOW_INSTANCE    = os.getenv("SERVICENOW_INSTANCE")
 SERVICENOW_USER        = os.getenv("SERVICENOW_USER")
 SERVICENOW_PASSWORD    = os.getenv("SERVICENOW_PASSWORD")
+NOTIFY_TIMEOUT         = float(os.getenv("NOTIFY_TIMEOUT", "5"))
+
+# Pooled HTTP session shared by every webhook call
+_session = requests.Session()
+_session.mount("https://", HTTPAdapter(pool_connections=4, pool_maxsize=8))
+_session.mount("http://", HTTPAdapter(pool_connections=4, pool_maxsize=8))
 
 # Pre-configured Grafana panel links
 GRAFANA_LINKS = {
@@ -19,15 +31,18 @@ GRAFANA_LINKS = {
     "fraud_spike": f"{GRAFANA_URL}/d/GpK4WWlmz/fraud-spike-dashboard?orgId=1&viewPanel=12",
 }
 
-def send_slack_alert(text, dashboard_key=None):
+def _post_slack(text, dashboard_key=None):
     if not SLACK_WEBHOOK_URL:
         return
     if dashboard_key:
         grafana_url = GRAFANA_LINKS.get(dashboard_key)
         if grafana_url:
             text += f"\nView dashboard: <{grafana_url}|Grafana Panel>"
+    _session.post(SLACK_WEBHOOK_URL, json={"text": text}, timeout=NOTIFY_TIMEOUT).raise_for_status()
+
+def send_slack_alert(text, dashboard_key=None):
     try:
-        requests.post(SLACK_WEBHOOK_URL, json={"text": text}, timeout=5)
+        _post_slack(text, dashboard_key)
     except Exception as e:
         print(f"Slack alert failed: {e}")
 
@@ -50,11 +65,11 @@ def create_grafana_annotation(dashboard_uid, panel_id, text, link_url=None):
     if link_url:
         payload["url"] = link_url
     try:
-        requests.post(url, json=payload, headers=headers).raise_for_status()
+        _session.post(url, json=payload, headers=headers, timeout=NOTIFY_TIMEOUT).raise_for_status()
     except Exception as e:
         print(f"Grafana annotation failed: {e}")
 
-def send_pagerduty_incident(summary, severity="error"):
+def _post_pagerduty(summary, severity="error"):
     if not PAGERDUTY_ROUTING_KEY:
         return
     payload = {
@@ -66,8 +81,11 @@ def send_pagerduty_incident(summary, severity="error"):
             "source": "fraud_detection_api"
         }
     }
+    _session.post("https://events.pagerduty.com/v2/enqueue", json=payload, timeout=NOTIFY_TIMEOUT).raise_for_status()
+
+def send_pagerduty_incident(summary, severity="error"):
     try:
-        requests.post("https://events.pagerduty.com/v2/enqueue", json=payload).raise_for_status()
+        _post_pagerduty(summary, severity)
     except Exception as e:
         print(f"PagerDuty incident failed: {e}")
 
@@ -81,8 +99,137 @@ def create_servicenow_incident(short_description, description):
         "description": description
     }
     try:
-        r = requests.post(url, auth=auth, json=payload)
+        r = _session.post(url, auth=auth, json=payload, timeout=NOTIFY_TIMEOUT)
         r.raise_for_status()
         return r.json()
     except Exception as e:
         print(f"ServiceNow incident creation failed: {e}")
+
+ALERTS_SENT = Counter("alerts_sent_total", "Alerts delivered", ["channel"])
+ALERTS_FAILED = Counter("alerts_failed_total", "Alerts that failed after all retries", ["channel"])
+ALERTS_DROPPED = Counter("alerts_dropped_total", "Alerts dropped because the queue was full", ["channel"])
+ALERTS_COALESCED = Counter("alerts_coalesced_total", "Alerts folded into a summary message", ["channel"])
+ALERT_QUEUE_DEPTH = Gauge("alert_queue_depth", "Alerts waiting to be sent", ["channel"], multiprocess_mode="livesum")
+
+ALERT_SENDERS = {
+    "slack": _post_slack,
+    "pagerduty": _post_pagerduty,
+}
+
+class _AlertChannel:
+    def __init__(self, name, sender, max_queue, rate_per_min, burst):
+        self.name = name
+        self.sender = sender
+        self.queue = queue.Queue(maxsize=max_queue)
+        self.rate = rate_per_min / 60.0
+        self.burst = burst
+        self.tokens = float(burst)
+        self.last_refill = time.monotonic()
+        # coalesce_key -> [window_start, suppressed_count, summary, kwargs]
+        self.windows = {}
+
+    def wait_for_token(self):
+        while True:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.last_refill) * self.rate)
+            self.last_refill = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return
+            time.sleep((1 - self.tokens) / self.rate)
+
+class AlertDispatcher:
+    """
+    Sends alerts from background threads so callers never wait on a webhook.
+
+    Each channel has its own bounded queue, worker thread and token-bucket
+    rate limit. Alerts sharing a `coalesce_key` within `coalesce_window`
+    seconds are folded: the first is sent at once, the rest are counted and
+    reported in one summary message when the window closes. Failed sends are
+    retried with exponential backoff and jitter.
+    """
+
+    def __init__(self, max_queue=1000, rate_per_min=30, burst=5, coalesce_window=10.0,
+                 max_retries=3, backoff_base=0.5, senders=None):
+        self.coalesce_window = coalesce_window
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self._lock = threading.Lock()
+        self._closed = False
+        self._channels = {
+            name: _AlertChannel(name, sender, max_queue, rate_per_min, burst)
+            for name, sender in (senders or ALERT_SENDERS).items()
+        }
+        self._threads = [
+            threading.Thread(target=self._run, args=(channel,), name=f"alerts-{name}", daemon=True)
+            for name, channel in self._channels.items()
+        ]
+        for t in self._threads:
+            t.start()
+
+    def dispatch(self, channel, text, coalesce_key=None, summary=None, coalesce_count=1, **kwargs):
+        """
+        Queue an alert; returns False if it was dropped. `summary` is a format
+        string with {count} and {window} used for the coalesced message, and
+        `coalesce_count` is how many events this alert stands for.
+        """
+        ch = self._channels[channel]
+        if coalesce_key is not None:
+            with self._lock:
+                now = time.monotonic()
+                window = ch.windows.get(coalesce_key)
+                if window is not None and now - window[0] < self.coalesce_window:
+                    window[1] += coalesce_count
+                    ALERTS_COALESCED.labels(channel=channel).inc()
+                    return True
+                ch.windows[coalesce_key] = [now, 0, summary or f"{{count}} more '{coalesce_key}' alerts in the last {{window:.0f}} s", kwargs]
+        return self._enqueue(ch, text, kwargs)
+
+    def close(self, timeout=None):
+        self._closed = True
+        for t in self._threads:
+            t.join(timeout)
+
+    def _enqueue(self, ch, text, kwargs):
+        try:
+            ch.queue.put_nowait((text, kwargs))
+            return True
+        except queue.Full:
+            ALERTS_DROPPED.labels(channel=ch.name).inc()
+            return False
+
+    def _flush_windows(self, ch, force=False):
+        now = time.monotonic()
+        with self._lock:
+            expired = [k for k, w in ch.windows.items() if force or now - w[0] >= self.coalesce_window]
+            closed = [ch.windows.pop(k) for k in expired]
+        for _, count, summary, kwargs in closed:
+            if count:
+                self._enqueue(ch, summary.format(count=count, window=self.coalesce_window), kwargs)
+
+    def _send(self, ch, text, kwargs):
+        for attempt in range(self.max_retries + 1):
+            try:
+                ch.sender(text, **kwargs)
+                ALERTS_SENT.labels(channel=ch.name).inc()
+                return
+            except Exception as e:
+                if attempt == self.max_retries:
+                    ALERTS_FAILED.labels(channel=ch.name).inc()
+                    print(f"{ch.name} alert failed after {attempt + 1} attempts: {e}")
+                    return
+                time.sleep(self.backoff_base * (2 ** attempt) * random.uniform(0.5, 1.5))
+
+    def _run(self, ch):
+        while True:
+            # Refreshed on every pass of the sender loop
+            ALERT_QUEUE_DEPTH.labels(channel=ch.name).set(ch.queue.qsize())
+            self._flush_windows(ch, force=self._closed)
+            try:
+                text, kwargs = ch.queue.get(timeout=0.5)
+            except queue.Empty:
+                if self._closed:
+                    return
+                continue
+            ch.wait_for_token()
+            self._send(ch, text, kwargs)
@@ -0,0 +1,66 @@
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+from prometheus_client import Counter, Gauge
+
+CACHE_HITS = Counter("prediction_cache_hits_total", "Predictions served from the cache")
+CACHE_MISSES = Counter("prediction_cache_misses_total", "Predictions that had to be scored")
+CACHE_EVICTIONS = Counter("prediction_cache_evictions_total", "Cache entries removed", ["reason"])
+CACHE_SIZE = Gauge("prediction_cache_entries", "Entries in the prediction cache", multiprocess_mode="livesum")
+
+def fingerprint(features: dict, version) -> str:
+    # Key order and whitespace never change the key; non-JSON values fall back to str
+    canonical = json.dumps(features, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha256(f"{version}:{canonical}".encode()).hexdigest()
+
+class PredictionCache:
+    """
+    Bounded LRU of scored transactions with a per-entry TTL.
+
+    Keys are `fingerprint(features, model_version)`, so a retried or
+    duplicated transaction is answered without scoring it again. Entries
+    older than `ttl` seconds count as misses; past `max_size` the least
+    recently used entry is evicted.
+    """
+
+    def __init__(self, max_size=100000, ttl=300.0):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] < now:
+                del self._entries[key]
+                CACHE_EVICTIONS.labels(reason="expired").inc()
+                entry = None
+            if entry is None:
+                CACHE_MISSES.inc()
+                CACHE_SIZE.set(len(self._entries))
+                return None
+            self._entries.move_to_end(key)
+        CACHE_HITS.inc()
+        return entry[1]
+
+    def put(self, key, value):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                CACHE_EVICTIONS.labels(reason="capacity").inc()
+            CACHE_SIZE.set(len(self._entries))
+
+    def clear(self):
+        with self._lock:
+            CACHE_EVICTIONS.labels(reason="invalidated").inc(len(self._entries))
+            self._entries.clear()
+            CACHE_SIZE.set(0)
@@ -0,0 +1,99 @@
+import argparse
+import asyncio
+import cProfile
+import functools
+import glob
+import itertools
+import os
+import pstats
+import threading
+import time
+from contextlib import contextmanager
+from prometheus_client import Histogram
+
+# 0 disables sampling: endpoints are then left undecorated
+PROFILE_SAMPLE_EVERY = int(os.getenv("PROFILE_SAMPLE_EVERY", "0"))
+PROFILE_DIR = os.getenv("PROFILE_DIR", os.path.join(os.getenv("DATA_DIR", "data"), "profiles"))
+
+STAGE_LATENCY = Histogram(
+    "fraud_stage_latency_seconds", "Latency of each stage of the predict, feedback and model reload paths",
+    ["endpoint", "stage", "model_version"],
+    buckets=(0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 120),
+)
+
+@contextmanager
+def stage_timer(endpoint, stage, model_version):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        STAGE_LATENCY.labels(endpoint, stage, str(model_version)).observe(time.perf_counter() - start)
+
+class SamplingProfiler:
+    """
+    Runs cProfile on one call in every `sample_every` and writes the stats
+    to `out_dir` as <endpoint>-<timestamp>-<pid>-<n>.prof. Only one call is
+    profiled at a time per process; a sample that would overlap another is
+    skipped rather than waited for.
+    """
+
+    def __init__(self, sample_every=PROFILE_SAMPLE_EVERY, out_dir=PROFILE_DIR):
+        self.sample_every = sample_every
+        self.out_dir = out_dir
+        self._calls = itertools.count(1)
+        self._active = threading.Lock()
+
+    @contextmanager
+    def _sample(self, endpoint):
+        n = next(self._calls)
+        if n % self.sample_every or not self._active.acquire(blocking=False):
+            yield
+            return
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+            try:
+                yield
+            finally:
+                profiler.disable()
+            os.makedirs(self.out_dir, exist_ok=True)
+            stamp = time.strftime("%Y%m%dT%H%M%S")
+            profiler.dump_stats(os.path.join(self.out_dir, f"{endpoint}-{stamp}-{os.getpid()}-{n}.prof"))
+        finally:
+            self._active.release()
+
+    def profiled(self, endpoint):
+        # Decorator for sync and async endpoints; a no-op when sampling is off
+        def decorate(fn):
+            if self.sample_every <= 0:
+                return fn
+            if asyncio.iscoroutinefunction(fn):
+                @functools.wraps(fn)
+                async def async_wrapper(*args, **kwargs):
+                    # Async samples also see whatever else ran on the event loop meanwhile
+                    with self._sample(endpoint):
+                        return await fn(*args, **kwargs)
+                return async_wrapper
+
+            @functools.wraps(fn)
+            def wrapper(*args, **kwargs):
+                with self._sample(endpoint):
+                    return fn(*args, **kwargs)
+            return wrapper
+        return decorate
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Summarize sampled request profiles")
+    parser.add_argument("--dir", default=PROFILE_DIR)
+    parser.add_argument("--endpoint", default="*", help="Only profiles of this endpoint")
+    parser.add_argument("--sort", default="cumulative")
+    parser.add_argument("--top", type=int, default=30)
+    args = parser.parse_args()
+    files = sorted(glob.glob(os.path.join(args.dir, f"{args.endpoint}-*.prof")))
+    if not files:
+        raise SystemExit(f"No profiles in {args.dir}")
+    print(f"{len(files)} sampled requests")
+    stats = pstats.Stats(*files)
+    # Otherwise every merged file name is printed above the table
+    stats.files = []
+    stats.strip_dirs().sort_stats(args.sort).print_stats(args.top)
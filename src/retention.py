@@ -0,0 +1,70 @@
+import argparse
+import json
+import os
+from datetime import datetime, timedelta
+import pandas as pd
+from sqlalchemy import delete, select, text
+
+from src.db import engine, PredictionLog
+from src.migrations import _month_start, check_schema, ensure_partitions, is_partitioned
+
+DATA_DIR = os.getenv("DATA_DIR", "data")
+PREDICTION_RETENTION_DAYS = int(os.getenv("PREDICTION_RETENTION_DAYS", "180"))
+ARCHIVE_DIR = os.getenv("ARCHIVE_DIR", os.path.join(DATA_DIR, "archive"))
+ARCHIVE_CHUNK_SIZE = int(os.getenv("ARCHIVE_CHUNK_SIZE", "50000"))
+
+def archive_predictions(retention_days=PREDICTION_RETENTION_DAYS, archive_dir=ARCHIVE_DIR, chunksize=ARCHIVE_CHUNK_SIZE):
+    """
+    Move prediction_log rows older than `retention_days` into Parquet files
+    and return how many were moved. Each chunk is written to disk before its
+    rows are deleted, in the same transaction, so an interrupted run never
+    loses rows. Feedback is training data and is never archived.
+    """
+    table = PredictionLog.__table__
+    cutoff = datetime.utcnow() - timedelta(days=retention_days)
+    os.makedirs(archive_dir, exist_ok=True)
+    moved = 0
+    while True:
+        with engine.begin() as conn:
+            rows = conn.execute(
+                select(table).where(table.c.prediction_time < cutoff).order_by(table.c.id).limit(chunksize)
+            ).mappings().all()
+            if not rows:
+                break
+            first, last = rows[0]["id"], rows[-1]["id"]
+            df = pd.DataFrame(rows)
+            df["features"] = df["features"].map(json.dumps)
+            df.to_parquet(os.path.join(archive_dir, f"prediction_log-{first:012d}-{last:012d}.parquet"), index=False)
+            conn.execute(delete(table).where(table.c.id.between(first, last), table.c.prediction_time < cutoff))
+        moved += len(rows)
+    return moved
+
+def drop_expired_partitions(retention_days=PREDICTION_RETENTION_DAYS):
+    # Monthly partitions entirely before the cutoff are empty once archived
+    cutoff = datetime.utcnow().date() - timedelta(days=retention_days)
+    dropped = []
+    with engine.begin() as conn:
+        if conn.dialect.name != "postgresql" or not is_partitioned(conn):
+            return dropped
+        names = conn.execute(text(
+            "SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+            "WHERE i.inhparent = 'prediction_log'::regclass AND c.relname ~ '^prediction_log_y[0-9]{4}m[0-9]{2}$'"
+        )).scalars().all()
+        for name in names:
+            month = datetime.strptime(name[len("prediction_log_"):], "y%Ym%m").date()
+            if _month_start(month, 1) <= cutoff:
+                conn.execute(text(f"ALTER TABLE prediction_log DETACH PARTITION {name}"))
+                conn.execute(text(f"DROP TABLE {name}"))
+                dropped.append(name)
+        ensure_partitions(conn)
+    return dropped
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Archive and delete old prediction_log rows")
+    parser.add_argument("--retention-days", type=int, default=PREDICTION_RETENTION_DAYS)
+    parser.add_argument("--archive-dir", default=ARCHIVE_DIR)
+    args = parser.parse_args()
+    check_schema()
+    print(f"Archived {archive_predictions(args.retention_days, args.archive_dir)} prediction_log rows to {args.archive_dir}")
+    for name in drop_expired_partitions(args.retention_days):
+        print(f"Dropped partition {name}")
@@ -1,60 +1,69 @@
-import pandas as pd
+import argparse
 import joblib
 import os
+from datetime import datetime
 import requests
-from sqlalchemy.orm import Session
-from src.db import SessionLocal, Feedback
-from advanced_model_training import build_hybrid_model, find_best_threshold, feature_list
+from src.model_training_hybrid import train_stacked_model
 from src.notify import send_slack_alert, send_pagerduty_incident, create_grafana_annotation
+from src.feature_engineering_advanced import AnomalyScoreTransformer, add_anomaly_score
+from src.model_store import (CURRENT_VERSION_FILE, get_current_version, model_path, drift_reference_path, compiled_model_path,
+                             anomaly_detector_path, load_model_metadata, save_model_metadata)
+from src.compiled_model import compile_model
+from src.training_data import update_cache, load_training_set, feedback_watermark, count_feedback_since
+from src.drift import build_reference, save_reference, load_reference, check_drift, iter_recent_features, push_drift_metrics
 
-MODEL_DIR = "models"
-X_BASE = "data/X_train_bal_adv.csv"
-Y_BASE = "data/y_train_bal_adv.csv"
-CURRENT_VERSION_FILE = os.path.join(MODEL_DIR, "current_model_version.txt")
+RETRAIN_MIN_NEW_FEEDBACK = int(os.getenv("RETRAIN_MIN_NEW_FEEDBACK", "1000"))
 
-def get_current_version():
-    try:
-        with open(CURRENT_VERSION_FILE) as f:
-            return int(f.read().strip())
-    except:
-        return 0
-
-def detect_drift(X_base: pd.DataFrame, X_feedback: pd.DataFrame, threshold=0.1):
-    # Simple drift check based on sample count or PSI can be implemented here
-    if X_feedback.empty:
-        return False
-    # For brevity, just returning True for retrain if feedback present
-    return True
-
-def retrain():
-    db = SessionLocal()
-    X_base = pd.read_csv(X_BASE)
-    y_base = pd.read_csv(Y_BASE)['Class']
-    
-    feedbacks = db.query(Feedback).all()
-    if feedbacks:
-        fb_dicts = [fb.features for fb in feedbacks]
-        fb_y = [fb.true_label for fb in feedbacks]
-        fb_X = pd.DataFrame(fb_dicts)
-        fb_y = pd.Series(fb_y)
-    else:
-        fb_X = pd.DataFrame()
-        fb_y = pd.Series()
+def detect_drift(version):
+    reference = load_reference(drift_reference_path(version)) if version else None
+    if reference is None:
+        # Models trained before drift references existed: bin the cached training set once
+        X, _ = load_training_set()
+        reference = build_reference(X)
+        if version:
+            save_reference(reference, drift_reference_path(version))
+    drifted, scores = check_drift(reference, iter_recent_features())
+    push_drift_metrics()
+    for col, s in sorted(scores.items()):
+        print(f"Drift {col}: PSI={s['psi']:.3f} KS={s['ks']:.3f}")
+    return drifted
 
-    if not fb_X.empty and detect_drift(X_base, fb_X):
-        X = pd.concat([X_base, fb_X], ignore_index=True)
-        y = pd.concat([y_base, fb_y], ignore_index=True)
-    else:
-        X, y = X_base, y_base
+def retrain(force=False):
+    # Only feedback that arrived since the last run is read from the database
+    new_feedback = update_cache()
+    print(f"Appended {new_feedback} new feedback rows to the training cache")
+    current_version = get_current_version()
+    if not force and current_version:
+        # Counted from the last feedback the current model saw, however many runs ago it was trained
+        trained_watermark = load_model_metadata(current_version).get("feedback_watermark", 0)
+        unseen_feedback = count_feedback_since(trained_watermark)
+        print(f"{unseen_feedback} feedback rows since model v{current_version} was trained")
+        drifted = detect_drift(current_version)
+        if not drifted and unseen_feedback < RETRAIN_MIN_NEW_FEEDBACK:
+            print("No drift and too little new feedback; skipping retrain")
+            return
+    X, y = load_training_set()
+    watermark = feedback_watermark()
+    # Fitted once here on the columns requests carry; scoring only calls score_samples on it
+    anomaly_detector = AnomalyScoreTransformer().fit(X)
+    X_scored = add_anomaly_score(X, anomaly_detector)
 
-    model = build_hybrid_model()
-    model.fit(X, y)
-    probs = model.predict_proba(X)[:, 1]
-    best_t, _ = find_best_threshold(y, probs)
+    # Base-learner CV folds run in parallel and are cached, so meta-only changes are cheap
+    model, best_t = train_stacked_model(X_scored, y)
 
-    new_version = get_current_version() + 1
-    model_filepath = os.path.join(MODEL_DIR, f"stacked_fraud_model_v{new_version}.pkl")
+    new_version = (get_current_version() or 0) + 1
+    model_filepath = model_path(new_version)
     joblib.dump({'model': model, 'threshold': best_t}, model_filepath)
+    joblib.dump(anomaly_detector, anomaly_detector_path(new_version))
+
+    save_reference(build_reference(X), drift_reference_path(new_version))
+    save_model_metadata(new_version, {"feedback_watermark": watermark, "training_rows": len(y),
+                                      "trained_at": datetime.utcnow().isoformat()})
+    try:
+        # Calibrated on training rows: where sklearn overtakes traversal depends on the trees
+        compile_model(model, best_t, X_scored.head(1000)).save(compiled_model_path(new_version))
+    except TypeError as e:
+        print(f"Model v{new_version} cannot be compiled: {e}")
 
     with open(CURRENT_VERSION_FILE, 'w') as f:
         f.write(str(new_version))
@@ -73,4 +82,6 @@ def retrain():
             print(f"Error notifying API to reload model: {e}")
 
 if __name__ == "__main__":
-    retrain()
+    parser = argparse.ArgumentParser(description="Retrain the fraud model when drift or new feedback warrants it")
+    parser.add_argument("--force", action="store_true", help="retrain even if no drift is detected")
+    retrain(force=parser.parse_args().force)
@@ -0,0 +1,57 @@
+import os
+import shutil
+import uvicorn
+
+API_HOST = os.getenv("API_HOST", "0.0.0.0")
+API_PORT = int(os.getenv("API_PORT", "8000"))
+API_WORKERS = int(os.getenv("API_WORKERS", "1"))
+MULTIPROC_DIR = os.getenv("PROMETHEUS_MULTIPROC_DIR", "/tmp/prometheus_multiproc")
+MIGRATE_ON_START = os.getenv("MIGRATE_ON_START", "1") == "1"
+
+def prepare_multiprocess_metrics(path=MULTIPROC_DIR):
+    # Metric files left by a previous run would be summed into the new one
+    shutil.rmtree(path, ignore_errors=True)
+    os.makedirs(path)
+    os.environ["PROMETHEUS_MULTIPROC_DIR"] = path
+
+def prepare_database():
+    # Once, before forking: workers importing the API concurrently would race to create the same tables
+    from src.migrations import migrate
+    migrate()
+
+def prepare_shared_model():
+    """
+    With COMPILED_MODEL_ENABLED=1, compile the current model once, before
+    the workers start, so they all memory-map the same node arrays. The
+    pickle's forests cannot be shared: each worker serving it holds its
+    own copy.
+    """
+    os.environ.setdefault("MODEL_MMAP_MODE", "r")
+    # Workers only see a new version through the version file
+    os.environ.setdefault("MODEL_FOLLOW_INTERVAL", "5")
+    if os.getenv("COMPILED_MODEL_ENABLED", "0") != "1":
+        print(f"Each of the {API_WORKERS} workers loads its own copy of the model; "
+              "set COMPILED_MODEL_ENABLED=1 to share one memory-mapped copy")
+        return
+    # Imported here: model_store reads MODEL_MMAP_MODE at import time
+    from src.compiled_model import export_model, read_verify_rows
+    from src.model_store import compiled_model_path, get_current_version
+    version = get_current_version()
+    if version is None or os.path.exists(compiled_model_path(version)):
+        return
+    try:
+        export_model(version, read_verify_rows())
+    except Exception as e:
+        print(f"Model v{version} cannot be compiled, workers will load the pickle: {e}")
+
+if __name__ == "__main__":
+    if API_WORKERS > 1:
+        prepare_multiprocess_metrics()
+    # After the metrics directory exists: src.db creates pool metrics on import
+    if MIGRATE_ON_START:
+        prepare_database()
+    if API_WORKERS > 1:
+        prepare_shared_model()
+        print("Incident feed (/ws/incidents, /broadcast_incident) is disabled with several workers; "
+              "run a separate API with API_WORKERS=1 for it")
+    uvicorn.run("src.api_service_advanced:app", host=API_HOST, port=API_PORT, workers=API_WORKERS)
@@ -0,0 +1,111 @@
+import json
+import os
+import pandas as pd
+import pyarrow.parquet as pq
+from sqlalchemy import func, select
+
+from src.db import SessionLocal, Feedback
+
+DATA_DIR = os.getenv("DATA_DIR", "data")
+X_BASE = os.path.join(DATA_DIR, "X_train_bal_adv.csv")
+Y_BASE = os.path.join(DATA_DIR, "y_train_bal_adv.csv")
+CACHE_DIR = os.path.join(DATA_DIR, "training_cache")
+MANIFEST_FILE = os.path.join(CACHE_DIR, "_manifest.json")
+CHUNK_SIZE = int(os.getenv("TRAINING_CHUNK_SIZE", "100000"))
+LABEL = "Class"
+
+def _read_manifest():
+    try:
+        with open(MANIFEST_FILE) as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return None
+
+def _write_manifest(manifest):
+    # Write-then-rename so a crash never leaves a half-written watermark
+    tmp = MANIFEST_FILE + ".tmp"
+    with open(tmp, "w") as f:
+        json.dump(manifest, f)
+    os.replace(tmp, MANIFEST_FILE)
+
+def _align(X: pd.DataFrame, columns):
+    # Every part shares one float64 schema so parts can be read as one dataset
+    return X.reindex(columns=columns).apply(pd.to_numeric, errors="coerce").astype("float64")
+
+def _write_part(name, X, y):
+    part = X.assign(**{LABEL: y.astype("int64").to_numpy()})
+    path = os.path.join(CACHE_DIR, name)
+    part.to_parquet(path, index=False)
+    return name
+
+def _base_signature():
+    return [os.path.getsize(X_BASE), os.path.getmtime(X_BASE), os.path.getsize(Y_BASE), os.path.getmtime(Y_BASE)]
+
+def iter_base_chunks(chunksize=CHUNK_SIZE):
+    x_reader = pd.read_csv(X_BASE, chunksize=chunksize)
+    y_reader = pd.read_csv(Y_BASE, chunksize=chunksize)
+    for X, y in zip(x_reader, y_reader):
+        yield X, y[LABEL]
+
+def iter_feedback_chunks(since_id=0, chunksize=CHUNK_SIZE):
+    """
+    Yield (last_id, X, y) for feedback rows with id > since_id. yield_per
+    streams through a server-side cursor, so only one chunk of rows is held
+    in memory and no ORM objects are built.
+    """
+    stmt = (
+        select(Feedback.id, Feedback.features, Feedback.true_label)
+        .where(Feedback.id > since_id)
+        .order_by(Feedback.id)
+        .execution_options(yield_per=chunksize)
+    )
+    with SessionLocal() as db:
+        for rows in db.execute(stmt).partitions():
+            X = pd.DataFrame([row.features for row in rows])
+            y = pd.Series([row.true_label for row in rows])
+            yield rows[-1].id, X, y
+
+def feedback_watermark():
+    # Highest feedback id in the cached training set
+    return (_read_manifest() or {}).get("feedback_watermark", 0)
+
+def count_feedback_since(since_id=0):
+    with SessionLocal() as db:
+        return db.execute(select(func.count()).select_from(Feedback).where(Feedback.id > since_id)).scalar()
+
+def update_cache(chunksize=CHUNK_SIZE):
+    """
+    Bring the Parquet training cache up to date and return the number of
+    feedback rows added. The base CSV is only converted again when it
+    changes; feedback is appended as new parts after the stored watermark.
+    """
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    manifest = _read_manifest()
+    signature = _base_signature()
+    if manifest is None or manifest["base_signature"] != signature:
+        for name in (manifest or {}).get("base_parts", []) + (manifest or {}).get("feedback_parts", []):
+            if os.path.exists(os.path.join(CACHE_DIR, name)):
+                os.remove(os.path.join(CACHE_DIR, name))
+        manifest = {"base_signature": signature, "columns": None, "base_parts": [],
+                    "feedback_parts": [], "feedback_watermark": 0}
+        for i, (X, y) in enumerate(iter_base_chunks(chunksize)):
+            if manifest["columns"] is None:
+                manifest["columns"] = list(X.columns)
+            manifest["base_parts"].append(_write_part(f"base-{i:05d}.parquet", _align(X, manifest["columns"]), y))
+        _write_manifest(manifest)
+
+    added = 0
+    for last_id, X, y in iter_feedback_chunks(manifest["feedback_watermark"], chunksize):
+        name = _write_part(f"feedback-{last_id:012d}.parquet", _align(X, manifest["columns"]), y)
+        manifest["feedback_parts"].append(name)
+        manifest["feedback_watermark"] = last_id
+        _write_manifest(manifest)
+        added += len(y)
+    return added
+
+def load_training_set():
+    manifest = _read_manifest()
+    parts = [os.path.join(CACHE_DIR, name) for name in manifest["base_parts"] + manifest["feedback_parts"]]
+    df = pq.ParquetDataset(parts).read().to_pandas()
+    y = df.pop(LABEL)
+    return df, y
@@ -0,0 +1,9 @@
+import os
+import tempfile
+
+# src modules read their settings at import time, so these must be set before any test imports them
+_TMP = tempfile.mkdtemp(prefix="fraud-tests-")
+os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(_TMP, 'test.db')}"
+os.environ["DATA_DIR"] = os.path.join(_TMP, "data")
+os.environ["MODEL_DIR"] = os.path.join(_TMP, "models")
+os.environ["API_TOKEN"] = "test-token"
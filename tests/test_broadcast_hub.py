@@ -0,0 +1,120 @@
+import asyncio
+import json
+
+from prometheus_client import REGISTRY
+
+from src.broadcast_hub import BroadcastHub
+from src.incident_poller import ID_FIELDS, apply_diff
+
+N_CLIENTS = 400
+N_MESSAGES = 50
+
+class FakeSocket:
+    """An accepted WebSocket recording what it is sent; a slow one blocks in send_text until `released`."""
+
+    def __init__(self, slow=False):
+        self.received = []
+        self.released = asyncio.Event()
+        if not slow:
+            self.released.set()
+        self.closed = asyncio.Event()
+
+    async def send_text(self, data):
+        await self.released.wait()
+        self.received.append(json.loads(data))
+
+    async def receive(self):
+        await self.closed.wait()
+        return {"type": "websocket.disconnect"}
+
+    async def close(self):
+        self.closed.set()
+
+def diff(i):
+    return {"type": "incident_diff", "pagerduty": {
+        "added": [{"id": f"P{i}", "title": f"incident {i}", "status": "triggered"}],
+        "updated": [], "resolved": [f"P{i - 5}"] if i >= 5 else []}}
+
+def replay(messages):
+    # What the dashboard rebuilds from the messages it received
+    incidents = {source: {} for source in ID_FIELDS}
+    for msg in messages:
+        if msg["type"] == "incident_snapshot":
+            incidents = {source: {} for source in ID_FIELDS}
+        for source, id_field in ID_FIELDS.items():
+            if source in msg:
+                apply_diff(incidents[source], msg[source], id_field)
+    return incidents
+
+def slow_consumers(channel, action):
+    return REGISTRY.get_sample_value("ws_slow_consumers_total", {"channel": channel, "action": action}) or 0
+
+async def fan_out(hub, slow_count=1):
+    fast = [FakeSocket() for _ in range(N_CLIENTS)]
+    slow = [FakeSocket(slow=True) for _ in range(slow_count)]
+    serving = [asyncio.create_task(hub.serve(ws)) for ws in fast + slow]
+    await asyncio.sleep(0)
+    for i in range(N_MESSAGES):
+        hub.publish(diff(i))
+        # Let the writers run between messages, as the event loop does between POSTs
+        await asyncio.sleep(0)
+
+    async def all_delivered():
+        while any(len(ws.received) < N_MESSAGES + 1 for ws in fast):
+            await asyncio.sleep(0.01)
+
+    # The slow clients are still blocked here: they must not hold the others back
+    await asyncio.wait_for(all_delivered(), 10)
+    return fast, slow, serving
+
+def test_every_client_gets_the_same_diffs_in_order_and_a_slow_one_is_resynced():
+    async def run():
+        hub = BroadcastHub("test-resync", max_queue=10, slow_policy="resync")
+        before = slow_consumers("test-resync", "resync")
+        fast, slow, serving = await fan_out(hub)
+        first = fast[0].received
+        assert first[0] == {"type": "incident_snapshot", "pagerduty": {"added": []}, "servicenow": {"added": []}}
+        assert first[1:] == [diff(i) for i in range(N_MESSAGES)]
+        assert all(ws.received == first for ws in fast)
+        assert slow_consumers("test-resync", "resync") > before
+        assert len(hub) == N_CLIENTS + 1
+
+        # Once it catches up, the slow client holds the same incidents from far fewer messages
+        slow[0].released.set()
+        while len(slow[0].received) < 2 or slow[0].received[-1] != diff(N_MESSAGES - 1):
+            await asyncio.sleep(0.01)
+        assert len(slow[0].received) < N_MESSAGES
+        assert replay(slow[0].received) == replay(first) == hub.incidents
+        await hub.close()
+        await asyncio.gather(*serving)
+
+    asyncio.run(run())
+
+def test_slow_client_is_disconnected_without_stalling_the_others():
+    async def run():
+        hub = BroadcastHub("test-disconnect", max_queue=10, slow_policy="disconnect")
+        fast, slow, serving = await fan_out(hub)
+        assert all(ws.received == fast[0].received for ws in fast)
+        assert len(fast[0].received) == N_MESSAGES + 1
+        assert slow[0].closed.is_set()
+        assert len(hub) == N_CLIENTS
+        await hub.close()
+        await asyncio.gather(*serving)
+
+    asyncio.run(run())
+
+def test_stuck_send_is_disconnected_by_the_watchdog():
+    async def run():
+        hub = BroadcastHub("test-stuck", max_queue=1000, send_timeout=0.2)
+        # The queue never fills, so only the watchdog can notice the stuck client
+        fast, slow, serving = await fan_out(hub)
+        await asyncio.sleep(0.5)
+        assert slow[0].closed.is_set()
+        assert len(hub) == N_CLIENTS
+        hub.publish(diff(N_MESSAGES))
+        while any(len(ws.received) < N_MESSAGES + 2 for ws in fast):
+            await asyncio.sleep(0.01)
+        await hub.close()
+        await asyncio.gather(*serving)
+
+    asyncio.run(run())
@@ -0,0 +1,82 @@
+import numpy as np
+import pandas as pd
+import pytest
+from sklearn.ensemble import RandomForestClassifier, StackingClassifier
+from sklearn.linear_model import LogisticRegression
+from xgboost import XGBClassifier
+
+from src import compiled_model
+from src.compiled_model import (CALIBRATION_BATCH_SIZES, UNCALIBRATED_MAX_ROWS, VERIFY_TOLERANCE, CompiledStackedModel,
+                                compile_model)
+
+@pytest.fixture(scope="module")
+def stacked():
+    rng = np.random.default_rng(0)
+    X = pd.DataFrame(rng.normal(size=(600, 5)), columns=[f"f{i}" for i in range(5)])
+    y = ((X["f0"] + X["f1"] * X["f3"]) > 0.3).astype(int)
+    model = StackingClassifier(
+        estimators=[("rf", RandomForestClassifier(n_estimators=10, random_state=0)),
+                    ("xgb", XGBClassifier(n_estimators=10, max_depth=4))],
+        final_estimator=LogisticRegression(max_iter=1000), passthrough=True,
+    ).fit(X, y)
+    return model, X
+
+def test_traversal_matches_source_model(stacked):
+    model, X = stacked
+    compiled = CompiledStackedModel.from_model(model)
+    for rows in (X.iloc[:1], X, X.to_dict(orient="records")):
+        diff = np.abs(compiled.predict_proba(rows)[:, 1] - model.predict_proba(pd.DataFrame(rows))[:, 1]).max()
+        assert diff < VERIFY_TOLERANCE
+
+def test_batches_over_max_rows_go_to_fallback(stacked):
+    model, X = stacked
+    calls = []
+
+    class Spy:
+        def predict_proba(self, frame):
+            calls.append(frame)
+            return model.predict_proba(frame)
+
+    compiled = CompiledStackedModel.from_model(model).set_fallback(Spy(), max_rows=50)
+    records = X.to_dict(orient="records")
+    compiled.predict_proba(records[:50])
+    assert calls == []
+    probs = compiled.predict_proba(records[:51])
+    assert len(calls) == 1 and list(calls[0].columns) == list(X.columns)
+    np.testing.assert_allclose(probs, model.predict_proba(X.iloc[:51]))
+
+def test_zero_max_rows_disables_fallback(stacked):
+    model, X = stacked
+    compiled = CompiledStackedModel.from_model(model).set_fallback(model, max_rows=0)
+    assert compiled.fallback is None
+    assert compiled.predict_proba(X).shape == (len(X), 2)
+
+def test_fallback_loader_runs_on_first_large_batch_only(stacked):
+    model, X = stacked
+    loads = []
+
+    def loader():
+        loads.append(1)
+        return model
+
+    compiled = CompiledStackedModel.from_model(model).set_fallback(max_rows=50, loader=loader)
+    compiled.predict_proba(X.iloc[:50])
+    assert loads == []
+    np.testing.assert_allclose(compiled.predict_proba(X.iloc[:51]), model.predict_proba(X.iloc[:51]))
+    compiled.predict_proba(X.iloc[:60])
+    assert loads == [1]
+
+def test_calibrated_max_rows_is_saved_and_served(stacked, tmp_path, monkeypatch):
+    model, X = stacked
+    compiled = compile_model(model, 0.5, X)
+    assert compiled.calibrated_max_rows == 1 or compiled.calibrated_max_rows in CALIBRATION_BATCH_SIZES
+    compiled.save(str(tmp_path / "m"))
+    loaded = CompiledStackedModel.load(str(tmp_path / "m"))
+    assert loaded.calibrated_max_rows == compiled.calibrated_max_rows
+    assert loaded.set_fallback(model).max_rows == compiled.calibrated_max_rows
+    monkeypatch.setattr(compiled_model, "COMPILED_MODEL_MAX_ROWS", 0)
+    assert loaded.set_fallback(model).fallback is None
+
+def test_uncalibrated_model_uses_default_cutoff(stacked):
+    model, _ = stacked
+    assert compile_model(model, 0.5).set_fallback(model).max_rows == UNCALIBRATED_MAX_ROWS
@@ -0,0 +1,21 @@
+from sqlalchemy import create_engine
+
+from src.db import POOL_OVERFLOW, InstrumentedQueuePool
+
+def _overflow(name):
+    return POOL_OVERFLOW.labels(pool=name)._value.get()
+
+def test_overflow_gauge_drops_when_connections_return(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'pool.db'}", poolclass=InstrumentedQueuePool,
+                           pool_size=2, max_overflow=3, pool_logging_name="overflow-test")
+    conns = [engine.connect() for _ in range(5)]
+    assert _overflow("overflow-test") == 3
+    # The first two returned fill the pool; after that each returned connection is closed
+    for _ in range(3):
+        conns.pop().close()
+    assert _overflow("overflow-test") == 2
+    for conn in conns:
+        conn.close()
+    assert _overflow("overflow-test") == 0
+    engine.dispose()
+    assert _overflow("overflow-test") == 0
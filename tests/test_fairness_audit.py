@@ -0,0 +1,47 @@
+from datetime import datetime, timedelta
+
+import numpy as np
+import pytest
+from sqlalchemy import delete
+
+from src.db import SessionLocal, AuditWatermark, FairnessRollup, PredictionLog
+from src.fairness_audit import FAIRNESS_SETTLE_SECONDS, fairness_gaps, full_scan_gaps, update_rollups
+from src.migrations import migrate
+
+def predictions(n, seed, age):
+    rng = np.random.default_rng(seed)
+    at = datetime.utcnow() - age
+    return [PredictionLog(features={"Gender": str(rng.choice(["F", "M"])), "Region": str(rng.choice(["N", "S", "E"]))},
+                          predicted_label=int(rng.random() < 0.3), predicted_prob=0.5,
+                          prediction_time=at - timedelta(days=int(rng.integers(0, 3))))
+            for _ in range(n)]
+
+@pytest.fixture
+def db():
+    migrate()
+    with SessionLocal() as session:
+        for table in (PredictionLog, FairnessRollup, AuditWatermark):
+            session.execute(delete(table))
+        session.commit()
+        yield session
+
+def assert_rollup_matches_full_scan(db):
+    rollup = dict(fairness_gaps(db))
+    full = dict(full_scan_gaps(db))
+    assert rollup.keys() == full.keys() == {"Gender", "Region"}
+    for attr, gap in full.items():
+        assert rollup[attr] == pytest.approx(gap)
+
+def test_incremental_rollup_matches_full_scan(db):
+    settled = timedelta(seconds=FAIRNESS_SETTLE_SECONDS + 60)
+    db.add_all(predictions(200, seed=0, age=settled))
+    db.commit()
+    assert update_rollups(db) == 200
+    assert_rollup_matches_full_scan(db)
+
+    # Rows written after the first run, some backdated as write-behind retries insert them
+    db.add_all(predictions(150, seed=1, age=settled) + predictions(50, seed=2, age=timedelta(days=5)))
+    db.commit()
+    assert update_rollups(db) == 200
+    assert update_rollups(db) == 0
+    assert_rollup_matches_full_scan(db)
@@ -0,0 +1,58 @@
+import numpy as np
+import pytest
+from geopy.distance import geodesic
+
+from src.feature_engineering_advanced import haversine_km, vincenty_km
+
+# (lat1, lon1, lat2, lon2): city pairs, metre-scale hops, meridians, the equator and the poles
+PAIRS = [
+    (40.7128, -74.0060, 51.5074, -0.1278),
+    (-33.87, 151.21, 34.05, -118.24),
+    (52.2, 21.0, 52.2001, 21.0001),
+    (60.0, 0.0, 60.0, 0.001),
+    (1.0, 1.0, 1.0, 1.0),
+    (0.0, 0.0, 0.0, 90.0),
+    (0.0, -179.9, 0.0, 179.9),
+    (89.9, 0.0, 89.9, 180.0),
+    (-89.99, 10.0, -89.99, -170.0),
+    (90.0, 0.0, -90.0, 0.0),
+]
+# Antipodal and nearly antipodal: Vincenty's iteration does not converge and haversine is used
+ANTIPODAL = [
+    (45.0, 30.0, -45.0, -150.0),
+    (0.0, 0.0, 0.0, 180.0),
+    (0.0, 0.0, 0.5, 179.7),
+    (10.0, 20.0, -10.0, -160.0),
+]
+HAVERSINE_REL_TOL = 0.006
+VINCENTY_TOL_KM = 1e-6
+
+def geopy_km(pairs):
+    return np.array([geodesic((a, b), (c, d)).km for a, b, c, d in pairs])
+
+def columns(pairs):
+    return np.array(pairs, dtype=float).T
+
+@pytest.mark.parametrize("pairs", [PAIRS, ANTIPODAL])
+def test_haversine_within_tolerance_of_geopy(pairs):
+    np.testing.assert_allclose(haversine_km(*columns(pairs)), geopy_km(pairs), rtol=HAVERSINE_REL_TOL, atol=1e-9)
+
+def test_vincenty_within_a_millimetre_of_geopy():
+    np.testing.assert_allclose(vincenty_km(*columns(PAIRS)), geopy_km(PAIRS), rtol=0, atol=VINCENTY_TOL_KM)
+
+def test_vincenty_random_pairs():
+    rng = np.random.default_rng(0)
+    lat1, lat2 = rng.uniform(-89, 89, (2, 500))
+    lon1, lon2 = rng.uniform(-180, 180, (2, 500))
+    pairs = list(zip(lat1, lon1, lat2, lon2))
+    np.testing.assert_allclose(vincenty_km(lat1, lon1, lat2, lon2), geopy_km(pairs), rtol=0, atol=VINCENTY_TOL_KM)
+
+def test_vincenty_falls_back_to_haversine_near_antipodes():
+    lat1, lon1, lat2, lon2 = columns(ANTIPODAL)
+    np.testing.assert_allclose(vincenty_km(lat1, lon1, lat2, lon2), haversine_km(lat1, lon1, lat2, lon2))
+    np.testing.assert_allclose(vincenty_km(lat1, lon1, lat2, lon2), geopy_km(ANTIPODAL), rtol=HAVERSINE_REL_TOL)
+
+def test_scalars_match_columns():
+    lat1, lon1, lat2, lon2 = PAIRS[0]
+    assert vincenty_km(lat1, lon1, lat2, lon2) == pytest.approx(vincenty_km(*columns(PAIRS))[0])
+    assert haversine_km(lat1, lon1, lat2, lon2) == pytest.approx(haversine_km(*columns(PAIRS))[0])
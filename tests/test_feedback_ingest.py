@@ -0,0 +1,53 @@
+import asyncio
+import json
+
+from src.feedback_ingest import ingest_feedback
+
+def _ingest(body, fmt):
+    async def chunks():
+        yield body if isinstance(body, bytes) else body.encode()
+    inserted = []
+    report = asyncio.run(ingest_feedback(chunks(), fmt, chunk_size=2, insert=inserted.extend))
+    return report, inserted
+
+def test_bad_labels_are_rejected_per_row():
+    items = [
+        {"features": {"Amount": 1.0}, "analyst_label": 1},
+        {"features": {"Amount": 2.0}, "analyst_label": 1e999},
+        {"features": {"Amount": 3.0}, "analyst_label": "inf"},
+        {"features": {"Amount": 4.0}, "analyst_label": "-Infinity"},
+        {"features": {"Amount": 5.0}, "analyst_label": "nan"},
+        {"features": {"Amount": 6.0}, "analyst_label": 2},
+        {"features": {"Amount": 7.0}, "analyst_label": "0"},
+        {"features": {"Amount": 8.0}, "analyst_label": 0.7},
+        {"features": {"Amount": 9.0}, "analyst_label": 1.9},
+        {"features": {"Amount": 10.0}, "analyst_label": True},
+        {"features": {"Amount": 11.0}, "analyst_label": None},
+        {"features": {"Amount": 12.0}, "analyst_label": 1.0},
+    ]
+    # json.dumps writes 1e999 as the non-standard Infinity, which json.loads accepts
+    body = "\n".join(json.dumps(item) for item in items) + "\nnot json\n"
+    report, inserted = _ingest(body, "ndjson")
+    assert report["accepted"] == 3
+    assert [row["true_label"] for row in inserted] == [1, 0, 1]
+    assert [error["line"] for error in report["errors"]] == [2, 3, 4, 5, 6, 8, 9, 10, 11, 13]
+    assert all("analyst_label must be 0 or 1" in e["error"] for e in report["errors"][:-1])
+
+def test_csv_label_must_be_exactly_0_or_1():
+    body = "Amount,analyst_label\n1.5,1\n2.5,1e999\n3.5,inf\n4.5,0\n5.5,0.7\n6.5,true\n7.5,1.0\n"
+    report, inserted = _ingest(body, "csv")
+    assert report["accepted"] == 3
+    assert report["rejected"] == 4
+    assert [row["features"]["Amount"] for row in inserted] == [1.5, 4.5, 7.5]
+
+def test_invalid_utf8_rejects_only_that_line():
+    good = json.dumps({"features": {"Amount": 1.0}, "analyst_label": 1}).encode()
+    body = b"\n".join([good, good, b'{"features": {"Merchant": "caf\xe9"}, "analyst_label": 0}', good])
+    report, inserted = _ingest(body, "ndjson")
+    assert report["accepted"] == 3 and len(inserted) == 3
+    assert report["errors"][0]["line"] == 3 and "invalid UTF-8" in report["errors"][0]["error"]
+
+    csv_body = b"Merchant,analyst_label\nshop,1\ncaf\xe9,0\nbar,0\n"
+    report, inserted = _ingest(csv_body, "csv")
+    assert [row["features"]["Merchant"] for row in inserted] == ["shop", "bar"]
+    assert [error["line"] for error in report["errors"]] == [3]
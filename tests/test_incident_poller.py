@@ -0,0 +1,184 @@
+import asyncio
+import hashlib
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import httpx
+import pytest
+
+from src.broadcast_hub import BroadcastHub
+from src.incident_poller import IncidentSource, poll_and_push, poll_once
+
+class FakeServer(ThreadingHTTPServer):
+    """
+    Serves `incidents` under `result_key` on GET, with ETags, and records
+    POSTed JSON bodies, answering them with `post_statuses` in turn.
+    """
+
+    def __init__(self, result_key=None):
+        super().__init__(("127.0.0.1", 0), FakeHandler)
+        self.result_key = result_key
+        self.incidents = []
+        self.gets = 0
+        self.post_statuses = []
+        self.posted = []
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server_port}"
+
+class FakeHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        self.server.gets += 1
+        body = json.dumps({self.server.result_key: self.server.incidents}).encode()
+        etag = f'"{hashlib.md5(body).hexdigest()}"'
+        if self.headers.get("If-None-Match") == etag:
+            self._reply(304)
+        else:
+            self._reply(200, body, etag)
+
+    def do_POST(self):
+        # Recorded even when failing: the API may apply a message and still fail to answer
+        self.server.posted.append(json.loads(self.rfile.read(int(self.headers["Content-Length"]))))
+        status = self.server.post_statuses.pop(0) if self.server.post_statuses else 200
+        self._reply(status, b"{}")
+
+    def _reply(self, status, body=b"", etag=None):
+        self.send_response(status)
+        if etag:
+            self.send_header("ETag", etag)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+@pytest.fixture
+def servers():
+    started = {name: FakeServer(key) for name, key in
+               (("pagerduty", "incidents"), ("servicenow", "result"), ("api", None))}
+    for server in started.values():
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield started
+    for server in started.values():
+        server.shutdown()
+        server.server_close()
+
+def make_sources(servers):
+    return [
+        IncidentSource("pagerduty", f"{servers['pagerduty'].url}/incidents", "id", "incidents",
+                       params={"statuses[]": "triggered"}),
+        IncidentSource("servicenow", f"{servers['servicenow'].url}/api/now/table/incident", "sys_id", "result",
+                       auth=("user", "pass")),
+    ]
+
+def pd(n, status="triggered"):
+    return {"id": f"P{n}", "title": f"incident {n}", "status": status}
+
+def sn(n):
+    return {"sys_id": f"S{n}", "short_description": f"ticket {n}", "state": "1"}
+
+async def hub_state(messages):
+    # What a hub that received `messages` holds, in the shape of the sources
+    hub = BroadcastHub("test-poller")
+    for msg in messages:
+        hub.publish(msg)
+    return hub.incidents
+
+def test_diffs_snapshots_and_conditional_requests(servers):
+    async def run():
+        sources = make_sources(servers)
+        api = servers["api"]
+        servers["pagerduty"].incidents = [pd(1), pd(2)]
+        servers["servicenow"].incidents = [sn(1)]
+        async with httpx.AsyncClient(timeout=5) as client:
+            first = await poll_once(client, sources, api.url, snapshot=True)
+            assert first["type"] == "incident_snapshot"
+            assert [inc["id"] for inc in first["pagerduty"]["added"]] == ["P1", "P2"]
+
+            # Unchanged sources answer 304 and nothing is pushed
+            assert await poll_once(client, sources, api.url) is None
+
+            servers["pagerduty"].incidents = [pd(2, "acknowledged"), pd(3)]
+            diff = await poll_once(client, sources, api.url)
+            assert diff == {"type": "incident_diff", "pagerduty": {
+                "added": [pd(3)], "updated": [pd(2, "acknowledged")], "resolved": ["P1"]}}
+
+            # A snapshot still goes out when nothing changed, built from the committed state
+            again = await poll_once(client, sources, api.url, snapshot=True)
+            assert again["servicenow"] == {"added": [sn(1)]}
+        assert api.posted == [first, diff, again]
+        assert await hub_state(api.posted) == {"pagerduty": {"P2": pd(2, "acknowledged"), "P3": pd(3)},
+                                               "servicenow": {"S1": sn(1)}}
+
+    asyncio.run(run())
+
+def test_failed_push_is_not_committed(servers):
+    async def run():
+        sources = make_sources(servers)
+        api = servers["api"]
+        servers["pagerduty"].incidents = [pd(1)]
+        api.post_statuses = [500]
+        async with httpx.AsyncClient(timeout=5) as client:
+            with pytest.raises(httpx.HTTPStatusError):
+                await poll_once(client, sources, api.url)
+            assert sources[0].incidents == {} and sources[0].etag is None
+            retried = await poll_once(client, sources, api.url)
+        assert retried["pagerduty"]["added"] == [pd(1)]
+
+    asyncio.run(run())
+
+def test_poller_resyncs_hub_after_push_failure_and_periodically(servers):
+    api = servers["api"]
+
+    async def run_until(count, snapshot_every):
+        task = asyncio.create_task(poll_and_push(make_sources(servers), api.url, interval=0.01,
+                                                 snapshot_every=snapshot_every))
+        while len(api.posted) < count:
+            await asyncio.sleep(0.01)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    async def run():
+        servers["pagerduty"].incidents = [pd(1)]
+        servers["servicenow"].incidents = [sn(1)]
+        # The resolve of P1 is applied by the API but its response is lost
+        api.post_statuses = [200, 500]
+
+        async def change_then_wait():
+            while len(api.posted) < 1:
+                await asyncio.sleep(0.01)
+            servers["pagerduty"].incidents = [pd(2)]
+
+        changer = asyncio.create_task(change_then_wait())
+        await run_until(3, snapshot_every=1000)
+        await changer
+        kinds = [msg["type"] for msg in api.posted]
+        # Startup snapshot, the diff whose push failed, then a snapshot instead of a repeated diff
+        assert kinds == ["incident_snapshot", "incident_diff", "incident_snapshot"]
+        assert api.posted[2]["pagerduty"] == {"added": [pd(2)]}
+
+        # A hub that lost the diff (e.g. a restarted API) is repaired by the next snapshot
+        lost = [api.posted[0], api.posted[2]]
+        assert await hub_state(lost) == await hub_state(api.posted)
+
+        # Without changes, only the periodic snapshot is pushed, every 5 polls
+        api.posted.clear()
+        await run_until(2, snapshot_every=5)
+        assert [msg["type"] for msg in api.posted] == ["incident_snapshot", "incident_snapshot"]
+        assert servers["pagerduty"].gets >= 5
+
+    asyncio.run(run())
+
+def test_hub_snapshot_replaces_state():
+    async def run():
+        hub = BroadcastHub("test-snapshot")
+        hub.publish({"type": "incident_diff", "pagerduty": {"added": [pd(1), pd(2)]}, "servicenow": {"added": [sn(1)]}})
+        hub.publish({"type": "incident_snapshot", "pagerduty": {"added": [pd(2)]}})
+        assert hub.incidents == {"pagerduty": {"P2": pd(2)}, "servicenow": {}}
+        assert json.loads(hub.snapshot())["pagerduty"] == {"added": [pd(2)]}
+
+    asyncio.run(run())
@@ -0,0 +1,162 @@
+from collections import namedtuple
+
+import numpy as np
+import pandas as pd
+import pytest
+from kafka import TopicPartition
+from kafka.errors import KafkaTimeoutError
+from sqlalchemy import delete, func, select
+
+from src.db import engine, PredictionLog, StreamOffset
+from src.feature_engineering_advanced import AnomalyScoreTransformer
+from src.migrations import migrate
+from src.kafka_stream_scoring import StreamScorer
+
+Record = namedtuple("Record", "topic partition offset key value")
+
+class InMemoryBroker:
+    """Partitions of the input topic, produced output and committed offsets per group."""
+
+    def __init__(self, topic, partitions):
+        self.topic = topic
+        self.partitions = partitions
+        self.produced = []
+        self.committed = {}
+
+    def consumer(self, group="fraud_scoring"):
+        return FakeConsumer(self, group)
+
+class FakeConsumer:
+    def __init__(self, broker, group):
+        self.broker = broker
+        self.group = group
+        self.positions = {TopicPartition(broker.topic, p): broker.committed.get((group, p), 0)
+                          for p in range(len(broker.partitions))}
+        self.commits = 0
+
+    def poll(self, timeout_ms=0, max_records=None):
+        records = {}
+        for tp, position in self.positions.items():
+            values = self.broker.partitions[tp.partition][position:position + (max_records or 10**9)]
+            if values:
+                records[tp] = [Record(tp.topic, tp.partition, position + i, None, value) for i, value in enumerate(values)]
+                self.positions[tp] = position + len(values)
+        return records
+
+    def seek(self, tp, offset):
+        self.positions[tp] = offset
+
+    def commit(self):
+        self.commits += 1
+        for tp, position in self.positions.items():
+            self.broker.committed[(self.group, tp.partition)] = position
+
+class FakeFuture:
+    def __init__(self, error=None):
+        self.error = error
+
+    def get(self, timeout=None):
+        if self.error is not None:
+            raise self.error
+        return None
+
+class FakeProducer:
+    def __init__(self, broker, fail=False):
+        self.broker = broker
+        self.fail = fail
+
+    def send(self, topic, key=None, value=None):
+        if self.fail:
+            return FakeFuture(KafkaTimeoutError("broker unavailable"))
+        self.broker.produced.append((topic, value))
+        return FakeFuture()
+
+    def flush(self, timeout=None):
+        pass
+
+class AmountModel:
+    def predict_proba(self, X):
+        p = np.clip(X["Amount"].to_numpy(dtype=float) / 1000, 0, 1)
+        return np.column_stack([1 - p, p])
+
+def make_scorer(consumer, producer):
+    scorer = StreamScorer(consumer, producer, output_topic="fraud_scores")
+    scorer.model, scorer.threshold, scorer.version = AmountModel(), 0.5, 1
+    return scorer
+
+def logged_rows():
+    with engine.connect() as conn:
+        return conn.execute(select(func.count()).select_from(PredictionLog)).scalar()
+
+@pytest.fixture
+def broker():
+    migrate()
+    with engine.begin() as conn:
+        conn.execute(delete(PredictionLog))
+        conn.execute(delete(StreamOffset))
+    return InMemoryBroker("transactions", [
+        [{"Amount": 10.0}, {"Amount": 900.0}, "not json"],
+        [{"Amount": 700.0}, {"Amount": 20.0}],
+    ])
+
+def test_batch_is_logged_produced_and_committed(broker):
+    consumer = broker.consumer()
+    scorer = make_scorer(consumer, FakeProducer(broker))
+    assert scorer.process_batch(consumer.poll()) == 5
+    assert logged_rows() == 4
+    assert len(broker.produced) == 4
+    assert broker.committed == {("fraud_scoring", 0): 3, ("fraud_scoring", 1): 2}
+
+def test_send_failure_skips_commit_and_batch_is_consumed_again(broker):
+    consumer = broker.consumer()
+    producer = FakeProducer(broker, fail=True)
+    scorer = make_scorer(consumer, producer)
+    assert scorer.process_batch(consumer.poll()) == 0
+    assert consumer.commits == 0
+    assert broker.committed == {}
+    assert logged_rows() == 0
+
+    producer.fail = False
+    assert scorer.process_batch(consumer.poll()) == 5
+    assert broker.committed == {("fraud_scoring", 0): 3, ("fraud_scoring", 1): 2}
+    assert logged_rows() == 4
+
+def test_crash_between_write_and_commit_writes_no_duplicates(broker):
+    consumer = broker.consumer()
+
+    def crash():
+        raise RuntimeError("killed before commit")
+
+    consumer.commit = crash
+    with pytest.raises(RuntimeError):
+        make_scorer(consumer, FakeProducer(broker)).process_batch(consumer.poll())
+    assert logged_rows() == 4
+    assert broker.committed == {}
+
+    # A restarted consumer resumes from the last committed offsets and gets the same batch
+    restarted = broker.consumer()
+    assert make_scorer(restarted, FakeProducer(broker)).process_batch(restarted.poll()) == 5
+    assert logged_rows() == 4
+    assert broker.committed == {("fraud_scoring", 0): 3, ("fraud_scoring", 1): 2}
+
+    # New records after the redelivered ones are still logged
+    broker.partitions[1].append({"Amount": 50.0})
+    assert make_scorer(restarted, FakeProducer(broker)).process_batch(restarted.poll()) == 1
+    assert logged_rows() == 5
+
+def test_model_scores_with_the_persisted_anomaly_detector(broker):
+    frames = []
+
+    class RecordingModel(AmountModel):
+        def predict_proba(self, X):
+            frames.append(X)
+            return super().predict_proba(X)
+
+    consumer = broker.consumer()
+    scorer = make_scorer(consumer, FakeProducer(broker))
+    scorer.model = RecordingModel()
+    scorer.anomaly_detector = AnomalyScoreTransformer().fit(pd.DataFrame({"Amount": [10.0, 20.0, 30.0, 900.0]}))
+    assert scorer.process_batch(consumer.poll()) == 5
+    assert "IsoAnomalyScore" in frames[0].columns
+    # The transaction itself is logged and produced, not the model input
+    assert "IsoAnomalyScore" not in broker.produced[0][1]["transaction"]
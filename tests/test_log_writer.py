@@ -0,0 +1,58 @@
+import pytest
+from sqlalchemy import Column, Integer, MetaData, String, Table, create_engine, func, select
+from sqlalchemy.exc import OperationalError
+
+from src.log_writer import WriteBehindWriter
+
+class FlakyBind:
+    """Engine whose first `failures` transactions fail like a lost connection."""
+
+    def __init__(self, engine, failures):
+        self.engine = engine
+        self.failures = failures
+        self.attempts = 0
+
+    def begin(self):
+        self.attempts += 1
+        if self.attempts <= self.failures:
+            raise OperationalError("INSERT", {}, Exception("server closed the connection unexpectedly"))
+        return self.engine.begin()
+
+@pytest.fixture
+def table(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'writer.db'}")
+    table = Table("labels", MetaData(), Column("id", Integer, primary_key=True),
+                  Column("label", String, nullable=False))
+    table.metadata.create_all(engine)
+    table.engine = engine
+    return table
+
+def count(table):
+    with table.engine.connect() as conn:
+        return conn.execute(select(func.count()).select_from(table)).scalar()
+
+def test_unlimited_retries_write_every_row_once_database_is_back(table):
+    bind = FlakyBind(table.engine, failures=4)
+    writer = WriteBehindWriter(table, batch_size=10, flush_interval=0.01, bind=bind,
+                               max_retries=None, retry_backoff=0.001)
+    writer.put_many([{"label": str(i)} for i in range(10)])
+    writer.close(timeout=10)
+    assert bind.attempts == 5
+    assert count(table) == 10
+
+def test_rows_dropped_only_after_retries_run_out(table):
+    bind = FlakyBind(table.engine, failures=3)
+    writer = WriteBehindWriter(table, batch_size=5, flush_interval=0.01, bind=bind,
+                               max_retries=2, retry_backoff=0.001)
+    writer.put_many([{"label": "lost"}] * 5)
+    writer.close(timeout=10)
+    assert bind.attempts == 3
+    assert count(table) == 0
+
+def test_bad_row_is_rejected_without_losing_its_batch(table):
+    writer = WriteBehindWriter(table, batch_size=3, flush_interval=0.01, bind=table.engine,
+                               max_retries=None, retry_backoff=0.001)
+    writer.put_many([{"label": "a"}, {"label": None}, {"label": "c"}])
+    writer.close(timeout=10)
+    with table.engine.connect() as conn:
+        assert sorted(conn.execute(select(table.c.label)).scalars()) == ["a", "c"]
@@ -0,0 +1,65 @@
+import threading
+from concurrent.futures import TimeoutError as FutureTimeout
+
+import pytest
+
+from src.micro_batcher import MicroBatcher
+
+def test_batches_concurrent_items():
+    calls = []
+
+    def score(items):
+        calls.append(list(items))
+        return [item * 2 for item in items]
+
+    batcher = MicroBatcher(score, max_batch_size=8, max_wait_ms=50)
+    futures = [batcher.submit(i) for i in range(8)]
+    assert [f.result(5) for f in futures] == [i * 2 for i in range(8)]
+    assert calls == [list(range(8))]
+    batcher.close()
+
+def test_short_result_list_fails_every_item():
+    batcher = MicroBatcher(lambda items: items[:-1], max_batch_size=4, max_wait_ms=50)
+    futures = [batcher.submit(i) for i in range(4)]
+    for fut in futures:
+        with pytest.raises(ValueError, match="results for 1 items"):
+            fut.result(5)
+    batcher.close()
+
+def test_bad_item_only_fails_itself():
+    def score(items):
+        if "bad" in items:
+            raise ValueError("bad item")
+        return items
+
+    batcher = MicroBatcher(score, max_batch_size=3, max_wait_ms=50)
+    futures = [batcher.submit(item) for item in ("a", "bad", "c")]
+    assert futures[0].result(5) == "a"
+    assert futures[2].result(5) == "c"
+    with pytest.raises(ValueError):
+        futures[1].result(5)
+    batcher.close()
+
+def test_score_times_out_and_skips_cancelled_item():
+    release = threading.Event()
+    scored = []
+
+    def score(items):
+        release.wait(5)
+        scored.extend(items)
+        return items
+
+    batcher = MicroBatcher(score, max_batch_size=1, max_wait_ms=0, timeout=0.1)
+    blocker = batcher.submit("first")
+    with pytest.raises(FutureTimeout):
+        batcher.score("late")
+    release.set()
+    assert blocker.result(5) == "first"
+    batcher.close()
+    assert scored == ["first"]
+
+def test_close_fails_items_queued_after_stop():
+    batcher = MicroBatcher(lambda items: items)
+    batcher.close()
+    with pytest.raises(RuntimeError, match="closed"):
+        batcher.submit("after").result(5)
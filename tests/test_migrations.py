@@ -0,0 +1,97 @@
+import os
+import subprocess
+import sys
+
+import pytest
+from sqlalchemy import create_engine, inspect, text
+
+from src import migrations
+from src.db import Base, PredictionLog
+from src.migrations import check_schema, migrate, pending_migrations
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def test_check_schema_fails_until_migrated(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'fresh.db'}")
+    with pytest.raises(RuntimeError, match="python -m src.migrations"):
+        check_schema(engine)
+    migrate(engine)
+    check_schema(engine)
+    assert pending_migrations(engine) == []
+
+def test_concurrent_migrate_on_fresh_database(tmp_path):
+    # Like uvicorn workers or several replicas starting against an empty database
+    url = f"sqlite:///{tmp_path / 'race.db'}"
+    env = dict(os.environ, DATABASE_URL=url)
+    procs = [
+        subprocess.Popen([sys.executable, "-c", "from src.migrations import migrate; migrate()"],
+                         cwd=ROOT, env=env, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+        for _ in range(4)
+    ]
+    outputs = [proc.communicate(timeout=120) for proc in procs]
+    assert [proc.returncode for proc in procs] == [0] * 4, [err for _, err in outputs]
+    # Each migration was applied by exactly one process
+    applied = [line for out, _ in outputs for line in out.splitlines() if line.startswith("Applied migration")]
+    assert sorted(applied) == ["Applied migration 0001_prediction_model_columns",
+                               "Applied migration 0002_time_indexes"]
+    engine = create_engine(url)
+    assert inspect(engine).has_table("prediction_log")
+    assert pending_migrations(engine) == []
+
+class RecordingConnection:
+    """Stands in for a Postgres connection: records statements and answers the migration's catalog queries."""
+
+    def __init__(self, answers):
+        self.answers = answers
+        self.sql = []
+
+    def execute(self, statement, params=None):
+        sql = " ".join(str(statement).split())
+        self.sql.append(sql)
+        return RecordedResult(next((v for k, v in self.answers.items() if k in sql), None))
+
+class RecordedResult:
+    def __init__(self, value):
+        self.value = value
+
+    def first(self):
+        return self.value
+
+    def scalar(self):
+        return self.value
+
+    def __iter__(self):
+        return iter([])
+
+def test_partitioning_makes_the_legacy_table_attachable(monkeypatch):
+    monkeypatch.setattr(migrations, "add_time_indexes", lambda conn: None)
+    conn = RecordingConnection({"FROM pg_constraint": "prediction_log_pkey"})
+    migrations.partition_prediction_log(conn)
+    attach = next(i for i, sql in enumerate(conn.sql) if "ATTACH PARTITION prediction_log_legacy" in sql)
+    prepare = next(i for i, sql in enumerate(conn.sql) if sql.startswith("ALTER TABLE prediction_log_legacy "))
+    assert prepare < attach
+    # Postgres refuses a partition without the parent's NOT NULLs, or with a conflicting primary key
+    assert conn.sql[prepare] == ('ALTER TABLE prediction_log_legacy ALTER COLUMN prediction_time SET NOT NULL, '
+                                 'DROP CONSTRAINT "prediction_log_pkey", ADD PRIMARY KEY (id, prediction_time)')
+
+@pytest.mark.skipif(not os.getenv("POSTGRES_TEST_URL"), reason="set POSTGRES_TEST_URL to a throwaway Postgres database")
+def test_partition_existing_postgres_table(monkeypatch):
+    engine = create_engine(os.environ["POSTGRES_TEST_URL"])
+    with engine.begin() as conn:
+        conn.execute(text("DROP TABLE IF EXISTS prediction_log, prediction_log_legacy, schema_migrations CASCADE"))
+    Base.metadata.drop_all(engine)
+    # An existing deployment: migrated and holding rows, one without a timestamp, before partitioning is turned on
+    monkeypatch.setattr(migrations, "PARTITION_PREDICTION_LOG", False)
+    migrate(engine)
+    with engine.begin() as conn:
+        conn.execute(PredictionLog.__table__.insert(), [
+            {"features": {"Gender": "F"}, "predicted_prob": 0.1, "predicted_label": 0},
+            {"features": {"Gender": "M"}, "predicted_prob": 0.9, "predicted_label": 1, "prediction_time": None},
+        ])
+    monkeypatch.setattr(migrations, "PARTITION_PREDICTION_LOG", True)
+    migrate(engine)
+    migrate(engine)
+    with engine.begin() as conn:
+        assert migrations.is_partitioned(conn)
+        conn.execute(PredictionLog.__table__.insert(), [{"features": {}, "predicted_prob": 0.5, "predicted_label": 0}])
+        assert conn.execute(text("SELECT count(*) FROM prediction_log")).scalar() == 3
@@ -0,0 +1,100 @@
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+from prometheus_client import REGISTRY
+
+from src import notify
+from src.notify import AlertDispatcher
+
+class WebhookServer(ThreadingHTTPServer):
+    """Local webhook endpoint recording (arrival time, JSON body) and answering with `statuses` in turn."""
+
+    def __init__(self, statuses=()):
+        super().__init__(("127.0.0.1", 0), WebhookHandler)
+        self.statuses = list(statuses)
+        self.received = []
+        self.attempts = 0
+
+class WebhookHandler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        self.server.attempts += 1
+        status = self.server.statuses.pop(0) if self.server.statuses else 200
+        if status == 200:
+            self.server.received.append((time.monotonic(), body))
+        self.send_response(status)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+@pytest.fixture
+def webhook(monkeypatch):
+    def start(statuses=()):
+        server = WebhookServer(statuses)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        servers.append(server)
+        monkeypatch.setattr(notify, "SLACK_WEBHOOK_URL", f"http://127.0.0.1:{server.server_port}/hook")
+        return server
+
+    servers = []
+    yield start
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+def slack_dispatcher(**kwargs):
+    return AlertDispatcher(senders={"slack": notify._post_slack}, **kwargs)
+
+def sample(name):
+    return REGISTRY.get_sample_value(name, {"channel": "slack"}) or 0
+
+def test_rate_limit_spaces_sends_after_burst(webhook):
+    server = webhook()
+    dispatcher = slack_dispatcher(rate_per_min=600, burst=2)
+    start = time.monotonic()
+    for i in range(6):
+        assert dispatcher.dispatch("slack", f"alert {i}")
+    dispatcher.close(timeout=10)
+    times = [t for t, _ in server.received]
+    assert [body["text"] for _, body in server.received] == [f"alert {i}" for i in range(6)]
+    # Two sends from the burst, then one every 0.1 s
+    assert times[1] - start < 0.1
+    assert times[-1] - start >= 0.35
+
+def test_alerts_with_same_key_are_coalesced_into_summary(webhook):
+    server = webhook()
+    coalesced = sample("alerts_coalesced_total")
+    dispatcher = slack_dispatcher(coalesce_window=0.3)
+    for i in range(5):
+        dispatcher.dispatch("slack", f"spike {i}", coalesce_key="fraud_spike", summary="{count} more spikes")
+    time.sleep(0.8)
+    dispatcher.dispatch("slack", "spike after window", coalesce_key="fraud_spike", summary="{count} more spikes")
+    dispatcher.close(timeout=10)
+    assert [body["text"] for _, body in server.received] == ["spike 0", "4 more spikes", "spike after window"]
+    assert sample("alerts_coalesced_total") - coalesced == 4
+
+def test_failed_send_is_retried_until_it_succeeds(webhook):
+    server = webhook(statuses=[500, 503])
+    sent, failed = sample("alerts_sent_total"), sample("alerts_failed_total")
+    dispatcher = slack_dispatcher(max_retries=3, backoff_base=0.01)
+    dispatcher.dispatch("slack", "retry me")
+    dispatcher.close(timeout=10)
+    assert server.attempts == 3
+    assert [body["text"] for _, body in server.received] == ["retry me"]
+    assert sample("alerts_sent_total") - sent == 1
+    assert sample("alerts_failed_total") == failed
+
+def test_send_fails_after_retries_run_out(webhook):
+    server = webhook(statuses=[500] * 10)
+    failed = sample("alerts_failed_total")
+    dispatcher = slack_dispatcher(max_retries=2, backoff_base=0.01)
+    dispatcher.dispatch("slack", "never delivered")
+    dispatcher.close(timeout=10)
+    assert server.attempts == 3
+    assert server.received == []
+    assert sample("alerts_failed_total") - failed == 1
@@ -0,0 +1,58 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from src.feature_engineering_advanced import (AnomalyScoreTransformer, OnlineFeatureEngine, add_advanced_features,
+                                              add_anomaly_score, fit_anomaly_detector)
+from src.generate_synthetic_data import generate_transactions
+
+HISTORY = 200
+
+@pytest.fixture(scope="module")
+def transactions():
+    # Few users, so most transactions have earlier ones on the same card
+    X, _ = generate_transactions(n_samples=300, seed=7, n_users=20)
+    return X
+
+@pytest.fixture(scope="module")
+def detector(transactions):
+    return fit_anomaly_detector(transactions, expanding=True)
+
+def assert_same_features(online: pd.DataFrame, batch: pd.DataFrame):
+    assert set(online.columns) == set(batch.columns)
+    for column in batch.columns:
+        np.testing.assert_allclose(online[column].to_numpy(dtype=float), batch[column].to_numpy(dtype=float),
+                                   rtol=1e-9, atol=1e-9, err_msg=column)
+
+def test_cold_stream_matches_expanding_batch(transactions, detector):
+    engine = OnlineFeatureEngine(anomaly_detector=detector)
+    online = engine.transform(transactions.to_dict(orient="records"))
+    batch = add_advanced_features(transactions, expanding=True, anomaly_detector=detector)
+    assert len(engine) == transactions["UserID"].nunique()
+    assert_same_features(online, batch.reset_index(drop=True))
+
+def test_cold_stream_matches_expanding_batch_with_vincenty(transactions, detector):
+    engine = OnlineFeatureEngine(distance="vincenty", anomaly_detector=detector)
+    online = engine.transform(transactions.to_dict(orient="records"))
+    batch = add_advanced_features(transactions, expanding=True, distance="vincenty", anomaly_detector=detector)
+    assert_same_features(online, batch.reset_index(drop=True))
+
+def test_warm_start_from_fit_matches_batch_over_full_history(transactions, detector):
+    history, stream = transactions.iloc[:HISTORY], transactions.iloc[HISTORY:]
+    engine = OnlineFeatureEngine(anomaly_detector=detector).fit(history)
+    online = engine.transform(stream.to_dict(orient="records"))
+    batch = add_advanced_features(transactions, expanding=True, anomaly_detector=detector).iloc[HISTORY:]
+    assert_same_features(online, batch.reset_index(drop=True))
+
+def test_fit_then_stream_equals_streaming_everything(transactions):
+    history, stream = transactions.iloc[:HISTORY], transactions.iloc[HISTORY:]
+    warm = OnlineFeatureEngine().fit(history).transform(stream.to_dict(orient="records"))
+    replayed = OnlineFeatureEngine().transform(transactions.to_dict(orient="records")).iloc[HISTORY:]
+    assert_same_features(warm, replayed.reset_index(drop=True))
+
+def test_anomaly_score_is_the_same_for_records_and_frames(transactions):
+    detector = AnomalyScoreTransformer().fit(transactions)
+    records = add_anomaly_score(transactions.to_dict(orient="records"), detector)
+    frame = add_anomaly_score(transactions, detector)
+    np.testing.assert_allclose([r["IsoAnomalyScore"] for r in records], frame["IsoAnomalyScore"])
+    assert "IsoAnomalyScore" not in transactions.columns
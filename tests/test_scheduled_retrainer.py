@@ -0,0 +1,42 @@
+import os
+
+import pytest
+from sqlalchemy import delete
+
+from src import scheduled_retrainer
+from src.db import SessionLocal, Feedback
+from src.migrations import migrate
+from src.model_store import CURRENT_VERSION_FILE, MODEL_DIR, save_model_metadata
+
+class Retrained(Exception):
+    pass
+
+@pytest.fixture
+def feedback_since_v1(monkeypatch):
+    """Model v1 trained on feedback up to id 5; 8 feedback rows exist."""
+    migrate()
+    with SessionLocal() as db:
+        db.execute(delete(Feedback))
+        db.add_all([Feedback(id=i, features={"Amount": i}, true_label=i % 2) for i in range(1, 9)])
+        db.commit()
+    os.makedirs(MODEL_DIR, exist_ok=True)
+    with open(CURRENT_VERSION_FILE, "w") as f:
+        f.write("1")
+    save_model_metadata(1, {"feedback_watermark": 5})
+    # Tonight's cache update found nothing new: the 3 unseen rows arrived on earlier nights
+    monkeypatch.setattr(scheduled_retrainer, "update_cache", lambda: 0)
+    monkeypatch.setattr(scheduled_retrainer, "detect_drift", lambda version: False)
+
+    def load_training_set():
+        raise Retrained
+
+    monkeypatch.setattr(scheduled_retrainer, "load_training_set", load_training_set)
+
+def test_feedback_accumulated_over_several_runs_triggers_retrain(feedback_since_v1, monkeypatch):
+    monkeypatch.setattr(scheduled_retrainer, "RETRAIN_MIN_NEW_FEEDBACK", 3)
+    with pytest.raises(Retrained):
+        scheduled_retrainer.retrain()
+
+def test_retrain_skipped_below_threshold(feedback_since_v1, monkeypatch):
+    monkeypatch.setattr(scheduled_retrainer, "RETRAIN_MIN_NEW_FEEDBACK", 4)
+    scheduled_retrainer.retrain()